@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+帖子归档与全文检索
+- 每个抓取到的新条目写入 SQLite（标题、摘要、作者、时间、链接），摘要截断保存
+- FTS5 trigram 索引，中英文子串检索都可走索引；不足 3 个字符的词回退为 LIKE
+- 按保存天数与文件大小淘汰旧帖，增量回收空间
+"""
+
+import re
+import html
+import time
+import sqlite3
+import logging
+from collections import namedtuple
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_LIMIT = 500  # 摘要最多保存的字符数
+TRIGRAM_MIN = 3  # trigram 索引可用的最短检索词
+
+ArchivedPost = namedtuple('ArchivedPost', ['key', 'feed', 'title', 'summary', 'author', 'link', 'published'])
+
+_SPACE_RE = re.compile(r'\s+')
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS posts ("
+    "id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, feed TEXT NOT NULL, title TEXT NOT NULL, "
+    "summary TEXT NOT NULL, author TEXT NOT NULL, link TEXT NOT NULL, published INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS posts_published ON posts (published)",
+)
+_FTS_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5("
+    "title, summary, content='posts', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS posts_ai AFTER INSERT ON posts BEGIN "
+    "INSERT INTO posts_fts (rowid, title, summary) VALUES (new.id, new.title, new.summary); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_ad AFTER DELETE ON posts BEGIN "
+    "INSERT INTO posts_fts (posts_fts, rowid, title, summary) VALUES ('delete', old.id, old.title, old.summary); END",
+)
+
+
+def _fts_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+class PostArchive:
+    """帖子归档：单连接 + 锁（与配置库相同的用法），WAL 模式下写入不阻塞读取太久"""
+
+    def __init__(self, path, retention_days=90, max_mb=200, prune_interval=3600):
+        self.path = path
+        self.retention_days = retention_days
+        self.max_mb = max_mb
+        self.prune_interval = prune_interval
+        self.last_prune = 0.0
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # auto_vacuum 只能在建表前设置，已存在的库保持原模式
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for sql in _SCHEMA:
+            self.conn.execute(sql)
+        try:
+            for sql in _FTS_SCHEMA:
+                self.conn.execute(sql)
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            # SQLite 3.34 之前没有 trigram 分词器，检索退化为 LIKE 扫描
+            logger.warning(f"FTS5 trigram 不可用，检索将使用 LIKE 扫描: {e}")
+            self.fts = False
+
+    def add_many(self, posts):
+        """批量写入一轮抓取的新帖（已存在的 key 忽略），返回写入条数"""
+        rows = [(
+            p.key, p.feed, p.title, _SPACE_RE.sub(' ', p.summary).strip()[:SUMMARY_LIMIT],
+            p.author, p.link, int(p.published or time.time()),
+        ) for p in posts]
+        if not rows:
+            return 0
+        with self.lock:
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+                # rowcount 不含全文索引触发器写入的行
+                n = self.conn.executemany(
+                    "INSERT OR IGNORE INTO posts (key, feed, title, summary, author, link, published) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows).rowcount
+                self.conn.execute("COMMIT")
+                return n
+            except Exception as e:
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                logger.error(f"写入归档失败: {e}")
+                return 0
+
+    def search(self, terms, days=None, feed=None, limit=10):
+        """
+        检索同时包含所有词的帖子（不区分大小写），按发布时间倒序
+        返回 (总命中数, [ArchivedPost])
+        """
+        where, params = [], []
+        long_terms = [t for t in terms if len(t) >= TRIGRAM_MIN] if self.fts else []
+        if long_terms:
+            where.append("id IN (SELECT rowid FROM posts_fts WHERE posts_fts MATCH ?)")
+            params.append(" AND ".join(_fts_phrase(t) for t in long_terms))
+        for t in terms:
+            if t in long_terms:
+                continue
+            pattern = _like_pattern(t)
+            where.append("(title LIKE ? ESCAPE '\\' OR summary LIKE ? ESCAPE '\\')")
+            params += [pattern, pattern]
+        if days:
+            where.append("published >= ?")
+            params.append(int(time.time() - days * 86400))
+        if feed:
+            where.append("feed = ?")
+            params.append(feed)
+        cond = " WHERE " + " AND ".join(where) if where else ""
+        with self.lock:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM posts{cond}", params).fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT key, feed, title, summary, author, link, published FROM posts{cond} "
+                f"ORDER BY published DESC LIMIT ?", params + [limit]).fetchall()
+        return total, [ArchivedPost(*r) for r in rows]
+
+    def size_mb(self):
+        """数据占用（不含空闲页与 WAL）"""
+        with self.lock:
+            pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        return (pages - free) * size / 1024 / 1024
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def _delete(self, sql, params):
+        with self.lock:
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+                n = self.conn.execute(sql, params).rowcount
+                self.conn.execute("COMMIT")
+                return n
+            except Exception as e:
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                logger.error(f"清理归档失败: {e}")
+                return 0
+
+    def _compact(self):
+        """合并 FTS 段（删除标记此时才真正移除）并归还空闲页"""
+        with self.lock:
+            if self.fts:
+                self.conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('optimize')")
+            self.conn.execute("PRAGMA incremental_vacuum")
+
+    def prune(self):
+        """按保存天数删除旧帖；超过大小上限时继续按时间从旧到新删除，返回删除条数"""
+        removed = 0
+        if self.retention_days:
+            removed += self._delete("DELETE FROM posts WHERE published < ?",
+                                    (int(time.time() - self.retention_days * 86400),))
+            if removed:
+                self._compact()
+        while self.max_mb and self.size_mb() > self.max_mb:
+            total = self.count()
+            if not total:
+                break
+            # 每次删除最旧的 10%，直到回到上限以内
+            removed += self._delete(
+                "DELETE FROM posts WHERE id IN (SELECT id FROM posts ORDER BY published LIMIT ?)",
+                (max(1, total // 10),))
+            self._compact()
+        if removed:
+            logger.info(f"归档清理: 删除 {removed} 条旧帖")
+        return removed
+
+    def maybe_prune(self):
+        """到达清理间隔时执行一次 prune()"""
+        now = time.monotonic()
+        if now - self.last_prune < self.prune_interval:
+            return 0
+        self.last_prune = now
+        return self.prune()
+
+    def status_text(self):
+        """统计信息（用于 /status）"""
+        return f"帖子归档: {self.count()} 条，{self.size_mb():.1f} MB（保留 {self.retention_days} 天 / {self.max_mb} MB）\n"
+
+
+def format_results(query, total, posts, tz_hours=8):
+    """把检索结果格式化为 Telegram HTML 消息"""
+    if not posts:
+        return f"🔍 未找到包含「{html.escape(query)}」的帖子"
+    lines = [f"<b>🔍 「{html.escape(query)}」共 {total} 条</b>" + (f"（显示最新 {len(posts)} 条）" if total > len(posts) else "")]
+    for p in posts:
+        when = time.strftime('%m-%d %H:%M', time.gmtime(p.published + tz_hours * 3600))
+        lines.append(f"• {when} <a href=\"{html.escape(p.link, quote=True)}\">{html.escape(p.title)}</a>"
+                     f" - {html.escape(p.author)}")
+    return "\n".join(lines)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+新规则回溯匹配
+- 内存中保留最近 N 条已规范化的帖子（环形缓冲）
+- /add 之后只编译新增/修改的规则，立即在缓冲中匹配，命中结果合并为一条消息
+"""
+
+import html
+from collections import namedtuple, deque
+from threading import Lock
+
+from matcher import MatchEngine
+
+# text 为 EntryText；notified 为抓取时已命中的 chat_id 集合（回溯时跳过，避免重复推送）
+RecentEntry = namedtuple('RecentEntry', ['text', 'feed', 'title', 'author', 'pub_date', 'link', 'notified'])
+
+
+class RecentEntries:
+    """最近条目的环形缓冲，超出容量时丢弃最旧的"""
+
+    def __init__(self, capacity=200):
+        self.lock = Lock()
+        self.entries = deque(maxlen=max(1, int(capacity)))
+
+    def add(self, entry):
+        with self.lock:
+            self.entries.append(entry)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.entries)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+
+def backfill(recent, chat_id, user_conf, words):
+    """
+    用 words 对应的规则（沿用用户的屏蔽词与匹配设置）匹配缓冲中的条目
+    返回 (扫描条数, [(RecentEntry, [命中规则词...])])，从新到旧
+    """
+    words = set(words)
+    conf = dict(user_conf)
+    conf['keywords'] = [r for r in user_conf.get('keywords', []) if r['word'] in words]
+    engine = MatchEngine({chat_id: conf})
+    entries = recent.snapshot()
+    hits = []
+    for e in reversed(entries):
+        if chat_id in e.notified:
+            continue
+        for _, matched in engine.match(e.text, feed=e.feed):
+            hits.append((e, matched))
+    return len(entries), hits
+
+
+def format_backfill(scanned, hits, limit=10):
+    """回溯结果合并为一条 Telegram HTML 消息"""
+    lines = [f"<b>⏪ 最近 {scanned} 条帖子中有 {len(hits)} 条命中新规则</b>"]
+    for e, matched in hits[:limit]:
+        lines.append(
+            f"• {html.escape(e.pub_date[5:16]) if e.pub_date else ''} "
+            f"<a href=\"{html.escape(e.link, quote=True)}\">{html.escape(e.title)}</a>"
+            f"（{html.escape(', '.join(matched))}）"
+        )
+    if len(hits) > limit:
+        lines.append(f"……另有 {len(hits) - limit} 条未显示")
+    return "\n".join(lines)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+匹配与推送流水线基准测试：合成订阅源（N 条帖子）与用户配置（U 个用户 × K 条规则），
+经本地 HTTP 服务走完整的 check_rss_feed 流程，推送发往桩发送器（不访问 Telegram）
+
+输出：帖子/秒、命中/秒、单条帖子匹配延迟 p50/p99、推送排空耗时、峰值内存、全量编译与单条规则增量更新耗时
+
+用法:
+    python3 bench/bench_pipeline.py                                  # 默认矩阵
+    python3 bench/bench_pipeline.py --entries 2000 --users 10 100 1000 --rules 20
+    python3 bench/bench_pipeline.py --regex-ratio 0.2 --vocab 5000 --json out.json
+    python3 bench/bench_pipeline.py --baseline old.json              # 与之前的结果对比
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+VOCAB = [
+    "vps", "VPS", "甲骨文", "oracle", "搬瓦工", "bwg", "dmit", "斯巴达", "cn2", "gia", "香港", "日本",
+    "美国", "补货", "优惠", "出", "收", "求", "独服", "机场", "域名", "续费", "年付", "月付", "1C1G",
+    "2C4G", "大盘鸡", "小鸡", "测评", "教程", "闲聊", "Ｈｅｔｚｎｅｒ", "hetzner", "racknerd", "黑五",
+    "claw", "ovh", "Linode", "vultr", "DO", "aws", "azure", "gcp", "Cloudflare", "warp", "ipv6",
+]
+REGEX_PATTERNS = [
+    r"vps\d*", r"(甲骨文|oracle)", r"\d+C\d+G", r"(出|收).{0,4}(vps|独服)", r"^\[.*\]", r"年付\s*\$?\d+",
+    r"(hetzner|ovh)", r"cn2\s*gia",
+]
+
+
+def synth_vocab(extra):
+    """常用词 + extra 个合成词（模拟不同用户关注的商家/型号），词表越大规则越分散"""
+    return VOCAB + [f"kw{n:05d}" for n in range(extra)]
+
+
+def synth_feed(entries, vocab, seed=0):
+    """生成合成帖子 [(id, title, summary, 发布时间)]，时间从新到旧"""
+    rnd = random.Random(seed)
+    now = time.time()
+    items = []
+    for i in range(entries):
+        title = " ".join(rnd.choice(vocab) for _ in range(rnd.randint(3, 9)))
+        summary = " ".join(rnd.choice(vocab) for _ in range(rnd.randint(8, 30)))
+        items.append((1000000 - i, title, summary, now - i * 30))
+    return items
+
+
+def render_rss(items):
+    from email.utils import formatdate
+    from xml.sax.saxutils import escape
+    parts = ['<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>bench</title>']
+    for pid, title, summary, ts in items:
+        parts.append(
+            f"<item><title>{escape(title)}</title><link>https://www.nodeseek.com/post-{pid}-1</link>"
+            f"<description>{escape(summary)}</description><author>bench</author>"
+            f"<pubDate>{formatdate(ts, usegmt=True)}</pubDate></item>"
+        )
+    parts.append("</channel></rss>")
+    return "".join(parts).encode("utf-8")
+
+
+def synth_users(users, rules, regex_ratio, vocab, seed=0):
+    """生成用户配置：规则带随机的必含/排除，部分用户开启正则或完整词匹配"""
+    rnd = random.Random(seed + 1)
+    result = {}
+    for u in range(users):
+        use_regex = rnd.random() < regex_ratio
+        pool = REGEX_PATTERNS + vocab if use_regex else vocab
+        keywords = []
+        for _ in range(rules):
+            keywords.append({
+                "word": rnd.choice(pool),
+                "include": rnd.sample(VOCAB, rnd.choice((0, 0, 1, 2))),
+                "exclude": rnd.sample(VOCAB, rnd.choice((0, 1, 1, 2))),
+            })
+        result[str(100000 + u)] = {
+            "keywords": keywords,
+            "global_exclude": rnd.sample(VOCAB, rnd.choice((0, 1, 2))),
+            "defaults": {"include": [], "exclude": []},
+            "settings": {
+                "match_summary": rnd.random() < 0.5,
+                "full_word_match": not use_regex and rnd.random() < 0.2,
+                "regex_match": use_regex,
+                "digest": False,
+                "digest_window": 60,
+            },
+        }
+    return result
+
+
+class FeedServer:
+    """本地订阅源：始终返回同一份 RSS"""
+
+    def __init__(self, body):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/rss+xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+
+class TimedEngine:
+    """包装 MatchEngine，记录每条帖子的匹配耗时（含规范化）"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.latencies = []
+        self.hits = 0
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def match(self, entry, summary='', feed=None):
+        t0 = time.perf_counter()
+        result = self.engine.match(entry, summary, feed=feed)
+        self.latencies.append(time.perf_counter() - t0)
+        self.hits += sum(len(words) for _, words in result)
+        return result
+
+
+def bench_rule_edits(snap, vocab, seed, edits=20):
+    """单个用户 /add 一条规则时，匹配引擎增量派生新版本的平均耗时"""
+    from events import RuleUpserted
+    rnd = random.Random(seed + 2)
+    users = dict(snap.users)
+    engine = snap.engine
+    total = 0.0
+    for _ in range(edits):
+        chat_id = rnd.choice(list(users))
+        conf = json.loads(json.dumps(users[chat_id]))
+        word = rnd.choice(vocab)
+        conf["keywords"].append({"word": word, "include": [], "exclude": []})
+        users[chat_id] = conf
+        t0 = time.perf_counter()
+        engine = engine.apply([RuleUpserted(chat_id, word)], users)
+        total += time.perf_counter() - t0
+    return total / edits
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run_once(entries, users, rules, regex_ratio, vocab_size, seed):
+    """在当前进程中运行一次完整流水线"""
+    import logging
+    os.environ["TG_BOT_TOKEN"] = "bench"
+    os.environ["STORAGE_BACKEND"] = "json"
+    # 配置、去重记录与日志都写到临时目录，须在 import monitor 之前设置
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="ns-bench-")
+
+    import monitor
+    from dispatcher import NotificationDispatcher, SEND_OK
+    logging.getLogger().setLevel(logging.WARNING)
+    monitor.load_config()
+
+    vocab = synth_vocab(vocab_size)
+    items = synth_feed(entries, vocab, seed)
+    server = FeedServer(render_rss(items))
+    with monitor.config_lock:
+        monitor.global_config["system"]["rss_url"] = server.url
+        monitor.global_config["system"]["processed_capacity"] = entries * 2
+        monitor.global_config["users"] = synth_users(users, rules, regex_ratio, vocab, seed)
+    t0 = time.perf_counter()
+    monitor.save_main_config()
+    compile_s = time.perf_counter() - t0
+    monitor.processed_ids.capacity = entries * 2
+
+    sent = [0]
+    sent_lock = Lock()
+
+    def stub_send(chat_id, text, reply_to):
+        with sent_lock:
+            sent[0] += 1
+        return SEND_OK, None
+
+    edit_s = bench_rule_edits(monitor.config_snapshot, vocab, seed)
+
+    monitor.dispatcher = NotificationDispatcher(stub_send, workers=8, global_rate=1e9,
+                                                chat_interval=0.0, group_per_minute=1e9).start()
+    engine = TimedEngine(monitor.config_snapshot.engine)
+    monitor.config_snapshot = monitor.config_snapshot._replace(engine=engine)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    ok = monitor.check_rss_feed()
+    check_s = time.perf_counter() - t0
+    monitor.dispatcher.drain(timeout=300)
+    total_s = time.perf_counter() - t0
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {
+        "entries": entries,
+        "users": users,
+        "rules": rules,
+        "regex_ratio": regex_ratio,
+        "vocab": vocab_size,
+        "ok": bool(ok),
+        "processed": len(engine.latencies),
+        "compile_s": round(compile_s, 4),
+        "rule_edit_ms": round(edit_s * 1000, 4),
+        "check_s": round(check_s, 4),
+        "drain_s": round(total_s - check_s, 4),
+        "posts_per_s": round(len(engine.latencies) / check_s, 1) if check_s > 0 else None,
+        "matches": engine.hits,
+        "matches_per_s": round(engine.hits / check_s, 1) if check_s > 0 else None,
+        "notifications": sent[0],
+        "match_p50_ms": round(percentile(engine.latencies, 0.5) * 1000, 4) if engine.latencies else None,
+        "match_p99_ms": round(percentile(engine.latencies, 0.99) * 1000, 4) if engine.latencies else None,
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+        "pipeline_rss_growth_mb": round((peak_kb - rss_before) / 1024, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    """与基线结果逐项对比（按 entries/users/rules/regex_ratio 对齐）"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    key = lambda r: (r["entries"], r["users"], r["rules"], r["regex_ratio"], r.get("vocab", 0))
+    old = {key(r): r for r in baseline.get("results", [])}
+    print(f"\n对比基线 {baseline.get('revision') or baseline_path}:")
+    for r in results:
+        b = old.get(key(r))
+        if not b:
+            continue
+        diffs = []
+        for field in ("posts_per_s", "match_p50_ms", "match_p99_ms", "peak_rss_mb"):
+            if b.get(field) and r.get(field) is not None:
+                diffs.append(f"{field} {(r[field] - b[field]) / b[field] * 100:+.1f}%")
+        print(f"  users={r['users']:<5} rules={r['rules']:<3} " + "  ".join(diffs))
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--entries", type=int, default=1000)
+    p.add_argument("--users", type=int, nargs="*", default=[10, 100, 1000])
+    p.add_argument("--rules", type=int, nargs="*", default=[10])
+    p.add_argument("--regex-ratio", type=float, default=0.1, help="开启正则匹配的用户比例")
+    p.add_argument("--vocab", type=int, default=0, help="额外合成词数量（0 时只用常用词，几乎每条规则都会命中）")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--json", help="结果输出到 JSON 文件")
+    p.add_argument("--baseline", help="与之前输出的 JSON 结果对比")
+    p.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.single:
+        print(json.dumps(run_once(args.entries, args.users[0], args.rules[0], args.regex_ratio, args.vocab, args.seed)))
+        return
+
+    # 每种配置在独立子进程中运行，峰值内存互不影响
+    results = []
+    for users in args.users:
+        for rules in args.rules:
+            cmd = [sys.executable, os.path.abspath(__file__), "--single", "--entries", str(args.entries),
+                   "--users", str(users), "--rules", str(rules), "--regex-ratio", str(args.regex_ratio),
+                   "--vocab", str(args.vocab), "--seed", str(args.seed)]
+            out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+            res = json.loads(next(l for l in reversed(out.splitlines()) if l.startswith("{")))
+            results.append(res)
+            print(f"users={users:<5} rules={rules:<3} {res['posts_per_s']} 帖/秒  {res['matches_per_s']} 命中/秒  "
+                  f"p50 {res['match_p50_ms']}ms p99 {res['match_p99_ms']}ms  推送 {res['notifications']} 条 "
+                  f"(排空 {res['drain_s']:.2f}s)  峰值内存 {res['peak_rss_mb']} MB  "
+                  f"编译 {res['compile_s']:.3f}s / 增量 {res['rule_edit_ms']:.2f}ms")
+
+    if args.baseline:
+        compare(results, args.baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"revision": git_revision(), "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
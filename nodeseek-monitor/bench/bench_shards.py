@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+订阅者分片基准测试：合成订阅源与用户配置，经本地 HTTP 服务走完整的 check_rss_feed 流程，
+条目发布给 SHARD_WORKERS 个工作进程匹配，推送发往桩发送器（不访问 Telegram）
+
+输出：各分片数下的匹配完成耗时、推送排空耗时、帖子/秒，以及每个分片的用户数/命中数/完成时间
+分片只能利用多核：分片数超过 CPU 核数时结果会标注 CPU 受限，此时分片越多越慢
+--slow-chat-ms 让一个会话的每次发送变慢，观察其它分片是否受影响
+
+用法:
+    python3 bench/bench_shards.py                                    # 默认 1/2/4 个分片
+    python3 bench/bench_shards.py --shards 1 2 4 8 --entries 2000 --users 5000 --rules 20
+    python3 bench/bench_shards.py --slow-chat-ms 200
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from bench_pipeline import synth_vocab, synth_feed, render_rss, synth_users, FeedServer
+
+SLOW_CHAT = "100000"
+
+
+def wait_shards(pool, entries, timeout):
+    """等待所有分片匹配完 entries 条并排空队列，返回 (匹配完成耗时, 排空耗时, 各分片完成耗时)"""
+    t0 = time.perf_counter()
+    matched_at = None
+    done_at = [None] * pool.shards
+    while time.perf_counter() - t0 < timeout:
+        with pool.lock:
+            stats = list(pool.stats)
+        now = time.perf_counter() - t0
+        if matched_at is None and all(s.get('entries', 0) >= entries for s in stats):
+            matched_at = now
+        for i, s in enumerate(stats):
+            if done_at[i] is None and s.get('entries', 0) >= entries and not s.get('pending'):
+                done_at[i] = now
+        if all(d is not None for d in done_at):
+            break
+        time.sleep(0.02)
+    return matched_at, max(d or timeout for d in done_at), done_at
+
+
+def run_once(shards, entries, users, rules, regex_ratio, vocab_size, slow_chat_ms, seed):
+    """在当前进程中运行一次分片流水线"""
+    import logging
+    os.environ["TG_BOT_TOKEN"] = "bench"
+    os.environ["STORAGE_BACKEND"] = "json"
+    # 配置、去重记录与日志都写到临时目录，须在 import monitor 之前设置
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="ns-bench-")
+
+    import monitor
+    from shard import ShardPool, shard_of
+    from dispatcher import SEND_OK
+    logging.getLogger().setLevel(logging.WARNING)
+    monitor.load_config()
+
+    vocab = synth_vocab(vocab_size)
+    items = synth_feed(entries, vocab, seed)
+    with monitor.config_lock:
+        monitor.global_config["system"]["processed_capacity"] = entries * 2
+        monitor.global_config["users"] = synth_users(users, rules, regex_ratio, vocab, seed)
+    monitor.save_main_config()
+    monitor.processed_ids.capacity = entries * 2
+
+    def stub_send(chat_id, text, reply_to):
+        if slow_chat_ms and chat_id == SLOW_CHAT:
+            time.sleep(slow_chat_ms / 1000)
+        return SEND_OK, None
+
+    # 工作进程由 fork 创建，先于本地订阅源的服务线程启动
+    pool = ShardPool(shards, stub_send, global_rate=1e9, stats_interval=0.05, workers=8,
+                     chat_interval=0.0, group_per_minute=1e9).start()
+    with monitor.snapshot_lock:
+        monitor.shard_pool = pool
+        pool.load_users(dict(monitor.config_snapshot.users))
+
+    server = FeedServer(render_rss(items))
+    with monitor.config_lock:
+        monitor.global_config["system"]["rss_url"] = server.url
+    monitor.save_system_config()
+
+    t0 = time.perf_counter()
+    ok = monitor.check_rss_feed()
+    check_s = time.perf_counter() - t0
+    matched_s, drain_s, done_at = wait_shards(pool, entries, timeout=300)
+    with pool.lock:
+        stats = list(pool.stats)
+    totals = pool.totals()
+    pool.stop(timeout=5)
+
+    return {
+        "shards": shards,
+        "entries": entries,
+        "users": users,
+        "rules": rules,
+        "regex_ratio": regex_ratio,
+        "vocab": vocab_size,
+        "slow_chat_ms": slow_chat_ms,
+        "cpus": os.cpu_count() or 1,
+        "ok": bool(ok),
+        "check_s": round(check_s, 4),
+        "matched_s": round(check_s + (matched_s or 0), 4),
+        "drain_s": round(check_s + drain_s, 4),
+        "posts_per_s": round(entries / (check_s + matched_s), 1) if matched_s else None,
+        "matches": totals.get('matched', 0),
+        "notifications": totals.get('sent', 0),
+        "slow_chat_shard": shard_of(SLOW_CHAT, shards) if slow_chat_ms else None,
+        "per_shard": [
+            {"users": s.get('users', 0), "matched": s.get('matched', 0),
+             "match_s": round(s.get('match_time', 0), 4),
+             "done_s": round(check_s + d, 4) if d is not None else None}
+            for s, d in zip(stats, done_at)
+        ],
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--shards", type=int, nargs="*", default=[1, 2, 4])
+    p.add_argument("--entries", type=int, default=1000)
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--rules", type=int, default=10)
+    p.add_argument("--regex-ratio", type=float, default=0.1, help="开启正则匹配的用户比例")
+    p.add_argument("--vocab", type=int, default=0, help="额外合成词数量（0 时只用常用词，几乎每条规则都会命中）")
+    p.add_argument("--slow-chat-ms", type=float, default=0, help=f"会话 {SLOW_CHAT} 每次发送的额外耗时")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--json", help="结果输出到 JSON 文件")
+    p.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.single:
+        print(json.dumps(run_once(args.shards[0], args.entries, args.users, args.rules, args.regex_ratio,
+                                  args.vocab, args.slow_chat_ms, args.seed)))
+        return
+
+    # 每种分片数在独立子进程中运行
+    cpus = os.cpu_count() or 1
+    print(f"CPU 核数: {cpus}")
+    results = []
+    for shards in args.shards:
+        cmd = [sys.executable, os.path.abspath(__file__), "--single", "--shards", str(shards),
+               "--entries", str(args.entries), "--users", str(args.users), "--rules", str(args.rules),
+               "--regex-ratio", str(args.regex_ratio), "--vocab", str(args.vocab),
+               "--slow-chat-ms", str(args.slow_chat_ms), "--seed", str(args.seed)]
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        res = json.loads(next(l for l in reversed(out.splitlines()) if l.startswith("{")))
+        results.append(res)
+        base = results[0]["posts_per_s"]
+        speedup = f"{res['posts_per_s'] / base:.2f}x" if base and res["posts_per_s"] else "-"
+        bound = "  (CPU 受限：分片数超过核数)" if shards > cpus else ""
+        print(f"shards={shards:<3} {res['posts_per_s']} 帖/秒 ({speedup})  匹配完成 {res['matched_s']:.2f}s  "
+              f"排空 {res['drain_s']:.2f}s  命中 {res['matches']}  推送 {res['notifications']} 条{bound}")
+        for i, s in enumerate(res["per_shard"]):
+            mark = "  ← 慢速会话" if res["slow_chat_shard"] == i else ""
+            print(f"    #{i} 用户 {s['users']:<5} 命中 {s['matched']:<6} 匹配 {s['match_s']:.2f}s  "
+                  f"完成 {s['done_s']}s{mark}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
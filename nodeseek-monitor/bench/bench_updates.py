@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+命令监听基准测试：在本地假 Bot API 上回放 getUpdates 批次，测量全部命令得到回复所需时间
+同时校验并发处理多个会话的命令时没有保存失败（ERROR 日志），且 config.json（STORAGE_BACKEND=json）
+与内存中的配置一致；否则退出码为 1
+
+用法:
+    python3 bench/bench_updates.py                       # 合成数据，对比 1/2/4/8 个工作线程
+    python3 bench/bench_updates.py --updates rec.json    # 回放录制的批次（getUpdates 的 result 列表组成的数组）
+    python3 bench/bench_updates.py --workers 4 --latency 0.08 --json out.json
+    python3 bench/bench_updates.py --mix writes --workers 8 --latency 0   # 只发修改配置的命令，检查并发写入
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+
+MIXES = {
+    "default": ["/list", "/status", "/blocklist", "/add vps{n} +出", "/del vps{n}", "/setsummary on", "/help"],
+    "writes": ["/add vps{n} +出", "/add kw{n}", "/block spam{n}", "/setsummary on", "/setsummary off"],
+}
+
+
+def synth_batches(chats, per_chat, batch_size, seed=0, mix="default"):
+    """生成合成的更新批次：多个会话混合发送 /add /list /status 等命令"""
+    rnd = random.Random(seed)
+    cmds = MIXES[mix]
+    updates = []
+    uid = 1
+    for n in range(per_chat):
+        for c in range(chats):
+            text = rnd.choice(cmds).format(n=n)
+            updates.append({
+                "update_id": uid,
+                "message": {"message_id": uid, "chat": {"id": 10000 + c}, "text": text},
+            })
+            uid += 1
+    return [updates[i:i + batch_size] for i in range(0, len(updates), batch_size)]
+
+
+class FakeBotAPI:
+    """最小化的 Bot API 模拟：按顺序下发批次，sendMessage 带固定延迟"""
+
+    def __init__(self, batches, latency):
+        self.batches = list(batches)
+        self.latency = latency
+        self.lock = Lock()
+        self.sent = 0
+        self.first_poll = None
+        self.last_send = None
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                self._handle()
+
+            def _handle(self):
+                method = urlparse(self.path).path.rsplit("/", 1)[-1]
+                if method == "getUpdates":
+                    self._reply({"ok": True, "result": api.next_batch()})
+                elif method == "sendMessage":
+                    time.sleep(api.latency)
+                    with api.lock:
+                        api.sent += 1
+                        api.last_send = time.perf_counter()
+                    self._reply({"ok": True, "result": {}})
+                else:
+                    self._reply({"ok": True, "result": True})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def next_batch(self):
+        with self.lock:
+            if self.first_poll is None:
+                self.first_poll = time.perf_counter()
+            if self.batches:
+                return self.batches.pop(0)
+        time.sleep(0.2)  # 模拟长轮询空闲
+        return []
+
+
+class ErrorCounter:
+    """统计 ERROR 及以上级别的日志（保存配置失败等）"""
+
+    def __init__(self):
+        import logging
+        self.count = 0
+        counter = self
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                counter.count += 1
+
+        logging.getLogger().addHandler(Handler(logging.ERROR))
+
+
+def run_once(batches, workers, latency, timeout):
+    """在当前进程中运行一次：启动监听线程，等待所有命令得到回复"""
+    import logging
+    os.environ["TG_BOT_TOKEN"] = "bench"
+    os.environ["TG_UPDATE_WORKERS"] = str(workers)
+    os.environ["STORAGE_BACKEND"] = "json"
+    # 配置、去重记录与日志都写到临时目录，须在 import monitor 之前设置
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="ns-bench-")
+
+    import monitor
+    import tg_api
+    logging.getLogger().setLevel(logging.WARNING)
+    errors = ErrorCounter()
+    monitor.load_config()
+
+    expected = sum(len(b) for b in batches)
+    api = FakeBotAPI(batches, latency)
+    tg_api.API_BASE = api.base
+    Thread(target=monitor.telegram_command_listener, daemon=True).start()
+
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        with api.lock:
+            if api.sent >= expected:
+                break
+        time.sleep(0.01)
+    elapsed = (api.last_send or time.perf_counter()) - (api.first_poll or time.perf_counter())
+    # 回复在保存配置之后发送，全部回复后磁盘上的配置应与内存一致
+    monitor.get_update_pool().join()
+    with monitor.config_lock:
+        expected_users = json.loads(json.dumps(monitor.global_config["users"]))
+    with open(monitor.CONFIG_FILE, "r", encoding="utf-8") as f:
+        persisted_users = json.load(f).get("users", {})
+    # 只执行过只读命令的会话使用内存中的默认配置，不写入磁盘
+    default_user = monitor.get_default_user_config()
+    for chat_id, conf in list(expected_users.items()):
+        if chat_id not in persisted_users and conf == default_user:
+            del expected_users[chat_id]
+    return {
+        "workers": workers,
+        "updates": expected,
+        "replies": api.sent,
+        "latency_ms": latency * 1000,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(api.sent / elapsed, 1) if elapsed > 0 else None,
+        "completed": api.sent >= expected,
+        "errors": errors.count,
+        "persisted": persisted_users == expected_users,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--updates", help="录制的更新批次 JSON 文件")
+    p.add_argument("--chats", type=int, default=50)
+    p.add_argument("--per-chat", type=int, default=4)
+    p.add_argument("--batch-size", type=int, default=100)
+    p.add_argument("--mix", choices=sorted(MIXES), default="default", help="合成命令的组成")
+    p.add_argument("--latency", type=float, default=0.05, help="假 API 的 sendMessage 延迟（秒）")
+    p.add_argument("--workers", type=int, nargs="*", default=[1, 2, 4, 8])
+    p.add_argument("--timeout", type=float, default=120)
+    p.add_argument("--json", help="结果输出到 JSON 文件")
+    p.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.updates:
+        with open(args.updates, "r", encoding="utf-8") as f:
+            batches = json.load(f)
+    else:
+        batches = synth_batches(args.chats, args.per_chat, args.batch_size, mix=args.mix)
+
+    if args.single:
+        print(json.dumps(run_once(batches, args.workers[0], args.latency, args.timeout)))
+        return
+
+    # 每种配置在独立子进程中运行，避免监听线程互相干扰
+    results = []
+    for w in args.workers:
+        cmd = [sys.executable, os.path.abspath(__file__), "--single", "--workers", str(w),
+               "--latency", str(args.latency), "--timeout", str(args.timeout),
+               "--chats", str(args.chats), "--per-chat", str(args.per_chat), "--batch-size", str(args.batch_size),
+               "--mix", args.mix]
+        if args.updates:
+            cmd += ["--updates", args.updates]
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        res = json.loads(next(l for l in reversed(out.splitlines()) if l.startswith("{")))
+        results.append(res)
+        print(f"workers={w:<3} {res['replies']}/{res['updates']} 回复  {res['elapsed_s']:.2f}s  {res['updates_per_s']} 条/秒  "
+              f"配置落盘{'一致' if res['persisted'] else '不一致'}  错误日志 {res['errors']} 条")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if not all(r["completed"] and r["persisted"] and not r["errors"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
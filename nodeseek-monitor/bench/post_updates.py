@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+把录制的更新 POST 到本地 webhook 服务，用于本地测试 webhook 模式
+
+用法:
+    TG_WEBHOOK_LISTEN=127.0.0.1:8443 TG_WEBHOOK_SECRET=s3cret python3 monitor.py
+    python3 bench/post_updates.py rec.json --url http://127.0.0.1:8443/ --secret s3cret
+
+rec.json 可以是单个 update、update 列表，或 getUpdates 批次列表（与 bench_updates.py 相同格式）
+"""
+
+import sys
+import json
+import time
+import argparse
+import urllib.request
+
+
+def iter_updates(data):
+    if isinstance(data, dict):
+        yield data
+        return
+    for item in data:
+        yield from iter_updates(item)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("file")
+    p.add_argument("--url", default="http://127.0.0.1:8443/")
+    p.add_argument("--secret", default="")
+    args = p.parse_args()
+
+    with open(args.file, "r", encoding="utf-8") as f:
+        updates = list(iter_updates(json.load(f)))
+
+    latencies = []
+    for update in updates:
+        req = urllib.request.Request(args.url, data=json.dumps(update).encode(), method="POST",
+                                     headers={"Content-Type": "application/json",
+                                              "X-Telegram-Bot-Api-Secret-Token": args.secret})
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=10) as resp:
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        latencies.append(time.perf_counter() - t0)
+        if status != 200:
+            print(f"update {update.get('update_id')}: HTTP {status}", file=sys.stderr)
+
+    if latencies:
+        latencies.sort()
+        print(f"已发送 {len(updates)} 条更新，应答延迟 p50 {latencies[len(latencies) // 2] * 1000:.1f}ms "
+              f"max {latencies[-1] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
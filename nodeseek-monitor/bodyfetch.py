@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+帖子正文抓取（深度匹配）
+- 有界并发：固定大小线程池 + keep-alive 连接池会话
+- 按域名限速：同一域名两次请求之间至少间隔 1/rate 秒
+- 正文提取为纯文本后按帖子ID缓存（LRU 淘汰），失败不缓存
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from threading import Lock
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from feed import RSS_HEADERS
+
+logger = logging.getLogger(__name__)
+
+BODY_LIMIT = 20000  # 正文最多保留的字符数
+_SKIP_TAGS = frozenset({'script', 'style', 'noscript', 'template', 'svg', 'head', 'nav', 'header', 'footer'})
+_VOID_TAGS = frozenset({'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                        'source', 'track', 'wbr'})
+_CONTENT_CLASS = 'post-content'  # NodeSeek 帖子正文容器
+
+
+class _TextExtractor(HTMLParser):
+    """提取可见文本；存在正文容器（class 含 post-content）时只取第一个容器"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.skip = 0
+        self.stack = []  # 已打开的标签，用于判断正文容器何时闭合
+        self.content_depth = None
+        self.content_done = False
+        self.all_text = []
+        self.content_text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_TAGS:
+            return
+        self.stack.append(tag)
+        if tag in _SKIP_TAGS:
+            self.skip += 1
+        if self.content_depth is None and not self.content_done:
+            classes = (dict(attrs).get('class') or '').split()
+            if _CONTENT_CLASS in classes:
+                self.content_depth = len(self.stack)
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+        while self.stack:
+            open_tag = self.stack.pop()
+            if open_tag in _SKIP_TAGS:
+                self.skip -= 1
+            if self.content_depth is not None and len(self.stack) < self.content_depth:
+                self.content_depth = None
+                self.content_done = True
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.skip or not data.strip():
+            return
+        self.all_text.append(data)
+        if self.content_depth is not None:
+            self.content_text.append(data)
+
+
+def extract_text(page):
+    """HTML 页面 -> 正文纯文本"""
+    parser = _TextExtractor()
+    try:
+        parser.feed(page)
+        parser.close()
+    except Exception as e:
+        logger.debug(f"解析帖子页面失败: {e}")
+    parts = parser.content_text or parser.all_text
+    return " ".join(" ".join(p.split()) for p in parts)[:BODY_LIMIT]
+
+
+class BodyFetcher:
+    """
+    帖子正文抓取器
+    fetch_many() 并发抓取一批帖子，整体不超过 timeout 秒；超时或失败的帖子返回空正文
+    """
+
+    def __init__(self, workers=4, host_rate=2.0, cache_size=2000, timeout=15):
+        self.workers = max(1, int(workers))
+        self.min_gap = 1.0 / host_rate if host_rate > 0 else 0.0
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.cache = OrderedDict()  # 帖子ID -> 正文
+        self.lock = Lock()
+        self.host_next = {}  # 域名 -> 下次允许请求的时间
+        self.host_lock = Lock()
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="body")
+        self.session = requests.Session()
+        self.session.headers.update(RSS_HEADERS)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.workers, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # 统计
+        self.requests = 0
+        self.failures = 0
+        self.cache_hits = 0
+        self.fetch_time = 0.0
+
+    def _cached(self, key):
+        with self.lock:
+            body = self.cache.get(key)
+            if body is not None:
+                self.cache.move_to_end(key)
+                self.cache_hits += 1
+            return body
+
+    def _store(self, key, body):
+        with self.lock:
+            self.cache[key] = body
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _wait_turn(self, host):
+        """预约该域名的下一个请求时间片并等待到达"""
+        with self.host_lock:
+            now = time.monotonic()
+            at = max(now, self.host_next.get(host, 0.0))
+            self.host_next[host] = at + self.min_gap
+        if at > now:
+            time.sleep(at - now)
+
+    def _fetch(self, key, link, deadline):
+        host = urlparse(link).hostname or ''
+        self._wait_turn(host)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return ""
+        t0 = time.perf_counter()
+        try:
+            resp = self.session.get(link, timeout=min(remaining, self.timeout))
+            self.requests += 1
+            if resp.status_code != 200:
+                self.failures += 1
+                logger.debug(f"抓取正文失败 {link}: HTTP {resp.status_code}")
+                return ""
+            body = extract_text(resp.text)
+        except Exception as e:
+            self.failures += 1
+            logger.debug(f"抓取正文失败 {link}: {e}")
+            return ""
+        finally:
+            self.fetch_time += time.perf_counter() - t0
+        self._store(key, body)
+        return body
+
+    def fetch_many(self, items):
+        """items 为 [(帖子ID, 链接)]，返回 {帖子ID: 正文}"""
+        result = {}
+        todo = []
+        for key, link in items:
+            body = self._cached(key)
+            if body is None:
+                todo.append((key, link))
+            else:
+                result[key] = body
+        if not todo:
+            return result
+        deadline = time.monotonic() + self.timeout
+        futures = {self.pool.submit(self._fetch, key, link, deadline): key for key, link in todo}
+        done, _ = wait(futures, timeout=self.timeout + 1)
+        for fut, key in futures.items():
+            result[key] = fut.result() if fut in done else ""
+        return result
+
+    def status_text(self):
+        """统计信息（用于 /status）"""
+        avg_ms = self.fetch_time / self.requests * 1000 if self.requests else 0
+        return (
+            f"正文抓取: {self.requests} 次（失败 {self.failures}）| 缓存命中 {self.cache_hits} 次 "
+            f"| 缓存 {len(self.cache)}/{self.cache_size} | 平均 {avg_ms:.0f}ms\n"
+        )
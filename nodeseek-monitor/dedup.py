@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+已处理条目去重存储
+- 按插入顺序淘汰（FIFO），容量有界，O(1) 判重
+- 追加写日志：每次只写入新增ID，日志超过容量一定倍数时压缩重写
+"""
+
+import os
+import json
+import logging
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class DedupStore:
+    """有界、按插入顺序淘汰的去重集合，持久化为追加日志（每行一个ID）"""
+
+    def __init__(self, path, capacity=500, compact_factor=4, legacy_path=None):
+        self.path = path
+        self.capacity = max(1, int(capacity))
+        self.compact_factor = compact_factor
+        self.lock = Lock()
+        self.items = OrderedDict()
+        self.pending = []
+        self.log_lines = 0
+        self._load(legacy_path)
+
+    def _load(self, legacy_path):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        key = line.rstrip('\n')
+                        if key:
+                            self._add_locked(key)
+                            self.log_lines += 1
+            except Exception as e:
+                logger.error(f"加载 {self.path} 失败: {e}")
+        elif legacy_path and os.path.exists(legacy_path):
+            # 从旧版 processed.json 迁移（旧版为无序集合，顺序无从恢复）
+            try:
+                with open(legacy_path, 'r', encoding='utf-8') as f:
+                    for key in json.load(f):
+                        self._add_locked(str(key))
+                self._compact_locked()
+                logger.info(f"已从 {legacy_path} 迁移 {len(self.items)} 个已处理ID")
+            except Exception as e:
+                logger.error(f"迁移 {legacy_path} 失败: {e}")
+
+    def _add_locked(self, key):
+        if key in self.items:
+            return False
+        self.items[key] = None
+        while len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+        return True
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+    def add(self, key):
+        """加入ID，返回是否为新ID"""
+        with self.lock:
+            if self._add_locked(key):
+                self.pending.append(key)
+                return True
+            return False
+
+    def flush(self):
+        """把新增ID追加写入日志；日志过长时压缩为当前内容"""
+        with self.lock:
+            if not self.pending:
+                return
+            if self.log_lines + len(self.pending) > self.capacity * self.compact_factor:
+                self._compact_locked()
+                return
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(k + '\n' for k in self.pending))
+                self.log_lines += len(self.pending)
+                self.pending = []
+            except Exception as e:
+                logger.error(f"保存 {self.path} 失败: {e}")
+
+    def _compact_locked(self):
+        try:
+            temp = self.path + '.tmp'
+            with open(temp, 'w', encoding='utf-8') as f:
+                f.write(''.join(k + '\n' for k in self.items))
+            os.replace(temp, self.path)
+            self.log_lines = len(self.items)
+            self.pending = []
+        except Exception as e:
+            logger.error(f"压缩 {self.path} 失败: {e}")
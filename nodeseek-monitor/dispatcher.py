@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+通知分发器
+- 独立队列 + 工作线程并发发送，轮询线程只负责入队
+- 令牌桶限速：全局 ~30 条/秒；单聊 1 条/秒；群组额外限制 20 条/分钟
+- 429 / 网络错误按计划时间重试，不阻塞其它会话
+- 同一会话内消息严格按入队顺序发送
+"""
+
+import re
+import time
+import html
+import heapq
+import asyncio
+import logging
+import zlib
+import itertools
+from queue import Queue
+from collections import deque
+from threading import Thread, Condition
+
+logger = logging.getLogger(__name__)
+
+SEND_OK = 'ok'
+SEND_RETRY = 'retry'    # 可重试（429 / 网络错误 / 5xx），附带建议等待秒数
+SEND_FAIL = 'fail'      # 不可重试（400 / 403 等）
+
+
+class TokenBucket:
+    """令牌桶"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.stamp = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.stamp:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def take(self, now):
+        """尝试取一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self, now):
+        """令牌是否已补满"""
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ('chat_id', 'text', 'reply_to', 'on_done', 'attempt')
+
+    def __init__(self, chat_id, text, reply_to, on_done):
+        self.chat_id = chat_id
+        self.text = text
+        self.reply_to = reply_to
+        self.on_done = on_done
+        self.attempt = 0
+
+
+class _ChatState:
+    __slots__ = ('queue', 'next_time', 'scheduled', 'in_flight', 'minute_bucket')
+
+    def __init__(self, is_group, group_per_minute):
+        self.queue = deque()
+        self.next_time = 0.0
+        self.scheduled = False
+        self.in_flight = False
+        self.minute_bucket = TokenBucket(group_per_minute / 60.0, group_per_minute) if is_group else None
+
+
+class NotificationDispatcher:
+    """限速感知的异步通知分发器"""
+
+    def __init__(self, send_once, workers=8, global_rate=30, chat_interval=1.0,
+                 group_per_minute=20, max_retries=3):
+        """
+        send_once(chat_id, text, reply_to) -> (SEND_OK|SEND_RETRY|SEND_FAIL, retry_after)
+        只尝试一次，不得 sleep
+        """
+        self.send_once = send_once
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self.group_per_minute = group_per_minute
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.cond = Condition()
+        self.chats = {}
+        self.ready = []  # 堆: (可发送时间, 序号, chat_id)
+        self.seq = itertools.count()
+        self.threads = []
+        # 统计
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.finished = 0
+
+    def start(self):
+        """启动工作线程"""
+        for i in range(self.workers):
+            t = Thread(target=self._worker, name=f"dispatch-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+        return self
+
+    def submit(self, chat_id, text, reply_to=None, on_done=None):
+        """入队一条消息（非阻塞）；on_done(ok) 在最终成功/失败后回调"""
+        chat_id = str(chat_id)
+        with self.cond:
+            st = self.chats.get(chat_id)
+            if st is None:
+                st = _ChatState(chat_id.startswith('-'), self.group_per_minute)
+                self.chats[chat_id] = st
+            st.queue.append(_Job(chat_id, text, reply_to, on_done))
+            self.queued += 1
+            self._schedule(chat_id, st, time.monotonic())
+
+    def pending(self):
+        """队列中（含发送中）的消息数"""
+        with self.cond:
+            return self.queued
+
+    def drain(self, timeout=None):
+        """等待队列清空，超时返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while self.queued:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining if remaining is not None else 1.0)
+        return True
+
+    def _schedule(self, chat_id, st, now):
+        """会话有待发消息且未在堆中/发送中时，按其下次可发送时间入堆（需持有锁）"""
+        if st.queue and not st.scheduled and not st.in_flight:
+            st.scheduled = True
+            heapq.heappush(self.ready, (max(now, st.next_time), next(self.seq), chat_id))
+            self.cond.notify()
+
+    def _take_ready(self, now):
+        """
+        取出一个现在可以发送的任务（需持有锁）
+        返回 ((st, job), None)；没有可发送的任务时返回 (None, 需等待秒数)，None 表示无限等待
+        """
+        while self.ready:
+            when, _, chat_id = self.ready[0]
+            if when > now:
+                return None, when - now
+            heapq.heappop(self.ready)
+            st = self.chats[chat_id]
+            st.scheduled = False
+            wait = self.global_bucket.take(now)
+            if not wait and st.minute_bucket is not None:
+                wait = st.minute_bucket.take(now)
+                if wait:
+                    self.global_bucket.tokens += 1  # 归还全局令牌
+            if wait:
+                st.scheduled = True
+                heapq.heappush(self.ready, (now + wait, next(self.seq), chat_id))
+                continue
+            st.in_flight = True
+            return (st, st.queue.popleft()), None
+        return None, None
+
+    def _next_job(self):
+        """取出下一个可以发送的任务（需持有锁），没有则等待"""
+        while True:
+            item, wait = self._take_ready(time.monotonic())
+            if item is not None:
+                return item
+            self.cond.wait(wait)
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                st, job = self._next_job()
+            try:
+                status, retry_after = self.send_once(job.chat_id, job.text, job.reply_to)
+            except Exception as e:
+                logger.error(f"发送消息异常: {e}")
+                status, retry_after = SEND_RETRY, None
+            self._finish(st, job, status, retry_after)
+
+    def _finish(self, st, job, status, retry_after):
+        done = None
+        with self.cond:
+            now = time.monotonic()
+            st.in_flight = False
+            st.next_time = now + self.chat_interval
+            if status == SEND_RETRY and job.attempt + 1 < self.max_retries:
+                job.attempt += 1
+                self.retried += 1
+                if retry_after is not None:
+                    self.rate_limited += 1
+                    delay = float(retry_after)
+                else:
+                    delay = 2 ** (job.attempt - 1)  # 指数退避
+                st.queue.appendleft(job)
+                st.next_time = now + delay
+            else:
+                ok = status == SEND_OK
+                if ok:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                self.queued -= 1
+                done = (job.on_done, ok)
+            self._schedule(job.chat_id, st, now)
+            self.finished += 1
+            if self.finished % 1000 == 0:
+                self._prune(now)
+            self.cond.notify_all()
+        if done and done[0]:
+            try:
+                done[0](done[1])
+            except Exception as e:
+                logger.error(f"发送回调异常: {e}")
+
+    def _prune(self, now):
+        """清理已空闲且限速窗口已过期的会话状态，避免订阅者多时字典无限增长（需持有锁）"""
+        for chat_id in [c for c, st in self.chats.items()
+                        if not st.queue and not st.in_flight and not st.scheduled and st.next_time < now
+                        and (st.minute_bucket is None or st.minute_bucket.full(now))]:
+            del self.chats[chat_id]
+
+    def status_text(self):
+        """统计信息（用于 /status）"""
+        with self.cond:
+            return (
+                f"推送队列: {self.queued} 条 | 已发送: {self.sent} | 失败: {self.failed}\n"
+                f"重试: {self.retried} 次 (429: {self.rate_limited})\n"
+            )
+
+
+class AsyncDispatcher(NotificationDispatcher):
+    """
+    事件循环中的分发器：限速/重试/顺序规则与 NotificationDispatcher 相同，发送由协程完成
+    send_once 为协程函数；submit() 可在任意线程调用，drain() 只能在循环之外的线程调用
+    """
+
+    def start(self):
+        """在事件循环中启动发送协程"""
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.tasks = [self.loop.create_task(self._worker_async()) for _ in range(self.workers)]
+        return self
+
+    def _wake(self):
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self.wakeup.set()
+        else:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def _schedule(self, chat_id, st, now):
+        queued = st.scheduled
+        super()._schedule(chat_id, st, now)
+        if st.scheduled and not queued:
+            self._wake()
+
+    async def _worker_async(self):
+        while True:
+            self.wakeup.clear()
+            with self.cond:
+                item, wait = self._take_ready(time.monotonic())
+            if item is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            st, job = item
+            try:
+                status, retry_after = await self.send_once(job.chat_id, job.text, job.reply_to)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"发送消息异常: {e}")
+                status, retry_after = SEND_RETRY, None
+            self._finish(st, job, status, retry_after)
+
+    async def drain_async(self, timeout=None):
+        """在事件循环中等待队列清空，超时返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+
+class KeyedWorkerPool:
+    """按 key 分区的线程池：不同 key 并行处理，同一 key 的任务按提交顺序串行执行"""
+
+    def __init__(self, workers=4, name="worker"):
+        self.queues = [Queue() for _ in range(max(1, workers))]
+        for i, q in enumerate(self.queues):
+            Thread(target=self._run, args=(q,), name=f"{name}-{i}", daemon=True).start()
+
+    def submit(self, key, func, *args):
+        shard = zlib.crc32(str(key).encode()) % len(self.queues)
+        self.queues[shard].put((func, args))
+
+    def pending(self):
+        return sum(q.unfinished_tasks for q in self.queues)
+
+    def join(self):
+        """等待所有已提交任务完成"""
+        for q in self.queues:
+            q.join()
+
+    def _run(self, q):
+        while True:
+            func, args = q.get()
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"任务执行异常: {e}")
+            finally:
+                q.task_done()
+
+
+TG_MESSAGE_LIMIT = 4096
+
+
+_TAG_RE = re.compile(r'<[^>]*>')
+
+
+def _plain_prefix(line, room):
+    """去掉标签后按纯文本截断（重新转义，不会截断实体），结果不超过 room 个字符"""
+    out = []
+    used = 0
+    for ch in html.unescape(_TAG_RE.sub('', line)):
+        esc = html.escape(ch, quote=False)
+        if used + len(esc) > room:
+            break
+        out.append(esc)
+        used += len(esc)
+    return ''.join(out)
+
+
+def _split_block(block, room):
+    """
+    超长的块按行拆成若干段，每段不超过 room 个字符（每行的 HTML 标签自成对，按行拆分不会破坏标签）
+    单行仍超长时去掉标签后截断，避免留下未闭合的标签或半个实体（Telegram 会以 400 拒绝整条消息）
+    """
+    pieces = []
+    cur = ''
+    for line in block.split('\n'):
+        if len(line) > room:
+            line = _plain_prefix(line, room)
+        candidate = cur + '\n' + line if cur else line
+        if len(candidate) > room and cur:
+            pieces.append(cur)
+            candidate = line
+        cur = candidate
+    if cur:
+        pieces.append(cur)
+    return pieces
+
+
+def split_message(blocks, header='', sep='\n\n', limit=TG_MESSAGE_LIMIT):
+    """把多个消息块拼接为若干条不超过 limit 字符的消息，尽量不拆开单个块"""
+    messages = []
+    cur = header
+    room = limit - len(header)
+    pieces = []
+    for block in blocks:
+        pieces.extend(_split_block(block, room) if len(block) > room else (block,))
+    for block in pieces:
+        candidate = cur + (sep if cur != header else '') + block
+        if len(candidate) > limit and cur != header:
+            messages.append(cur)
+            candidate = header + block
+        cur = candidate
+    if cur != header:
+        messages.append(cur)
+    return messages
+
+
+def format_hit(title, kws_str, author, pub_date, source_line, link):
+    """命中帖子的推送消息"""
+    return (
+        f"<b>🎯 发现命中帖子</b>\n"
+        f"• <b>标题</b>：{title}\n"
+        f"• <b>匹配</b>：{kws_str}\n"
+        f"• <b>作者</b>：{author}\n"
+        f"• <b>时间</b>：{pub_date}\n"
+        f"{source_line}"
+        f"• <b>链接</b>：{link}"
+    )
+
+
+def format_regex_disabled(pattern, ttl):
+    """正则连续超时被暂停时通知用户的消息"""
+    return (
+        f"<b>⚠️ 正则已暂停</b>\n"
+        f"<code>{html.escape(pattern)}</code> 连续多次匹配超时，暂停 {ttl / 60:.0f} 分钟后自动恢复。\n"
+        f"请考虑简化该正则（避免嵌套重复，如 <code>(a+)+</code>）"
+    )
+
+
+def _chain(callbacks):
+    def on_done(ok):
+        for cb in callbacks:
+            cb(ok)
+    return on_done
+
+
+class DigestBuffer:
+    """按会话合并推送：窗口期内的命中合并为一条（或按长度拆分的几条）消息"""
+
+    def __init__(self, dispatcher, tick=1.0):
+        self.dispatcher = dispatcher
+        self.tick = tick
+        self.cond = Condition()
+        self.buffers = {}  # chat_id -> [到期时间, [消息块], [回调]]
+        self.thread = None
+
+    def start(self):
+        """启动定时刷新线程"""
+        self.thread = Thread(target=self._loop, name="digest", daemon=True)
+        self.thread.start()
+        return self
+
+    def add(self, chat_id, block, window, on_done=None):
+        """加入一条命中；窗口从该会话第一条命中开始计时"""
+        chat_id = str(chat_id)
+        with self.cond:
+            buf = self.buffers.get(chat_id)
+            if buf is None:
+                buf = [time.monotonic() + window, [], []]
+                self.buffers[chat_id] = buf
+            buf[1].append(block)
+            if on_done:
+                buf[2].append(on_done)
+
+    def pending(self):
+        """缓冲中的命中条数"""
+        with self.cond:
+            return sum(len(b[1]) for b in self.buffers.values())
+
+    def flush(self, force=False):
+        """发送所有已到期（force 时为全部）的缓冲"""
+        now = time.monotonic()
+        with self.cond:
+            due = [c for c, b in self.buffers.items() if force or b[0] <= now]
+            items = [(c, self.buffers.pop(c)) for c in due]
+        for chat_id, (_, blocks, callbacks) in items:
+            if len(blocks) == 1:
+                parts = split_message(blocks)
+            else:
+                parts = split_message(blocks, header=f"<b>📬 命中汇总（{len(blocks)} 条）</b>\n\n")
+            for i, text in enumerate(parts):
+                last = i == len(parts) - 1
+                self.dispatcher.submit(chat_id, text, on_done=_chain(callbacks) if last and callbacks else None)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"合并推送刷新异常: {e}")
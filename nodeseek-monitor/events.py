@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+用户配置变更事件
+规则编辑命令在修改配置的同时产生事件，匹配引擎据此只更新受影响的用户，不再全量重建
+"""
+
+from collections import namedtuple
+
+RuleUpserted = namedtuple('RuleUpserted', ['chat_id', 'word'])       # /add 新建或修改规则
+RuleRemoved = namedtuple('RuleRemoved', ['chat_id', 'word'])         # /del
+BlocklistChanged = namedtuple('BlocklistChanged', ['chat_id'])       # /block /unblock
+DefaultsChanged = namedtuple('DefaultsChanged', ['chat_id'])         # /include /exclude（只影响之后新建的规则）
+SettingChanged = namedtuple('SettingChanged', ['chat_id', 'key'])    # /setsummary /setfullword /setregex /setdeep 等
+UserChanged = namedtuple('UserChanged', ['chat_id'])                 # 未细分的整体变更
+
+# 会改变匹配结果的设置项
+MATCH_SETTINGS = frozenset({'match_summary', 'full_word_match', 'regex_match', 'deep_match'})
+
+
+def affects_matching(event):
+    """事件是否需要更新匹配引擎"""
+    if isinstance(event, DefaultsChanged):
+        return False
+    if isinstance(event, SettingChanged):
+        return event.key in MATCH_SETTINGS
+    return True
+
+
+def affected_chats(events):
+    """需要重新编译的用户集合"""
+    return {e.chat_id for e in events if affects_matching(e)}
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+RSS 抓取与增量解析
+- 条件请求（ETag / If-Modified-Since），304 直接跳过解析
+- 内容哈希短路：内容未变化时不解析
+- 增量解析：只解析第一个已处理帖子之前的新条目
+"""
+
+import re
+import time
+from urllib.parse import urlparse
+import hashlib
+import logging
+import feedparser
+import requests
+
+logger = logging.getLogger(__name__)
+
+RSS_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+
+POST_ID_RE = re.compile(r"post-(\d+)")
+_ITEM_RE = re.compile(rb'<item[\s>]')
+_LINK_RE = re.compile(rb'<link[^>]*>\s*(?:<!\[CDATA\[)?\s*(.*?)\s*(?:\]\]>)?\s*</link>', re.S)
+
+
+def post_key(link, entry_id=None):
+    """
+    计算条目去重key：优先使用链接中的帖子ID
+    NodeSeek 各分类订阅源共享同一个帖子ID空间（同一帖子只推送一次），其它站点的ID加上域名前缀
+    """
+    m = POST_ID_RE.search(link)
+    if m:
+        host = urlparse(link).hostname or ''
+        if not host or host == 'nodeseek.com' or host.endswith('.nodeseek.com'):
+            return m.group(1)
+        return f"{host}:{m.group(1)}"
+    if entry_id:
+        return entry_id
+    return hashlib.md5(link.encode()).hexdigest()
+
+
+def slice_new_items(content, is_seen):
+    """
+    在不完整解析的情况下扫描 <item>，遇到第一个已处理帖子即截断
+    返回只包含新条目的 RSS 片段；没有新条目返回 None；无法预扫描时返回原内容
+    """
+    starts = [m.start() for m in _ITEM_RE.finditer(content)]
+    if not starts:
+        return content
+    for i, pos in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(content)
+        m = _LINK_RE.search(content, pos, end)
+        if not m:
+            return content
+        link = m.group(1).decode('utf-8', 'replace')
+        if not POST_ID_RE.search(link):
+            # 链接中没有帖子ID，key 需要 guid，交给 feedparser 完整解析
+            return content
+        if is_seen(post_key(link)):
+            if i == 0:
+                return None
+            return content[:pos] + b'</channel></rss>'
+    return content
+
+
+class FeedFetcher:
+    """单个订阅源的条件抓取器，带统计计数"""
+
+    def __init__(self, url):
+        self.url = url
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self._pending = None
+        # 统计
+        self.requests = 0
+        self.not_modified = 0
+        self.unchanged = 0
+        self.bytes_fetched = 0
+        self.parses = 0
+        self.parse_time = 0.0
+        self.last_parse_time = 0.0
+        self.last_fetch_time = 0.0
+
+    def _headers(self):
+        headers = dict(RSS_HEADERS)
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def poll(self, is_seen, timeout=30):
+        """
+        抓取订阅源，返回 (checked, entries)
+        checked 表示服务端正常响应（200/304）；entries 为需要处理的新条目（可能为空）
+        处理完成后需调用 commit() 记录缓存校验信息
+        """
+        t0 = time.perf_counter()
+        resp = requests.get(self.url, headers=self._headers(), timeout=timeout)
+        self.last_fetch_time = time.perf_counter() - t0
+        return self._handle(resp, is_seen)
+
+    async def poll_async(self, client, is_seen, timeout=30):
+        """poll() 的协程版本，client 为 httpx.AsyncClient"""
+        t0 = time.perf_counter()
+        resp = await client.get(self.url, headers=self._headers(), timeout=timeout)
+        self.last_fetch_time = time.perf_counter() - t0
+        return self._handle(resp, is_seen)
+
+    def _handle(self, resp, is_seen):
+        """处理响应（requests 与 httpx 的响应对象接口相同）"""
+        self.requests += 1
+        self.bytes_fetched += len(resp.content)
+        if resp.status_code == 304:
+            self.not_modified += 1
+            return True, []
+        if resp.status_code != 200:
+            return False, []
+
+        content = resp.content
+        content_hash = hashlib.sha1(content).hexdigest()
+        self._pending = (resp.headers.get('ETag'), resp.headers.get('Last-Modified'), content_hash)
+        if content_hash == self.content_hash:
+            self.unchanged += 1
+            return True, []
+
+        new_content = slice_new_items(content, is_seen)
+        if new_content is None:
+            return True, []
+
+        t0 = time.perf_counter()
+        feed = feedparser.parse(new_content)
+        self.last_parse_time = time.perf_counter() - t0
+        self.parse_time += self.last_parse_time
+        self.parses += 1
+        return True, feed.entries
+
+    def commit(self):
+        """本轮条目处理完成后记录 ETag/Last-Modified/内容哈希"""
+        if self._pending:
+            self.etag, self.last_modified, self.content_hash = self._pending
+            self._pending = None
+
+    def status_text(self, name=None):
+        """统计信息（用于 /status）"""
+        ratio = self.not_modified / self.requests * 100 if self.requests else 0
+        avg_ms = self.parse_time / self.parses * 1000 if self.parses else 0
+        head = f"[{name}] " if name else ""
+        return (
+            f"{head}抓取流量: {self.bytes_fetched / 1024:.1f} KB ({self.requests} 次)\n"
+            f"{head}304 比例: {ratio:.0f}% | 内容未变: {self.unchanged} 次\n"
+            f"{head}解析耗时: 平均 {avg_ms:.1f}ms / 最近 {self.last_parse_time * 1000:.1f}ms\n"
+        )
@@ -0,0 +1,746 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+多用户关键词匹配引擎
+配置变更时编译一次：所有用户的普通子串合并进一个 Aho-Corasick 自动机，
+每个用户的规则以位图（int）记录 include/exclude/global_exclude，每条帖子只需扫描一遍
+倒排索引：规则触发词 -> 用户，只有触发词出现在帖子中的用户才会进一步评估；
+正则规则按其必含的字面量建索引，无法提取字面量的正则进入回退列表
+"""
+
+import os
+import re
+import time
+import logging
+import unicodedata
+import multiprocessing
+from functools import lru_cache
+from threading import Lock
+
+from events import affected_chats
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+REGEX_MAX_LEN = 100        # 写入时校验与匹配共用 compile_regex 的长度上限
+REGEX_BUDGET = float(os.environ.get('REGEX_BUDGET_MS', '50')) / 1000  # 单个正则单次匹配的时间预算
+REGEX_STRIKES = int(os.environ.get('REGEX_STRIKES', '3'))  # 连续超时达到该次数才禁用
+REGEX_DISABLE_TTL = float(os.environ.get('REGEX_DISABLE_TTL', '3600'))  # 禁用时长（秒），到期后重新启用
+GUARD_START_TIMEOUT = 30  # 等待正则隔离进程启动的秒数（首次需启动 forkserver）
+DELTA_TERMS_LIMIT = 256    # 增量自动机超过该词数时全量重新编译
+
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_WORD_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize_text(text):
+    """匹配用文本规范化：去除 HTML 标签、全角转半角（NFKC）、casefold"""
+    return unicodedata.normalize('NFKC', _TAG_RE.sub('', text)).casefold()
+
+
+def normalize_term(term):
+    """规则词规范化（与 normalize_text 一致，但不去标签）"""
+    return unicodedata.normalize('NFKC', term).casefold()
+
+
+def normalize_pattern(pattern):
+    """正则规则规范化：只做全角转半角和 lower()，避免 casefold 改变转义序列含义"""
+    return unicodedata.normalize('NFKC', pattern).lower()
+
+
+VIEW_TITLE, VIEW_SUMMARY, VIEW_BODY = 0, 1, 2  # 文本视图：标题 / 标题+摘要 / 标题+摘要+正文
+VIEWS = (VIEW_TITLE, VIEW_SUMMARY, VIEW_BODY)
+
+
+class EntryText:
+    """一条帖子的规范化文本视图，每条帖子只计算一次，供所有用户共享"""
+    __slots__ = ('title', 'full', 'deep', '_tokens')
+
+    def __init__(self, title, summary=''):
+        self.title = normalize_text(title)
+        self.full = self.title + " " + normalize_text(summary)
+        self.deep = self.full  # 未抓取正文时与标题+摘要相同
+        self._tokens = [None, None, None]
+
+    def set_body(self, body):
+        """设置深度匹配用的帖子正文"""
+        self.deep = self.full + " " + normalize_text(body) if body else self.full
+        self._tokens[VIEW_BODY] = None
+
+    def text(self, view):
+        if view == VIEW_BODY:
+            return self.deep
+        return self.full if view else self.title
+
+    def tokens(self, view):
+        """全词匹配用的词元集合（\w+ 的极大连续段），按需计算"""
+        t = self._tokens[view]
+        if t is None:
+            t = self._tokens[view] = frozenset(_WORD_TOKEN_RE.findall(self.text(view)))
+        return t
+
+
+class AhoCorasick:
+    """Aho-Corasick 多模式串自动机，输出为命中模式 ID 的位图"""
+
+    def __init__(self):
+        self.goto = [{}]   # 节点 -> {字符: 子节点}
+        self.fail = [0]
+        self.out = [0]     # 节点 -> 命中模式位图
+        self.built = False
+
+    def add(self, pattern, pid):
+        """加入一个模式串，pid 为其位序号"""
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(0)
+                self.goto[node][ch] = nxt
+            node = nxt
+        self.out[node] |= 1 << pid
+        self.built = False
+
+    def build(self):
+        """按 BFS 构建失配指针并合并输出"""
+        queue = list(self.goto[0].values())
+        for child in queue:
+            self.fail[child] = 0
+        i = 0
+        while i < len(queue):
+            node = queue[i]
+            i += 1
+            for ch, child in self.goto[node].items():
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[child] = target if target != child else 0
+                self.out[child] |= self.out[self.fail[child]]
+                queue.append(child)
+        self.built = True
+
+    def scan(self, text):
+        """扫描文本，返回所有命中模式的位图"""
+        if not self.built:
+            self.build()
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        found = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return found
+
+
+@lru_cache(maxsize=4096)
+def compile_regex(pattern, flags=re.IGNORECASE):
+    """编译用户正则（进程级 LRU 缓存，键为 (pattern, flags)），不合法时返回 None"""
+    if not pattern or len(pattern) > REGEX_MAX_LEN:
+        return None
+    try:
+        return re.compile(pattern, flags)
+    except Exception:
+        return None
+
+
+# re 在 IGNORECASE 下有额外等价关系且 NFKC 不会消除的字符（i/ı），不能作为索引字面量
+# （s/ſ、k/K 等在 NFKC 规范化后的文本中不会出现另一种写法）
+_FOLD_UNSAFE = frozenset('iı')
+
+
+def _literal_safe(ch):
+    """规范化后的文本中，正则命中该字符意味着文本中一定出现该字符本身"""
+    if ch in _FOLD_UNSAFE:
+        return False
+    if ch.isascii():
+        return not ch.isupper()
+    return ch.lower() == ch.upper() == ch.casefold()
+
+
+def _literal_runs(items, runs):
+    """收集解析树中必须出现的连续字面量片段"""
+    cur = []
+    for op, av in items:
+        if op is sre_parse.LITERAL and _literal_safe(chr(av)):
+            cur.append(chr(av))
+            continue
+        if op is sre_parse.AT:
+            continue  # 零宽断言不打断字面量
+        if cur:
+            runs.append(''.join(cur))
+            cur = []
+        if op is sre_parse.SUBPATTERN:
+            _literal_runs(av[-1], runs)
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            _literal_runs(av[2], runs)
+    if cur:
+        runs.append(''.join(cur))
+
+
+@lru_cache(maxsize=4096)
+def regex_literal(pattern, flags=re.IGNORECASE):
+    """
+    提取正则命中时文本中必然包含的最长字面量（用于倒排索引），无法提取时返回 None
+    单个 ASCII 字符区分度太低，不作为字面量
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+    runs = []
+    _literal_runs(list(parsed), runs)
+    best = max(runs, key=len, default='')
+    if len(best) >= 2 or (best and not best.isascii()):
+        return best
+    return None
+
+
+def _guard_worker(conn):
+    """子进程：先回传就绪标记，再依次匹配收到的正则，每完成一个立即回传结果"""
+    cache = {}
+    conn.send(None)
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg is None:
+            return
+        text, patterns = msg
+        for key in patterns:
+            r = cache.get(key)
+            if r is None:
+                r = cache[key] = re.compile(*key)
+            try:
+                conn.send(bool(r.search(text)))
+            except Exception:
+                conn.send(False)
+
+
+class RegexGuard:
+    """
+    在独立子进程中执行用户正则，单个正则超过时间预算即终止子进程，该次视为未命中
+    （Python 的 re 无法在线程内中断，只能通过进程隔离实现真正的超时）
+    子进程经 forkserver 创建：主进程此时已有抓取/推送等线程，直接 fork 可能继承被其它线程持有的锁而死锁
+    预算包含进程间通信与子进程首次编译，偶发超时不处理；连续 strikes 次超时才禁用 ttl 秒，
+    禁用时回调 on_disabled(pattern)，由调用方通知使用该正则的用户
+    """
+
+    def __init__(self, budget=REGEX_BUDGET, strikes=REGEX_STRIKES, ttl=REGEX_DISABLE_TTL):
+        self.budget = budget
+        self.strikes = max(1, strikes)
+        self.ttl = ttl
+        self.lock = Lock()
+        self.proc = None
+        self.conn = None
+        self.streaks = {}   # (pattern, flags) -> 连续超时次数
+        self.disabled = {}  # (pattern, flags) -> 重新启用的时间（monotonic）
+        self.on_disabled = None
+        self.timeouts = 0
+        self.available = 'forkserver' in multiprocessing.get_all_start_methods()
+
+    def _spawn(self):
+        try:
+            ctx = multiprocessing.get_context('forkserver')
+            # forkserver 只在首次使用时启动并导入一次主模块，之后的子进程都由它 fork
+            ctx.set_forkserver_preload(['__main__', 'matcher'])
+            parent, child = ctx.Pipe()
+            self.proc = ctx.Process(target=_guard_worker, args=(child,), name="regex-guard", daemon=True)
+            self.proc.start()
+            child.close()
+            self.conn = parent
+            # 首次启动 forkserver 较慢，等子进程就绪后再开始计算匹配预算
+            if not parent.poll(GUARD_START_TIMEOUT):
+                raise TimeoutError(f"{GUARD_START_TIMEOUT} 秒内未就绪")
+            parent.recv()
+            return True
+        except Exception as e:
+            logger.warning(f"无法启动正则隔离进程，改为进程内匹配: {e}")
+            if self.proc is not None:
+                self._kill()
+            self.available = False
+            return False
+
+    def _kill(self):
+        try:
+            self.proc.kill()
+            self.proc.join(1)
+            self.conn.close()
+        except Exception:
+            pass
+        self.proc = None
+        self.conn = None
+
+    def _is_disabled(self, key, now):
+        until = self.disabled.get(key)
+        if until is None:
+            return False
+        if until > now:
+            return True
+        del self.disabled[key]
+        logger.info(f"正则禁用到期，重新启用: {key[0]}")
+        return False
+
+    def _timed_out(self, key):
+        """记录一次超时，达到连续次数时禁用，返回是否本次被禁用"""
+        self.timeouts += 1
+        streak = self.streaks.get(key, 0) + 1
+        if streak < self.strikes:
+            self.streaks[key] = streak
+            logger.warning(f"正则匹配超时（>{self.budget * 1000:.0f}ms，连续 {streak}/{self.strikes} 次）: {key[0]}")
+            return False
+        self.streaks.pop(key, None)
+        self.disabled[key] = time.monotonic() + self.ttl
+        logger.warning(f"正则连续 {streak} 次匹配超时，禁用 {self.ttl:.0f} 秒: {key[0]}")
+        return True
+
+    def search_many(self, text, regexes):
+        """返回与 regexes 一一对应的命中结果；超时或已禁用的正则视为未命中"""
+        results = [False] * len(regexes)
+        newly_disabled = []
+        with self.lock:
+            now = time.monotonic()
+            todo = [i for i, r in enumerate(regexes)
+                    if r is not None and not (self.disabled and self._is_disabled((r.pattern, r.flags), now))]
+            while todo:
+                if not self.available or (self.conn is None and not self._spawn()):
+                    for i in todo:
+                        results[i] = _search_local(regexes[i], text)
+                    return results
+                done = 0
+                try:
+                    self.conn.send((text, [(regexes[i].pattern, regexes[i].flags) for i in todo]))
+                    for i in todo:
+                        if not self.conn.poll(self.budget):
+                            raise TimeoutError
+                        results[i] = self.conn.recv()
+                        done += 1
+                        if self.streaks:
+                            self.streaks.pop((regexes[i].pattern, regexes[i].flags), None)
+                    todo = []
+                except TimeoutError:
+                    bad = regexes[todo[done]]
+                    if self._timed_out((bad.pattern, bad.flags)):
+                        newly_disabled.append(bad.pattern)
+                    self._kill()
+                    todo = todo[done + 1:]
+                except (EOFError, OSError) as e:
+                    logger.warning(f"正则隔离进程异常，重新启动: {e}")
+                    self._kill()
+                    todo = todo[done:]
+        if newly_disabled and self.on_disabled is not None:
+            for pattern in newly_disabled:
+                try:
+                    self.on_disabled(pattern)
+                except Exception as e:
+                    logger.error(f"正则禁用通知失败: {e}")
+        return results
+
+    def status_text(self):
+        """统计信息（用于 /status）"""
+        with self.lock:
+            now = time.monotonic()
+            active = sum(1 for until in self.disabled.values() if until > now)
+        return f"正则超时: {self.timeouts} 次 | 暂停中 {active} 个\n"
+
+
+def _search_local(compiled_re, text):
+    try:
+        return bool(compiled_re.search(text))
+    except Exception:
+        return False
+
+
+regex_guard = RegexGuard()
+
+
+def regex_owners(users, pattern):
+    """开启正则匹配、且规则或屏蔽词中用到该正则（规范化后的 pattern）的用户"""
+    owners = []
+    for chat_id, conf in users.items():
+        if not conf.get('settings', {}).get('regex_match'):
+            continue
+        terms = list(conf.get('global_exclude', []))
+        for rule in conf.get('keywords', []):
+            terms.append(rule['word'])
+            terms.extend(rule.get('include', []))
+            terms.extend(rule.get('exclude', []))
+        if any(normalize_pattern(t) == pattern for t in terms):
+            owners.append(chat_id)
+    return owners
+
+
+class _PlainRule:
+    """子串/全词模式下的单条规则"""
+    __slots__ = ('word', 'feeds', 'base_bit', 'word_token', 'word_re', 'exclude_mask', 'include_mask')
+
+    def __init__(self, word, feeds, base_bit, word_token, word_re, exclude_mask, include_mask):
+        self.word = word
+        self.feeds = feeds              # 限定的订阅源名称集合，None 表示所有订阅源
+        self.base_bit = base_bit
+        self.word_token = word_token    # 全词模式且规则词本身是单个词元：直接查词元集合
+        self.word_re = word_re          # 全词模式下其余情况的 \b...\b 校验
+        self.exclude_mask = exclude_mask
+        self.include_mask = include_mask
+
+
+class _PlainUser:
+    """子串/全词模式下的用户"""
+    __slots__ = ('chat_id', 'view', 'block_mask', 'rules', 'triggers', 'fallback')
+
+    def __init__(self, chat_id, view, block_mask, rules):
+        self.chat_id = chat_id
+        self.view = view                # 匹配的文本视图（VIEW_*）
+        self.block_mask = block_mask
+        self.rules = rules
+        self.triggers = frozenset(r.base_bit.bit_length() - 1 for r in rules)  # 倒排索引中登记的触发位
+        self.fallback = False
+
+
+class _RegexUser:
+    """正则模式下的用户，规则引用引擎中去重后的正则序号（None 表示不合法，永不命中）"""
+    __slots__ = ('chat_id', 'view', 'blocks', 'rules', 'triggers', 'fallback')
+
+    def __init__(self, chat_id, view, blocks, rules, triggers, fallback):
+        self.chat_id = chat_id
+        self.view = view
+        self.blocks = blocks            # [idx|None]
+        self.rules = rules              # [(word, feeds, base_idx, [exc_idx], [inc_idx])]
+        self.triggers = triggers
+        self.fallback = fallback        # 含无法索引的正则，每条帖子都要评估
+
+
+class MatchEngine:
+    """
+    编译后的多用户匹配器
+    发布后只读：apply() 按配置变更事件派生新版本，只重新编译受影响的用户，
+    正在匹配的线程继续使用旧版本；词位、正则表等只追加的结构在各版本间共享
+    """
+
+    def __init__(self, users):
+        self.automaton = AhoCorasick()
+        self.delta = None                   # 全量编译后新增词的增量自动机
+        self._delta_terms = ()              # ((词, 位), ...)
+        self._building = True
+        self._term_bits = {}
+        self._word_res = {}
+        self.regexes = []
+        self._regex_idx = {}
+        self._regex_lits = []               # 正则序号 -> 必含字面量的位（None 表示无法索引）
+        self.users = {}                     # chat_id -> 编译后的用户
+        self.order = {}                     # chat_id -> 配置中的顺序
+        self.postings = [{} for _ in VIEWS]  # 视图(VIEW_*) -> {触发位: (chat_id, ...)}
+        self.trigger_mask = [0 for _ in VIEWS]  # 视图 -> 所有触发位（删除用户后可能残留，查表时跳过）
+        self.fallback = [frozenset() for _ in VIEWS]
+        self.deep_users = frozenset()       # 开启深度匹配（需要帖子正文）的用户
+        for chat_id, user_conf in users.items():
+            self._set_user(chat_id, user_conf)
+        self.automaton.build()
+        self._building = False
+
+    def apply(self, events, users):
+        """
+        按变更事件派生新版本（users 为变更后的完整用户配置）
+        增量词过多时改为全量编译，回收不再使用的词位
+        """
+        chats = affected_chats(events)
+        # 新出现的用户（即使本次变更不影响匹配）按出现顺序登记，保持与配置顺序一致
+        new_chats = [e.chat_id for e in events if e.chat_id not in self.order and e.chat_id in users]
+        if not chats and not new_chats:
+            return self
+        eng = object.__new__(MatchEngine)
+        eng.__dict__.update(self.__dict__)
+        eng.users = dict(self.users)
+        eng.order = dict(self.order)
+        for chat_id in new_chats:
+            eng.order.setdefault(chat_id, len(eng.order))
+        eng.postings = [dict(p) for p in self.postings]
+        eng.trigger_mask = list(self.trigger_mask)
+        eng.fallback = list(self.fallback)
+        try:
+            for chat_id in chats:
+                eng._set_user(chat_id, users.get(chat_id))
+        except Exception as e:
+            # 新词可能已登记但未进入自动机，不能沿用共享结构
+            logger.warning(f"增量更新匹配引擎失败，改为全量编译: {e}")
+            return MatchEngine(users)
+        if len(eng._delta_terms) > DELTA_TERMS_LIMIT:
+            return MatchEngine(users)
+        if eng._delta_terms is not self._delta_terms:
+            eng.delta = AhoCorasick()
+            for term, bit in eng._delta_terms:
+                eng.delta.add(term, bit)
+            eng.delta.build()
+        return eng
+
+    def _bit(self, term):
+        """为小写子串分配位序号（相同子串共享一位）"""
+        bit = self._term_bits.get(term)
+        if bit is None:
+            bit = len(self._term_bits)
+            self._term_bits[term] = bit
+            if self._building:
+                self.automaton.add(term, bit)
+            else:
+                self._delta_terms += ((term, bit),)
+        return bit
+
+    def _mask(self, terms):
+        mask = 0
+        for t in terms:
+            t = normalize_term(t)
+            if t:
+                mask |= 1 << self._bit(t)
+        return mask
+
+    def _word_re(self, term):
+        r = self._word_res.get(term)
+        if r is None:
+            r = re.compile(rf"\b{re.escape(term)}\b", re.IGNORECASE)
+            self._word_res[term] = r
+        return r
+
+    def _set_user(self, chat_id, user_conf):
+        """（重新）编译一个用户并更新倒排索引；user_conf 为 None 表示删除"""
+        old = self.users.pop(chat_id, None)
+        if old is not None:
+            postings = self.postings[old.view]
+            for bit in old.triggers:
+                rest = tuple(c for c in postings.get(bit, ()) if c != chat_id)
+                if rest:
+                    postings[bit] = rest
+                else:
+                    postings.pop(bit, None)
+            if old.fallback:
+                self.fallback[old.view] = self.fallback[old.view] - {chat_id}
+            if old.view == VIEW_BODY:
+                self.deep_users = self.deep_users - {chat_id}
+        if user_conf is not None and chat_id not in self.order:
+            self.order[chat_id] = len(self.order)  # 新用户追加在配置末尾
+        user = self._compile_user(chat_id, user_conf) if user_conf else None
+        if user is None:
+            return
+        self.users[chat_id] = user
+        view = user.view
+        postings = self.postings[view]
+        for bit in user.triggers:
+            postings[bit] = postings.get(bit, ()) + (chat_id,)
+            self.trigger_mask[view] |= 1 << bit
+        if user.fallback:
+            self.fallback[view] = self.fallback[view] | {chat_id}
+        if view == VIEW_BODY:
+            self.deep_users = self.deep_users | {chat_id}
+
+    def _compile_user(self, chat_id, user_conf):
+        keywords = user_conf.get('keywords') or []
+        if not keywords:
+            return None
+        settings = user_conf.get('settings', {})
+        if settings.get('deep_match', False):
+            view = VIEW_BODY
+        else:
+            view = VIEW_SUMMARY if settings.get('match_summary', False) else VIEW_TITLE
+        full_word = settings.get('full_word_match', False)
+        use_regex = settings.get('regex_match', False)
+
+        if use_regex:
+            def comp(p):
+                r = compile_regex(normalize_pattern(p))
+                if r is None:
+                    if p:
+                        logger.warning(f"跳过不安全的正则表达式: {p}")
+                    return None
+                idx = self._regex_idx.get(r.pattern)
+                if idx is None:
+                    lit = regex_literal(r.pattern, r.flags)
+                    self._regex_lits.append(None if lit is None else 1 << self._bit(lit))
+                    idx = self._regex_idx[r.pattern] = len(self.regexes)
+                    self.regexes.append(r)
+                return idx
+            blocks = [comp(b) for b in user_conf.get('global_exclude', [])]
+            rules = []
+            triggers = set()
+            fallback = False
+            for rule in keywords:
+                base_idx = comp(rule['word'])
+                rules.append((
+                    rule['word'],
+                    _rule_feeds(rule),
+                    base_idx,
+                    [comp(x) for x in rule.get('exclude', [])],
+                    [comp(x) for x in rule.get('include', [])],
+                ))
+                if base_idx is None:
+                    continue
+                lit = self._regex_lits[base_idx]
+                if lit is None:
+                    fallback = True
+                else:
+                    triggers.add(lit.bit_length() - 1)
+            return _RegexUser(chat_id, view, blocks, rules, frozenset(triggers), fallback)
+
+        rules = []
+        for rule in keywords:
+            base = normalize_term(rule['word'])
+            includes = rule.get('include', [])
+            include_mask = self._mask(includes)
+            # 空关键词永不命中；必含列表只含空串时同理
+            if not base or (includes and not include_mask):
+                continue
+            single_token = full_word and _WORD_TOKEN_RE.fullmatch(base) is not None
+            rules.append(_PlainRule(
+                rule['word'],
+                _rule_feeds(rule),
+                1 << self._bit(base),
+                base if single_token else None,
+                self._word_re(base) if full_word and not single_token else None,
+                self._mask(rule.get('exclude', [])),
+                include_mask,
+            ))
+        block_mask = self._mask(user_conf.get('global_exclude', []))
+        return _PlainUser(chat_id, view, block_mask, rules)
+
+    def scan(self, text):
+        """扫描文本，返回命中词的位图（主自动机 + 增量自动机）"""
+        found = self.automaton.scan(text)
+        if self.delta is not None:
+            found |= self.delta.scan(text)
+        return found
+
+    def candidates(self, found, view):
+        """由扫描结果查倒排表，返回需要评估的用户集合"""
+        postings = self.postings[view]
+        result = set(self.fallback[view])
+        bits = found & self.trigger_mask[view]
+        while bits:
+            low = bits & -bits
+            result.update(postings.get(low.bit_length() - 1, ()))
+            bits ^= low
+        return result
+
+    def _regex_results(self, users, found, text, feed):
+        """只匹配候选正则用户实际需要的正则；必含字面量未出现的正则直接判为未命中"""
+        lits = self._regex_lits
+        needed = set()
+        for user in users:
+            needed.update(b for b in user.blocks if b is not None)
+            for _, feeds, base_idx, excludes, includes in user.rules:
+                if base_idx is None or (feeds is not None and feed not in feeds):
+                    continue
+                needed.add(base_idx)
+                needed.update(x for x in excludes if x is not None)
+                needed.update(x for x in includes if x is not None)
+        todo = [i for i in needed if lits[i] is None or found & lits[i]]
+        results = dict.fromkeys(needed, False)
+        if todo:
+            results.update(zip(todo, regex_guard.search_many(text, [self.regexes[i] for i in todo])))
+        return results
+
+    def needs_body(self, entry, feed=None):
+        """
+        深度匹配预筛：是否有深度匹配用户可能命中这条帖子（需要抓取正文）
+        规则都不适用于该订阅源、或标题+摘要已命中屏蔽词的用户不计
+        """
+        if not self.deep_users:
+            return False
+        found = None
+        for chat_id in self.deep_users:
+            user = self.users[chat_id]
+            if isinstance(user, _PlainUser):
+                if user.block_mask:
+                    if found is None:
+                        found = self.scan(entry.full)
+                    if found & user.block_mask:
+                        continue
+                if any(r.feeds is None or feed in r.feeds for r in user.rules):
+                    return True
+            elif any(feeds is None or feed in feeds for _, feeds, *_ in user.rules):
+                return True
+        return False
+
+    def match(self, entry, summary='', feed=None):
+        """
+        匹配一条帖子，返回 [(chat_id, [命中规则词...])]，顺序与配置中用户/规则顺序一致
+        entry 为 EntryText（推荐，规范化只做一次）或原始标题字符串；feed 为来源订阅源名称
+        """
+        if not isinstance(entry, EntryText):
+            entry = EntryText(entry, summary)
+        hits = []
+        for view in VIEWS:
+            if not self.postings[view] and not self.fallback[view]:
+                continue
+            found = self.scan(entry.text(view))
+            cands = [self.users[c] for c in self.candidates(found, view)]
+            regex_users = [u for u in cands if isinstance(u, _RegexUser)]
+            # 候选正则用户需要的正则在隔离进程中每个文本视图只批量匹配一次
+            results = self._regex_results(regex_users, found, entry.text(view), feed) if regex_users else None
+            for user in cands:
+                if isinstance(user, _RegexUser):
+                    matched = _match_regex_user(user, results, feed)
+                else:
+                    matched = _match_plain_user(user, found, entry, view, feed)
+                if matched:
+                    hits.append((self.order[user.chat_id], user.chat_id, matched))
+        hits.sort(key=lambda h: h[0])
+        return [(chat_id, matched) for _, chat_id, matched in hits]
+
+
+def _rule_feeds(rule):
+    feeds = rule.get('feeds')
+    return frozenset(feeds) if feeds else None
+
+
+def _match_plain_user(user, found, entry, view, feed):
+    if found & user.block_mask:
+        return None
+    matched = []
+    for rule in user.rules:
+        if rule.feeds is not None and feed not in rule.feeds:
+            continue
+        if not found & rule.base_bit:
+            continue
+        if rule.word_token is not None and rule.word_token not in entry.tokens(view):
+            continue
+        if rule.word_re is not None and not rule.word_re.search(entry.text(view)):
+            continue
+        if found & rule.exclude_mask:
+            continue
+        if rule.include_mask and not found & rule.include_mask:
+            continue
+        matched.append(rule.word)
+    return matched
+
+
+def _hit(results, idx):
+    return idx is not None and results.get(idx, False)
+
+
+def _match_regex_user(user, results, feed):
+    for b in user.blocks:
+        if _hit(results, b):
+            return None
+    matched = []
+    for word, feeds, base_idx, excludes, includes in user.rules:
+        if feeds is not None and feed not in feeds:
+            continue
+        if not _hit(results, base_idx):
+            continue
+        if any(_hit(results, x) for x in excludes):
+            continue
+        if includes and not any(_hit(results, x) for x in includes):
+            continue
+        matched.append(word)
+    return matched
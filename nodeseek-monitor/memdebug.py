@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+内存诊断（MEM_DEBUG=1 开启）
+定期记录 tracemalloc 分配热点与 gc 对象计数，快照差异写入数据目录，用于定位内存增长
+"""
+
+import os
+import gc
+import html
+import time
+import logging
+import tracemalloc
+from collections import Counter, deque
+from threading import Lock
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def object_counts():
+    """按类型统计 gc 跟踪的对象数量"""
+    return Counter(type(o).__name__ for o in gc.get_objects())
+
+
+def rss_mb():
+    return psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024
+
+
+class MemoryDiagnostics:
+    """
+    内存诊断采样器
+    sample() 每隔 interval 秒采样一次：与上一次快照比较并写入 out_dir，保留最近 keep 个文件；
+    report() 汇总自基线以来增长最多的分配位置与对象类型
+    """
+
+    def __init__(self, out_dir, interval=300, frames=10, top=15, keep=20):
+        self.out_dir = out_dir
+        self.interval = interval
+        self.frames = frames
+        self.top = top
+        self.keep = keep
+        self.lock = Lock()
+        self.baseline = None
+        self.previous = None
+        self.baseline_counts = None
+        self.last_counts = None
+        self.last_sample = 0.0
+        self.samples = deque(maxlen=288)  # (时间, RSS MB, tracemalloc 当前 MB, gc 对象数)
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        os.makedirs(self.out_dir, exist_ok=True)
+        logger.info(f"内存诊断已开启，快照差异写入 {self.out_dir}")
+        return self
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED)
+
+    def sample(self, force=False):
+        """到达采样间隔时采样一次，返回是否进行了采样"""
+        now = time.monotonic()
+        if not force and now - self.last_sample < self.interval:
+            return False
+        with self.lock:
+            self.last_sample = now
+            gc.collect()
+            snap = self._snapshot()
+            counts = object_counts()
+            current, _ = tracemalloc.get_traced_memory()
+            self.samples.append((time.time(), rss_mb(), current / 1024 / 1024, sum(counts.values())))
+            if self.baseline is None:
+                self.baseline, self.baseline_counts = snap, counts
+            else:
+                self._dump(snap, self.previous, counts, self.last_counts)
+            self.previous, self.last_counts = snap, counts
+        return True
+
+    def _dump(self, snap, prev, counts, prev_counts):
+        """把与上一次采样的差异写入文件，并清理旧文件"""
+        lines = [f"# {time.strftime('%Y-%m-%d %H:%M:%S')} RSS {self.samples[-1][1]:.1f} MB", "", "## 分配增长"]
+        for stat in snap.compare_to(prev, 'traceback')[:self.top]:
+            if stat.size_diff <= 0:
+                continue
+            lines.append(f"{stat.size_diff / 1024:+.1f} KB ({stat.count_diff:+d} 块)")
+            lines.extend(f"    {line}" for line in stat.traceback.format()[-6:])
+        lines += ["", "## 对象数量增长"]
+        growth = counts.copy()
+        growth.subtract(prev_counts)
+        for name, diff in growth.most_common(self.top):
+            if diff <= 0:
+                break
+            lines.append(f"{name}: {counts[name]} ({diff:+d})")
+
+        path = os.path.join(self.out_dir, f"memdiff-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+            files = sorted(n for n in os.listdir(self.out_dir) if n.startswith('memdiff-'))
+            for name in files[:-self.keep]:
+                os.remove(os.path.join(self.out_dir, name))
+        except OSError as e:
+            logger.warning(f"写入内存快照差异失败: {e}")
+
+    def trend(self):
+        """RSS 增长速度（MB/小时），样本不足时返回 None"""
+        if len(self.samples) < 2:
+            return None
+        (t0, m0, _, _), (t1, m1, _, _) = self.samples[0], self.samples[-1]
+        if t1 - t0 < 60:
+            return None
+        return (m1 - m0) / (t1 - t0) * 3600
+
+    def report(self, top=8):
+        """自基线以来的增长汇总（用于 /debugmem）"""
+        with self.lock:
+            if self.baseline is None or self.previous is self.baseline:
+                return "内存诊断：样本不足，请稍后再试\n"
+            first, last = self.samples[0], self.samples[-1]
+            trend = self.trend()
+            lines = [
+                f"采样: {len(self.samples)} 次，间隔 {self.interval}s",
+                f"RSS: {first[1]:.1f} → {last[1]:.1f} MB" + (f"（{trend:+.2f} MB/h）" if trend is not None else ""),
+                f"tracemalloc: {first[2]:.1f} → {last[2]:.1f} MB",
+                f"gc 对象: {first[3]} → {last[3]}",
+                "",
+                "<b>增长最多的分配位置</b>",
+            ]
+            for stat in self.previous.compare_to(self.baseline, 'lineno')[:top]:
+                if stat.size_diff <= 0:
+                    break
+                frame = stat.traceback[0]
+                lines.append(f"{html.escape(os.path.basename(frame.filename))}:{frame.lineno} {stat.size_diff / 1024:+.1f} KB")
+            lines += ["", "<b>增长最多的对象类型</b>"]
+            growth = self.last_counts.copy()
+            growth.subtract(self.baseline_counts)
+            for name, diff in growth.most_common(top):
+                if diff <= 0:
+                    break
+                lines.append(f"{html.escape(name)}: {diff:+d}")
+        return "\n".join(lines) + "\n"
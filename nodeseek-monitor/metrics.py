@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+运行指标与 Prometheus 文本格式导出
+- 计数器 / 仪表 / 直方图，支持标签
+- 可选的本地 HTTP 端点（GET /metrics）
+"""
+
+import bisect
+import time
+import logging
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+_INF_LABEL = 'le="+Inf"'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(v):
+    if v == float('inf'):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=(), func=None):
+        """func 不为空时取值由回调提供：返回数值，或 {标签值元组: 数值}"""
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        self.lock = Lock()
+        self.values = {} if self.labelnames else {(): 0}  # 无标签的指标从 0 开始导出
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def _items(self):
+        if self.func is None:
+            with self.lock:
+                return list(self.values.items())
+        value = self.func()
+        if isinstance(value, dict):
+            return list(value.items())
+        return [((), value)]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._items()):
+            lines.append(f"{self.name}{_labels_text(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.values = {}
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            st = self.values.get(key)
+            if st is None:
+                st = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                st[0][i] += 1
+            st[1] += value
+            st[2] += 1
+
+    def time(self, **labels):
+        """计时上下文：with hist.time(feed='x'): ..."""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self.values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_number(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, _INF_LABEL)} {count}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels_text(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ('hist', 'labels', 't0')
+
+    def __init__(self, hist, labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, **self.labels)
+        return False
+
+
+class TimedLock:
+    """记录获取等待时间的锁，可直接替换 threading.Lock 用于 with 语句"""
+
+    def __init__(self, hist):
+        self.hist = hist
+        self._lock = Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        t0 = time.perf_counter()
+        ok = self._lock.acquire(blocking, timeout)
+        self.hist.observe(time.perf_counter() - t0)
+        return ok
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = Lock()
+
+    def _add(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=(), func=None):
+        return self._add(Counter(name, help_text, labelnames, func))
+
+    def gauge(self, name, help_text, labelnames=(), func=None):
+        return self._add(Gauge(name, help_text, labelnames, func))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def _plain_counters(self):
+        with self.lock:
+            return [m for m in self.metrics if isinstance(m, Counter) and m.func is None]
+
+    def counter_values(self):
+        """非回调计数器的当前值 {名称: {标签值元组: 数值}}（子进程回报计数用）"""
+        result = {}
+        for m in self._plain_counters():
+            with m.lock:
+                result[m.name] = dict(m.values)
+        return result
+
+    def add_counts(self, counts):
+        """把 counter_values() 格式的增量累加到同名计数器（子进程的计数并入本进程导出）"""
+        counters = {m.name: m for m in self._plain_counters()}
+        for name, values in counts.items():
+            m = counters.get(name)
+            if m is None:
+                continue
+            with m.lock:
+                for key, v in values.items():
+                    m.values[key] = m.values.get(key, 0) + v
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics)
+        for m in metrics:
+            try:
+                lines.extend(m.render())
+            except Exception as e:
+                logger.warning(f"导出指标 {m.name} 失败: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class MetricsServer:
+    """在本地端口提供 GET /metrics"""
+
+    def __init__(self, host, port, registry=registry, path='/metrics'):
+        self.registry = registry
+        self.path = path
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                logger.debug("metrics: " + fmt % args)
+
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != server.path:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = server.registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def start(self):
+        """在后台线程中启动服务"""
+        Thread(target=self.httpd.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"指标服务已启动: http://{self.address[0]}:{self.address[1]}{self.path}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -12,26 +12,46 @@ import time
 import json
 import copy
 import logging
-import feedparser
-import requests
 import datetime
+import calendar
 import re
-import random
+import asyncio
 import psutil
-import hashlib
+from collections import namedtuple
+from types import MappingProxyType
 from logging.handlers import RotatingFileHandler
 from threading import Thread, Lock
 
+from matcher import MatchEngine, EntryText, compile_regex, normalize_pattern, regex_guard, regex_owners
+from events import RuleUpserted, RuleRemoved, BlocklistChanged, DefaultsChanged, SettingChanged, UserChanged
+from feed import FeedFetcher, post_key
+from archive import PostArchive, ArchivedPost, format_results
+from bodyfetch import BodyFetcher
+from backfill import RecentEntries, RecentEntry, backfill, format_backfill
+from scheduler import FeedScheduler, AsyncFeedScheduler
+from memdebug import MemoryDiagnostics, object_counts
+from metrics import registry, MetricsServer, TimedLock
+from dedup import DedupStore
+from storage import JsonStorage, SqliteStorage
+from tg_api import api_request, api_request_async, create_async_client, async_available, latency_stats
+from webhook import WebhookServer
+from dispatcher import NotificationDispatcher, AsyncDispatcher, DigestBuffer, KeyedWorkerPool, format_hit, format_regex_disabled, SEND_OK, SEND_RETRY, SEND_FAIL
+from shard import ShardPool, ShardEntry
+
 # --- 基础配置与路径 ---
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# DATA_DIR 可通过环境变量指定（基准测试等指向临时目录，避免在代码目录中写入配置和日志）
+DATA_DIR = os.environ.get('DATA_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR, exist_ok=True)
 
 # --- 配置路径 ---
-CONFIG_FILE = os.path.join(DATA_DIR, 'config.json')
-PROCESSED_FILE = os.path.join(DATA_DIR, 'processed.json')
+CONFIG_FILE = os.path.join(DATA_DIR, 'config.json')  # json 后端使用；sqlite 后端首次启动时从此迁移
+CONFIG_DB = os.path.join(DATA_DIR, 'config.db')
+PROCESSED_FILE = os.path.join(DATA_DIR, 'processed.json')  # 旧版格式，仅用于迁移
+PROCESSED_LOG = os.path.join(DATA_DIR, 'processed.log')
 LOG_FILE = os.path.join(DATA_DIR, 'monitor.log')
+ARCHIVE_DB = os.path.join(DATA_DIR, 'archive.db')
 
 # 日志配置
 log_handler = RotatingFileHandler(LOG_FILE, maxBytes=5*1024*1024, backupCount=1, encoding='utf-8')
@@ -47,18 +67,65 @@ logger = logging.getLogger(__name__)
 start_time = datetime.datetime.now()
 last_rss_check_time = None
 last_rss_error = None
+feed_fetchers = {}  # 各订阅源的条件抓取器（带 ETag/哈希缓存与统计），按订阅源名称索引
+feed_scheduler = None  # 多订阅源抓取调度器
+dispatcher = None  # 推送通知分发器（惰性启动）
+digest_buffer = None  # 合并推送缓冲（惰性启动）
+update_pool = None  # 命令处理线程池（按会话分区，保证同一会话内顺序）
+webhook_server = None  # webhook 模式下的接收服务
+mem_diag = None  # 内存诊断（MEM_DEBUG=1 时开启）
+archive = None  # 帖子归档与全文检索（ARCHIVE=off 关闭）
+body_fetcher = None  # 深度匹配的帖子正文抓取器（有用户开启时惰性启动）
+recent_entries = None  # 最近条目的环形缓冲，供 /add 回溯匹配（BACKFILL_SIZE=0 关闭）
+async_mode = False  # 事件循环模式（RUN_MODE=async）
+shard_pool = None  # 订阅者分片工作进程（SHARD_WORKERS>1 时开启，匹配与推送在工作进程中完成）
+service_lock = Lock()  # 保护分发器/缓冲的惰性创建（多个抓取线程可能同时首次推送）
+
+# --- 运行指标（设置 METRICS_LISTEN 后以 Prometheus 文本格式导出） ---
+metric_fetch_seconds = registry.histogram('nodeseek_fetch_seconds', 'RSS 请求耗时', ['feed'])
+metric_parse_seconds = registry.histogram('nodeseek_parse_seconds', 'RSS 解析耗时', ['feed'])
+metric_match_seconds = registry.histogram('nodeseek_match_seconds', '每轮抓取的规则匹配总耗时', ['feed'])
+metric_polls = registry.counter('nodeseek_polls_total', '抓取次数', ['feed', 'result'])
+metric_entries = registry.counter('nodeseek_entries_total', '新条目数', ['feed'])
+metric_rate_limited = registry.counter('nodeseek_telegram_429_total', 'Telegram 返回 429 的次数')
+metric_config_lock_wait = registry.histogram('nodeseek_config_lock_wait_seconds', '获取 config_lock 的等待时间',
+                                             buckets=(1e-5, 1e-4, 1e-3, 0.01, 0.1, 1.0))
+registry.counter('nodeseek_notifications_total', '推送结果', ['result'], func=lambda: {
+    ('sent',): (dispatcher.sent if dispatcher else 0) + (shard_pool.totals().get('sent', 0) if shard_pool else 0),
+    ('failed',): (dispatcher.failed if dispatcher else 0) + (shard_pool.totals().get('failed', 0) if shard_pool else 0),
+})
+registry.gauge('nodeseek_queue_depth', '队列长度', ['queue'], func=lambda: {
+    ('dispatch',): dispatcher.pending() if dispatcher else 0,
+    ('digest',): digest_buffer.pending() if digest_buffer else 0,
+    ('update',): update_pool.pending() if update_pool else 0,
+    ('shards',): shard_pool.totals().get('pending', 0) if shard_pool else 0,
+})
+metric_body_seconds = registry.histogram('nodeseek_body_fetch_seconds', '每轮深度匹配的正文抓取总耗时', ['feed'])
+metric_search_seconds = registry.histogram('nodeseek_search_seconds', '/search 检索耗时',
+                                            buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+metrics_server = None
 
 # 全局配置和状态（线程安全）
 global_config = None  # 全局配置对象 {system, users}
-processed_ids = set()  # 已处理的条目ID集合
-config_lock = Lock()  # 保护全局配置和 processed_ids 的锁
+processed_ids = None  # 已处理的条目ID（DedupStore，自带锁）
+config_lock = TimedLock(metric_config_lock_wait)  # 保护全局配置的锁（记录等待时间）
+config_version = 0  # 配置版本号，每次提交变更时递增
+storage = None  # 配置存储后端（STORAGE_BACKEND=sqlite|json，默认 sqlite）
+committed_users = {}  # 最近一次提交的用户配置副本（快照的数据来源，受 config_lock 保护）
+
+# 不可变配置快照：仅在配置提交时重建，轮询线程只需读取一次引用
+ConfigSnapshot = namedtuple('ConfigSnapshot', ['version', 'system', 'users', 'engine'])
+config_snapshot = None
+snapshot_lock = Lock()  # 仅保护快照发布顺序
 
 # --- 数据结构定义 ---
 DEFAULT_SYSTEM_CONFIG = {
     'system': {
         'check_min_interval': 30,
         'check_max_interval': 60,
-        'rss_url': 'https://rss.nodeseek.com/'
+        'rss_url': 'https://rss.nodeseek.com/',
+        'feeds': [],                # 多订阅源 [{"name", "url", "interval", "jitter", "max_backoff"}]，为空时使用 rss_url
+        'processed_capacity': 500   # 去重记录容量（按插入顺序淘汰最旧的）
     },
     'users': {}
 }
@@ -75,7 +142,11 @@ def get_default_user_config():
         'settings': {
             'match_summary': True,
             'full_word_match': False,
-            'regex_match': False
+            'regex_match': False,
+            'digest': False,        # 合并推送：窗口期内的命中合并为一条消息
+            'digest_window': 60,    # 合并窗口（秒）
+            'deep_match': False,    # 深度匹配：抓取帖子正文参与匹配（隐含匹配摘要）
+            'backfill': True        # /add 后用新规则回溯匹配最近的帖子
         }
     }
 
@@ -102,7 +173,7 @@ def save_json(filepath, data):
 
 def load_config(force_reload=False):
     """加载配置到全局变量中"""
-    global global_config, processed_ids
+    global global_config, processed_ids, config_version, storage, committed_users
 
     with config_lock:
         # 如果已经加载过且不强制重载，直接返回
@@ -110,7 +181,9 @@ def load_config(force_reload=False):
             return
 
         # 加载主配置
-        config = load_json(CONFIG_FILE, DEFAULT_SYSTEM_CONFIG)
+        if storage is None:
+            storage = create_storage()
+        config = storage.load()
 
         if 'system' not in config:
             config['system'] = copy.deepcopy(DEFAULT_SYSTEM_CONFIG['system'])
@@ -121,36 +194,160 @@ def load_config(force_reload=False):
                 config['system'][k] = v
 
         global_config = config
+        config_version += 1
+        committed_users = copy.deepcopy(config['users'])
+        snap_args = (config_version, copy.deepcopy(config['system']), committed_users)
 
         # 加载已处理ID（独立管理）
-        processed_list = load_json(PROCESSED_FILE, [])
-        processed_ids = set(processed_list)
+        processed_ids = DedupStore(PROCESSED_LOG, config['system']['processed_capacity'],
+                                   legacy_path=PROCESSED_FILE)
+
+    publish_snapshot(*snap_args)
+
+def create_storage():
+    """按 STORAGE_BACKEND 环境变量创建配置存储后端"""
+    backend = os.environ.get('STORAGE_BACKEND', 'sqlite').strip().lower()
+    if backend == 'json':
+        return JsonStorage(CONFIG_FILE, load_json, save_json, DEFAULT_SYSTEM_CONFIG)
+    return SqliteStorage(CONFIG_DB, json_path=CONFIG_FILE)
+
+def publish_snapshot(version, system, users, events=None):
+    """
+    编译并发布配置快照（传入的 system/users 须为独立副本）
+    events 为本次提交的配置变更事件：基于当前快照的引擎增量更新；为 None 时全量编译
+    """
+    global config_snapshot
+    if events is None:
+        snap = ConfigSnapshot(version, MappingProxyType(system), MappingProxyType(users), MatchEngine(users))
+        with snapshot_lock:
+            # 并发提交时只保留最新版本
+            if config_snapshot is None or snap.version > config_snapshot.version:
+                config_snapshot = snap
+                if shard_pool is not None:
+                    shard_pool.load_users(users)
+        return
+    with snapshot_lock:
+        # 分片模式下按发布顺序把变更转发给各工作进程
+        if shard_pool is not None:
+            shard_pool.apply(events, users if config_snapshot is None or version > config_snapshot.version
+                             else config_snapshot.users)
+        base = config_snapshot
+        if base is None:
+            config_snapshot = ConfigSnapshot(version, MappingProxyType(system), MappingProxyType(users), MatchEngine(users))
+        elif version > base.version:
+            config_snapshot = ConfigSnapshot(version, MappingProxyType(system), MappingProxyType(users),
+                                             base.engine.apply(events, users))
+        else:
+            # 更新的版本已先发布（其用户配置已包含本次变更），按最新配置重新编译受影响的用户即可
+            config_snapshot = base._replace(engine=base.engine.apply(events, base.users))
 
 def save_main_config():
-    """保存主配置（system, users）"""
+    """保存完整主配置（system, users）"""
+    global config_version, committed_users
     with config_lock:
+        config_version += 1
+        version = config_version
         data = {
-            'system': global_config.get('system', {}),
-            'users': global_config.get('users', {})
+            'system': copy.deepcopy(global_config.get('system', {})),
+            'users': copy.deepcopy(global_config.get('users', {}))
         }
-    save_json(CONFIG_FILE, data)
+        committed_users = data['users']
+    storage.save_all(data)
+    publish_snapshot(version, data['system'], data['users'])
 
-def save_processed():
-    """保存已处理ID缓存，包含限制逻辑"""
+def save_system_config():
+    """仅保存系统配置"""
+    global config_version
+    with config_lock:
+        config_version += 1
+        version = config_version
+        system = copy.deepcopy(global_config.get('system', {}))
+        users = committed_users
+    storage.save_system(system)
+    publish_snapshot(version, system, users, events=[])
+
+def save_user_config(chat_id, user_conf, events=None):
+    """
+    提交单个用户的配置：只持久化该用户，快照中其它用户的副本直接复用
+    events 为命令产生的变更事件，匹配引擎只重新编译该用户
+    """
+    global config_version, committed_users
     with config_lock:
-        p_list = list(processed_ids)
-        if len(p_list) > 500:
-            p_list = p_list[-500:]
-            processed_ids.clear()
-            processed_ids.update(p_list)
-    save_json(PROCESSED_FILE, p_list)
+        global_config['users'][chat_id] = user_conf
+        config_version += 1
+        version = config_version
+        users = dict(committed_users)
+        users[chat_id] = copy.deepcopy(user_conf)
+        committed_users = users
+        system = copy.deepcopy(global_config.get('system', {}))
+    storage.save_user(chat_id, user_conf)
+    if events is None:
+        events = [UserChanged(chat_id)]
+    publish_snapshot(version, system, users, events)
+
+DEFAULT_FEED_NAME = 'nodeseek'
+FEED_NAME_RE = re.compile(r'^[A-Za-z0-9_\-]{1,32}$')
+
+def get_feeds(system):
+    """
+    订阅源列表（补全默认参数）
+    未配置 feeds 时由 rss_url 生成单个默认源；未指定间隔的源在 /setinterval 设置的区间内按发帖速率自适应
+    """
+    mn = system.get('check_min_interval', 30)
+    mx = system.get('check_max_interval', 60)
+    feeds = system.get('feeds') or [{'name': DEFAULT_FEED_NAME, 'url': system.get('rss_url', 'https://rss.nodeseek.com/')}]
+    result = []
+    for f in feeds:
+        feed = {'max_backoff': 600}
+        if 'interval' in f:
+            feed['jitter'] = f['interval'] // 2
+        else:
+            feed.update({'interval': mn, 'min_interval': mn, 'max_interval': max(mn, mx)})
+        feed.update(f)
+        result.append(feed)
+    return result
+
+def save_processed():
+    """保存已处理ID（仅追加新增ID，超出容量时自动压缩）"""
+    processed_ids.flush()
 
 def get_user_config(chat_id_str):
-    """获取用户配置"""
+    """获取用户配置（已提交的对象，只读；修改请使用 UserConfigEditor）"""
     with config_lock:
         if chat_id_str not in global_config['users']:
             global_config['users'][chat_id_str] = get_default_user_config()
-        return json.loads(json.dumps(global_config['users'][chat_id_str], ensure_ascii=False))
+        return global_config['users'][chat_id_str]
+
+class UserConfigEditor:
+    """用户配置的写时复制视图：只读命令不复制，写命令首次 write() 时复制一份私有副本"""
+
+    def __init__(self, base):
+        self.base = base
+        self.conf = None
+
+    def read(self):
+        return self.conf if self.conf is not None else self.base
+
+    def write(self):
+        if self.conf is None:
+            self.conf = copy.deepcopy(self.base)
+        return self.conf
+
+    def changed(self):
+        """是否产生了实际修改（仅对写过的配置做结构比较，不做序列化）"""
+        return self.conf is not None and self.conf != self.base
+
+def invalid_regex_terms(user_conf, terms):
+    """正则模式开启时，返回不合法的正则（写入时校验，合法的编译结果进入缓存）"""
+    if not user_conf.get('settings', {}).get('regex_match'):
+        return []
+    return [t for t in terms if compile_regex(normalize_pattern(t)) is None]
+
+# 会修改用户配置的命令，其余命令直接读取已提交配置
+USER_CONFIG_COMMANDS = {
+    '/add', '/del', '/include', '/exclude', '/block', '/unblock',
+    '/setsummary', '/setfullword', '/setregex', '/setdigest', '/setbackfill', '/setdeep',
+}
 
 def validate_keyword(keyword):
     """验证关键词是否合法"""
@@ -166,24 +363,20 @@ def send_telegram_message(message, bot_token, chat_id, reply_to=None, max_retrie
     """发送Telegram消息"""
     if not bot_token or not chat_id: 
         return False
+    if async_mode:
+        # 事件循环模式：经分发器入队后立即返回，命令处理不等待网络和 429 退避
+        get_dispatcher().submit(chat_id, message, reply_to=reply_to)
+        return True
 
     for attempt in range(max_retries):
         try:
-            url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-            data = {"chat_id": chat_id, "text": message, "parse_mode": "HTML"}
-            if reply_to: 
-                data["reply_to_message_id"] = reply_to
-            
-            resp = requests.post(url, data=data, timeout=10)
-            if resp.status_code == 200:
+            status, retry_after = telegram_send_once(bot_token, chat_id, message, reply_to)
+            if status == SEND_OK:
                 return True
-            elif resp.status_code == 429:  # Rate limit
-                retry_after = resp.json().get('parameters', {}).get('retry_after', 5)
-                logger.warning(f"触发速率限制，等待 {retry_after} 秒")
+            elif retry_after is not None:  # Rate limit
                 time.sleep(retry_after)
                 continue
             else:
-                logger.warning(f"发送消息失败，状态码: {resp.status_code}")
                 if attempt < max_retries - 1:
                     time.sleep(2 ** attempt)  # 指数退避
         except Exception as e:
@@ -192,17 +385,120 @@ def send_telegram_message(message, bot_token, chat_id, reply_to=None, max_retrie
                 time.sleep(2 ** attempt)
     return False
 
+def telegram_send_once(bot_token, chat_id, message, reply_to=None):
+    """发送一次Telegram消息（不重试、不等待），返回 (状态, 建议等待秒数)"""
+    resp = api_request(bot_token, "sendMessage", data=send_message_data(chat_id, message, reply_to), timeout=10)
+    return send_result(resp, chat_id)
+
+async def telegram_send_once_async(client, bot_token, chat_id, message, reply_to=None):
+    """telegram_send_once() 的协程版本"""
+    resp = await api_request_async(client, bot_token, "sendMessage",
+                                   data=send_message_data(chat_id, message, reply_to), timeout=10)
+    return send_result(resp, chat_id)
+
+def send_message_data(chat_id, message, reply_to=None):
+    data = {"chat_id": chat_id, "text": message, "parse_mode": "HTML"}
+    if reply_to: 
+        data["reply_to_message_id"] = reply_to
+    return data
+
+def send_result(resp, chat_id):
+    """把 sendMessage 的响应转换为 (状态, 建议等待秒数)"""
+    if resp.status_code == 200:
+        return SEND_OK, None
+    if resp.status_code == 429:  # Rate limit
+        metric_rate_limited.inc()
+        retry_after = resp.json().get('parameters', {}).get('retry_after', 5)
+        logger.warning(f"触发速率限制 ({chat_id})，{retry_after} 秒后重试")
+        return SEND_RETRY, retry_after
+    logger.warning(f"发送消息失败，状态码: {resp.status_code}")
+    if resp.status_code >= 500:
+        return SEND_RETRY, None
+    return SEND_FAIL, None
+
+def get_dispatcher():
+    """获取推送分发器（首次调用时启动工作线程）"""
+    global dispatcher
+    with service_lock:
+        if dispatcher is None:
+            bot_token = os.environ.get('TG_BOT_TOKEN', '')
+            dispatcher = NotificationDispatcher(
+                lambda chat_id, text, reply_to: telegram_send_once(bot_token, chat_id, text, reply_to),
+                workers=int(os.environ.get('TG_DISPATCH_WORKERS', '8')),
+                global_rate=float(os.environ.get('TG_GLOBAL_RATE', '30')),
+            ).start()
+        return dispatcher
+
+def get_digest_buffer():
+    """获取合并推送缓冲（首次调用时启动刷新线程）"""
+    global digest_buffer
+    d = get_dispatcher()
+    with service_lock:
+        if digest_buffer is None:
+            digest_buffer = DigestBuffer(d).start()
+        return digest_buffer
+
+def start_shard_pool(shards):
+    """启动分片工作进程并下发当前用户配置"""
+    global shard_pool
+    bot_token = os.environ.get('TG_BOT_TOKEN', '')
+    pool = ShardPool(
+        shards,
+        lambda chat_id, text, reply_to: telegram_send_once(bot_token, chat_id, text, reply_to),
+        workers=int(os.environ.get('TG_DISPATCH_WORKERS', '8')),
+        global_rate=float(os.environ.get('TG_GLOBAL_RATE', '30')),
+    ).start()
+    with snapshot_lock:
+        shard_pool = pool
+        pool.load_users(dict(config_snapshot.users))
+
+def notify_regex_disabled(pattern):
+    """正则连续超时被暂停时通知使用它的用户"""
+    snap = config_snapshot
+    for chat_id in regex_owners(snap.users, pattern):
+        get_dispatcher().submit(chat_id, format_regex_disabled(pattern, regex_guard.ttl))
+
+regex_guard.on_disabled = notify_regex_disabled
+
+def get_body_fetcher():
+    """获取帖子正文抓取器（DEEP_FETCH_WORKERS / DEEP_HOST_RATE / DEEP_CACHE_SIZE）"""
+    global body_fetcher
+    if body_fetcher is None:
+        with service_lock:
+            if body_fetcher is None:
+                body_fetcher = BodyFetcher(
+                    workers=int(os.environ.get('DEEP_FETCH_WORKERS', '4')),
+                    host_rate=float(os.environ.get('DEEP_HOST_RATE', '2')),
+                    cache_size=int(os.environ.get('DEEP_CACHE_SIZE', '2000')),
+                )
+    return body_fetcher
+
 def disable_telegram_webhook(bot_token):
     """禁用Telegram webhook"""
     try:
-        requests.post(f"https://api.telegram.org/bot{bot_token}/deleteWebhook", timeout=10)
+        api_request(bot_token, "deleteWebhook", timeout=10)
     except Exception as e:
         logger.warning(f"删除 webhook 失败: {e}")
 
+def set_telegram_webhook(bot_token, url, secret):
+    """注册Telegram webhook"""
+    try:
+        data = {"url": url, "allowed_updates": json.dumps(["message"])}
+        if secret:
+            data["secret_token"] = secret
+        resp = api_request(bot_token, "setWebhook", data=data, timeout=10)
+        if resp.status_code != 200:
+            logger.error(f"设置 webhook 失败，状态码: {resp.status_code}")
+            return False
+        return True
+    except Exception as e:
+        logger.error(f"设置 webhook 失败: {e}")
+        return False
+
 def set_telegram_bot_commands(bot_token):
     """设置Telegram机器人命令菜单"""
     commands = [
-        {"command": "add", "description": "添加规则 /add [clean|clean-i|clean-e] kw1 [kw2...] [+inc] [-exc]"},
+        {"command": "add", "description": "添加规则 /add [clean|clean-i|clean-e] kw1 [kw2...] [+inc] [-exc] [@feed]"},
         {"command": "del", "description": "删除规则 /del kw1 [kw2...]"},
         {"command": "list", "description": "查看规则"},
         {"command": "include", "description": "设置默认必含 /include kw1 [kw2...]"},
@@ -213,13 +509,20 @@ def set_telegram_bot_commands(bot_token):
         {"command": "setsummary", "description": "设置: 匹配摘要 on/off"},
         {"command": "setfullword", "description": "设置: 完整词匹配 on/off"},
         {"command": "setregex", "description": "设置: 正则匹配 on/off"},
+        {"command": "setdigest", "description": "设置: 合并推送 on/off [窗口秒数]"},
+        {"command": "setdeep", "description": "设置: 深度匹配帖子正文 on/off"},
+        {"command": "setbackfill", "description": "设置: 新规则回溯最近帖子 on/off"},
         {"command": "setinterval", "description": "设置: 检测间隔 /setinterval 30 60。（仅管理员）"},
+        {"command": "search", "description": "搜索历史帖子 /search kw1 [kw2...] [@feed] [7d]"},
+        {"command": "feeds", "description": "查看订阅源"},
+        {"command": "addfeed", "description": "添加订阅源 /addfeed name url [interval]（仅管理员）"},
+        {"command": "delfeed", "description": "删除订阅源 /delfeed name（仅管理员）"},
+        {"command": "debugmem", "description": "内存诊断（仅管理员）"},
         {"command": "status", "description": "查看状态"},
         {"command": "help", "description": "帮助说明"},
     ]
     try:
-        requests.post(f"https://api.telegram.org/bot{bot_token}/setMyCommands", 
-                     json={"commands": commands}, timeout=10)
+        api_request(bot_token, "setMyCommands", json={"commands": commands}, timeout=10)
     except Exception as e:
         logger.warning(f"设置命令菜单失败: {e}")
 
@@ -237,6 +540,555 @@ def bool_from_text(text):
     return t in ('on', 'true', '1', 'yes', 'y')
 
 # --- 核心逻辑 ---
+def handle_update(update, bot_token):
+    """处理一条 Telegram 更新（命令）"""
+    chat_id = None
+    editor = None
+    events = []  # 本条命令产生的配置变更事件
+    try:
+        message = update.get("message")
+        if not message: 
+            return
+
+        chat_id = str(message.get("chat", {}).get("id"))
+        text = message.get("text", "").strip()
+        msg_id = message.get("message_id")
+
+        if not text: 
+            return
+
+        parts = text.split(maxsplit=1)
+        cmd_raw = parts[0].split('@')[0].lower()
+        args_str = parts[1] if len(parts) > 1 else ""
+
+        editor = UserConfigEditor(get_user_config(chat_id))
+        user_conf = editor.write() if cmd_raw in USER_CONFIG_COMMANDS else editor.read()
+        users_keywords = user_conf['keywords']
+        users_defaults = user_conf['defaults']
+
+        # 处理 /add 命令
+        if cmd_raw == "/add":
+            if not args_str:
+                send_telegram_message("❌ 请输入参数。示例：/add mk clean +出", bot_token, chat_id, msg_id)
+                return
+
+            tokens = args_str.split()
+
+            # 解析 flags 和 switches
+            flags = []
+            switches_inc = []
+            switches_exc = []
+            keywords = []
+            scope = None  # @订阅源：限定规则生效的订阅源，@all 取消限定
+
+            for t in tokens:
+                tl = t.lower()
+                if tl in ('clean', 'clean-i', 'clean-e'):
+                    flags.append(tl)
+                elif t.startswith('@') and len(t) > 1:
+                    scope = scope or []
+                    if tl != '@all':
+                        scope.append(t[1:])
+                elif t.startswith('+') and len(t) > 1:
+                    switches_inc.append(t[1:])
+                elif t.startswith('-') and len(t) > 1:
+                    switches_exc.append(t[1:])
+                else:
+                    keywords.append(t)
+
+            if not keywords:
+                send_telegram_message("❌ 未识别到关键词", bot_token, chat_id, msg_id)
+                return
+
+            # 验证关键词
+            invalid_keywords = [kw for kw in keywords if not validate_keyword(kw)]
+            if invalid_keywords:
+                send_telegram_message(f"❌ 关键词不合法: {', '.join(invalid_keywords)}", bot_token, chat_id, msg_id)
+                return
+            bad_regex = invalid_regex_terms(user_conf, keywords + switches_inc + switches_exc)
+            if bad_regex:
+                send_telegram_message(f"❌ 正则表达式不合法: {', '.join(bad_regex)}", bot_token, chat_id, msg_id)
+                return
+            if scope:
+                feed_names = [f['name'] for f in get_feeds(config_snapshot.system)]
+                unknown = [n for n in scope if n not in feed_names]
+                if unknown:
+                    send_telegram_message(f"❌ 未知的订阅源: {', '.join(unknown)}（可用: {', '.join(feed_names)}）", bot_token, chat_id, msg_id)
+                    return
+
+            logs = []
+            for kw in keywords:
+                # 查找或创建
+                rule = next((x for x in users_keywords if x['word'] == kw), None)
+                is_new = False
+                if not rule:
+                    rule = {"word": kw, "include": [], "exclude": []}
+                    users_keywords.append(rule)
+                    is_new = True
+                events.append(RuleUpserted(chat_id, kw))
+
+                # 处理 clean
+                if 'clean' in flags:
+                    rule['include'] = []
+                    rule['exclude'] = []
+                else:
+                    if 'clean-i' in flags: 
+                        rule['include'] = []
+                    if 'clean-e' in flags: 
+                        rule['exclude'] = []
+
+                # 处理 defaults (仅新建且未clean时)
+                if is_new and not flags:
+                    for d_inc in users_defaults.get('include', []):
+                        if d_inc not in rule['include']: 
+                            rule['include'].append(d_inc)
+                    for d_exc in users_defaults.get('exclude', []):
+                        if d_exc not in rule['exclude']: 
+                            rule['exclude'].append(d_exc)
+
+                # 处理 switches
+                for inc in switches_inc:
+                    if inc not in rule['include']: 
+                        rule['include'].append(inc)
+                for exc in switches_exc:
+                    if exc not in rule['exclude']: 
+                        rule['exclude'].append(exc)
+
+                # 处理订阅源限定
+                if scope is not None:
+                    if scope:
+                        rule['feeds'] = list(dict.fromkeys(scope))
+                    else:
+                        rule.pop('feeds', None)
+
+                # 生成日志
+                info = f"<b>{kw}</b>"
+                extras = []
+                if rule['include']: 
+                    extras.append(f"➕ 必含: [{','.join(rule['include'])}]")
+                if rule['exclude']: 
+                    extras.append(f"⛔ 排除: [{','.join(rule['exclude'])}]")
+                if rule.get('feeds'): 
+                    extras.append(f"📡 来源: [{','.join(rule['feeds'])}]")
+                if extras: 
+                    info += " " + " ".join(extras)
+                logs.append(info)
+
+            send_telegram_message("✅ 规则已更新：\n" + "\n".join(logs), bot_token, chat_id, msg_id)
+
+            # 回溯匹配：新规则立即在最近的帖子中查找，命中合并为一条消息
+            if recent_entries is not None and user_conf['settings'].get('backfill', True):
+                t0 = time.perf_counter()
+                scanned, hits = backfill(recent_entries, chat_id, user_conf, keywords)
+                logger.info(f"用户 {chat_id} 回溯匹配 {scanned} 条，命中 {len(hits)} 条，"
+                            f"耗时 {(time.perf_counter() - t0) * 1000:.1f}ms")
+                if hits:
+                    send_telegram_message(format_backfill(scanned, hits), bot_token, chat_id, msg_id)
+
+        # 处理 /del 命令
+        elif cmd_raw == "/del":
+            targets = args_str.split()
+            if not targets:
+                send_telegram_message("❌ 请指定要删除的关键词", bot_token, chat_id, msg_id)
+                return
+            deleted = []
+            for kw in targets:
+                initial_len = len(user_conf['keywords'])
+                user_conf['keywords'] = [r for r in user_conf['keywords'] if r['word'] != kw]
+                if len(user_conf['keywords']) < initial_len:
+                    deleted.append(kw)
+                    events.append(RuleRemoved(chat_id, kw))
+            if deleted:
+                send_telegram_message(f"🗑️ 已删除: {', '.join(deleted)}", bot_token, chat_id, msg_id)
+            else:
+                send_telegram_message("⚠️ 未找到匹配的规则", bot_token, chat_id, msg_id)
+
+        # 处理 /list 命令
+        elif cmd_raw == "/list":
+            msg_lines = ["<b>📋 您的配置</b>"]
+            defs = []
+            if users_defaults.get('include'): 
+                defs.append(f"默认必含: {','.join(users_defaults['include'])}")
+            if users_defaults.get('exclude'): 
+                defs.append(f"默认排除: {','.join(users_defaults['exclude'])}")
+            if defs:
+                msg_lines.append("<i>默认模板:</i>")
+                msg_lines.extend([f"  {d}" for d in defs])
+                msg_lines.append("")
+            if users_keywords:
+                msg_lines.append(f"<i>监控规则 ({len(users_keywords)}):</i>")
+                for i, r in enumerate(users_keywords):
+                    line = f"{i+1}. <b>{r['word']}</b>"
+                    extras = []
+                    if r.get('include'): 
+                        extras.append(f"➕ 包含: {', '.join(r['include'])}")
+                    if r.get('exclude'): 
+                        extras.append(f"⛔ 排除: {', '.join(r['exclude'])}")
+                    if r.get('feeds'): 
+                        extras.append(f"📡 来源: {', '.join(r['feeds'])}")
+                    if extras: 
+                        line += f" ({' '.join(extras)})"
+                    msg_lines.append(line)
+            else:
+                msg_lines.append("（暂无监控规则）")
+            g_exc = user_conf.get('global_exclude', [])
+            if g_exc:
+                msg_lines.append("")
+                msg_lines.append(f"<i>全局屏蔽:</i> {', '.join(g_exc)}")
+            send_telegram_message("\n".join(msg_lines), bot_token, chat_id, msg_id)
+
+        # 处理 /include 和 /exclude 命令
+        elif cmd_raw == "/include":
+            if not args_str:
+                user_conf['defaults']['include'] = []
+                events.append(DefaultsChanged(chat_id))
+                send_telegram_message("✅ 已清空默认必含关键词", bot_token, chat_id, msg_id)
+            else:
+                kws = args_str.split()
+                bad_regex = invalid_regex_terms(user_conf, kws)
+                if bad_regex:
+                    send_telegram_message(f"❌ 正则表达式不合法: {', '.join(bad_regex)}", bot_token, chat_id, msg_id)
+                    return
+                user_conf['defaults']['include'] = list(dict.fromkeys(kws))
+                events.append(DefaultsChanged(chat_id))
+                send_telegram_message(f"✅ 默认必含已设为: {', '.join(kws)}", bot_token, chat_id, msg_id)
+
+        elif cmd_raw == "/exclude":
+            if not args_str:
+                user_conf['defaults']['exclude'] = []
+                events.append(DefaultsChanged(chat_id))
+                send_telegram_message("✅ 已清空默认排除关键词", bot_token, chat_id, msg_id)
+            else:
+                kws = args_str.split()
+                bad_regex = invalid_regex_terms(user_conf, kws)
+                if bad_regex:
+                    send_telegram_message(f"❌ 正则表达式不合法: {', '.join(bad_regex)}", bot_token, chat_id, msg_id)
+                    return
+                user_conf['defaults']['exclude'] = list(dict.fromkeys(kws))
+                events.append(DefaultsChanged(chat_id))
+                send_telegram_message(f"✅ 默认排除已设为: {', '.join(kws)}", bot_token, chat_id, msg_id)
+
+        # 处理 /block 和 /unblock 命令
+        elif cmd_raw in ("/block", "/unblock"):
+            kws = args_str.split()
+            if not kws:
+                send_telegram_message(f"❌ 请指定关键词", bot_token, chat_id, msg_id)
+                return
+            g_exc = user_conf.get('global_exclude', [])
+            changed = False
+            if cmd_raw == "/block":
+                bad_regex = invalid_regex_terms(user_conf, kws)
+                if bad_regex:
+                    send_telegram_message(f"❌ 正则表达式不合法: {', '.join(bad_regex)}", bot_token, chat_id, msg_id)
+                    return
+                for k in kws:
+                    if k not in g_exc:
+                        g_exc.append(k)
+                        changed = True
+                if changed:
+                    user_conf['global_exclude'] = g_exc
+                    events.append(BlocklistChanged(chat_id))
+                    send_telegram_message(f"🚫 已添加到全局屏蔽", bot_token, chat_id, msg_id)
+            else:
+                initial_len = len(g_exc)
+                user_conf['global_exclude'] = [x for x in g_exc if x not in kws]
+                if len(user_conf['global_exclude']) < initial_len:
+                    events.append(BlocklistChanged(chat_id))
+                    send_telegram_message(f"✅ 已解除屏蔽", bot_token, chat_id, msg_id)
+                else:
+                    send_telegram_message("⚠️ 未找到相关屏蔽词", bot_token, chat_id, msg_id)
+
+        # 处理 /blocklist 命令
+        elif cmd_raw == "/blocklist":
+            g_exc = user_conf.get('global_exclude', [])
+            if not g_exc:
+                send_telegram_message("🚫 全局屏蔽列表为空", bot_token, chat_id, msg_id)
+            else:
+                send_telegram_message(f"<b>🚫 全局屏蔽列表</b>\n{', '.join(g_exc)}", bot_token, chat_id, msg_id)
+
+        # 处理设置命令
+        elif cmd_raw == "/setsummary":
+            val = bool_from_text(args_str)
+            user_conf['settings']['match_summary'] = val
+            events.append(SettingChanged(chat_id, 'match_summary'))
+            send_telegram_message(f"🔎 摘要匹配: {'开启' if val else '关闭'}", bot_token, chat_id, msg_id)
+
+        elif cmd_raw == "/setfullword":
+            val = bool_from_text(args_str)
+            user_conf['settings']['full_word_match'] = val
+            events.append(SettingChanged(chat_id, 'full_word_match'))
+            send_telegram_message(f"🧩 完整词匹配: {'开启' if val else '关闭'}", bot_token, chat_id, msg_id)
+
+        elif cmd_raw == "/setregex":
+            val = bool_from_text(args_str)
+            user_conf['settings']['regex_match'] = val
+            events.append(SettingChanged(chat_id, 'regex_match'))
+            msg = f"🧠 正则匹配: {'开启' if val else '关闭'}"
+            if val:
+                terms = list(user_conf.get('global_exclude', []))
+                for r in user_conf['keywords']:
+                    terms += [r['word']] + r.get('include', []) + r.get('exclude', [])
+                bad_regex = invalid_regex_terms(user_conf, list(dict.fromkeys(terms)))
+                if bad_regex:
+                    msg += f"\n⚠️ 以下规则不是合法正则，将被跳过: {', '.join(bad_regex)}"
+            send_telegram_message(msg, bot_token, chat_id, msg_id)
+
+        elif cmd_raw == "/setdigest":
+            parts = args_str.split()
+            val = bool_from_text(parts[0]) if parts else False
+            if len(parts) > 1:
+                if not parts[1].isdigit() or not 10 <= int(parts[1]) <= 3600:
+                    send_telegram_message("❌ 格式: /setdigest on 60（窗口 10-3600 秒）", bot_token, chat_id, msg_id)
+                    return
+                user_conf['settings']['digest_window'] = int(parts[1])
+            user_conf['settings']['digest'] = val
+            events.append(SettingChanged(chat_id, 'digest'))
+            window = user_conf['settings'].get('digest_window', 60)
+            send_telegram_message(f"📬 合并推送: {'开启' if val else '关闭'}（窗口 {window} 秒）", bot_token, chat_id, msg_id)
+
+        elif cmd_raw == "/setdeep":
+            val = bool_from_text(args_str)
+            user_conf['settings']['deep_match'] = val
+            events.append(SettingChanged(chat_id, 'deep_match'))
+            send_telegram_message(f"📄 深度匹配（帖子正文）: {'开启' if val else '关闭'}", bot_token, chat_id, msg_id)
+
+        elif cmd_raw == "/setbackfill":
+            val = bool_from_text(args_str)
+            user_conf['settings']['backfill'] = val
+            events.append(SettingChanged(chat_id, 'backfill'))
+            send_telegram_message(f"⏪ 新规则回溯匹配: {'开启' if val else '关闭'}", bot_token, chat_id, msg_id)
+
+        # 处理 /setinterval 命令（仅管理员）
+        elif cmd_raw == "/setinterval":
+            admin_id = os.environ.get('TG_CHAT_ID', '').strip()
+            if chat_id != admin_id:
+                send_telegram_message("⛔ 只有管理员可以使用此命令", bot_token, chat_id, msg_id)
+                return
+            parts = args_str.split()
+            if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
+                with config_lock:
+                    global_config['system']['check_min_interval'] = int(parts[0])
+                    global_config['system']['check_max_interval'] = int(parts[1])
+                save_system_config()
+                send_telegram_message(f"⏱️ 间隔已设为 {parts[0]}-{parts[1]}秒", bot_token, chat_id, msg_id)
+            else:
+                send_telegram_message("❌ 格式: /setinterval 30 60", bot_token, chat_id, msg_id)
+
+        # 处理订阅源管理命令（/feeds 所有人可查看，增删仅管理员）
+        elif cmd_raw == "/feeds":
+            lines = ["<b>📡 订阅源</b>"]
+            for f in get_feeds(config_snapshot.system):
+                if 'min_interval' in f:
+                    timing = f"自适应 {f['min_interval']}-{f['max_interval']}s"
+                else:
+                    timing = f"{f['interval']}+{f['jitter']}s"
+                lines.append(f"<b>{f['name']}</b> {f['url']} ({timing})")
+            send_telegram_message("\n".join(lines), bot_token, chat_id, msg_id)
+
+        # 处理 /search 命令：在归档中检索同时包含所有关键词的帖子
+        elif cmd_raw == "/search":
+            if archive is None:
+                send_telegram_message("⚠️ 帖子归档未开启", bot_token, chat_id, msg_id)
+                return
+            terms, feed, days = [], None, None
+            for t in args_str.split():
+                if t.startswith('@') and len(t) > 1:
+                    feed = t[1:]
+                elif re.fullmatch(r'\d{1,4}d', t.lower()):
+                    days = int(t[:-1])
+                else:
+                    terms.append(t)
+            if not terms:
+                send_telegram_message("❌ 请输入关键词。示例：/search 甲骨文 7d", bot_token, chat_id, msg_id)
+                return
+            with metric_search_seconds.time():
+                total, posts = archive.search(terms, days=days, feed=feed)
+            send_telegram_message(format_results(" ".join(terms), total, posts), bot_token, chat_id, msg_id)
+
+        # 处理 /debugmem 命令（仅管理员）
+        elif cmd_raw == "/debugmem":
+            if chat_id != os.environ.get('TG_CHAT_ID', '').strip():
+                send_telegram_message("⛔ 只有管理员可以使用此命令", bot_token, chat_id, msg_id)
+                return
+            if mem_diag is not None:
+                msg = "<b>🧪 内存诊断</b>\n" + mem_diag.report()
+            else:
+                top = object_counts().most_common(10)
+                msg = (
+                    "<b>🧪 内存诊断</b>（未开启，设置 MEM_DEBUG=1 后重启可记录增长趋势）\n"
+                    f"内存占用: {psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024:.1f} MB\n"
+                    + "\n".join(f"{name}: {n}" for name, n in top)
+                )
+            send_telegram_message(msg, bot_token, chat_id, msg_id)
+
+        elif cmd_raw in ("/addfeed", "/delfeed"):
+            admin_id = os.environ.get('TG_CHAT_ID', '').strip()
+            if chat_id != admin_id:
+                send_telegram_message("⛔ 只有管理员可以使用此命令", bot_token, chat_id, msg_id)
+                return
+            parts = args_str.split()
+            if cmd_raw == "/addfeed":
+                if len(parts) not in (2, 3) or not FEED_NAME_RE.match(parts[0]) \
+                        or not parts[1].startswith(('http://', 'https://')) \
+                        or (len(parts) == 3 and not parts[2].isdigit()):
+                    send_telegram_message("❌ 格式: /addfeed 名称 URL [间隔秒]", bot_token, chat_id, msg_id)
+                    return
+                feed = {'name': parts[0], 'url': parts[1]}
+                if len(parts) == 3:
+                    feed['interval'] = max(10, int(parts[2]))
+                with config_lock:
+                    system = global_config['system']
+                    # 首次添加时把原有的默认源固化到列表中
+                    feeds = system.get('feeds') or [{'name': DEFAULT_FEED_NAME, 'url': system.get('rss_url')}]
+                    system['feeds'] = [f for f in feeds if f['name'] != feed['name']] + [feed]
+                save_system_config()
+                send_telegram_message(f"✅ 已添加订阅源 <b>{feed['name']}</b>", bot_token, chat_id, msg_id)
+            else:
+                if len(parts) != 1:
+                    send_telegram_message("❌ 格式: /delfeed 名称", bot_token, chat_id, msg_id)
+                    return
+                with config_lock:
+                    feeds = global_config['system'].get('feeds') or []
+                    remaining = [f for f in feeds if f['name'] != parts[0]]
+                    found = len(remaining) < len(feeds)
+                    if found:
+                        global_config['system']['feeds'] = remaining
+                if not found:
+                    send_telegram_message("⚠️ 未找到该订阅源", bot_token, chat_id, msg_id)
+                    return
+                save_system_config()
+                send_telegram_message(f"🗑️ 已删除订阅源 {parts[0]}", bot_token, chat_id, msg_id)
+
+        # 处理 /help 和 /start 命令
+        elif cmd_raw in ("/help", "/start"):
+            is_admin = (chat_id == os.environ.get('TG_CHAT_ID', '').strip())
+            msg = (
+                "<b>👋 NodeSeek 监控机器人</b>\n\n"
+                "<b>📝 规则管理</b>\n"
+                "/add [clean] 词1 [词2...] [+必含] [-排除] [@订阅源] - <i>批量添加</i>\n"
+                "/del 词1 [词2...] - <i>批量删除</i>\n"
+                "/list - <i>查看规则</i>\n"
+                "/block /unblock - <i>全局屏蔽</i>\n\n"
+                "<b>⚙️ 默认模板</b>\n"
+                "/include 词1 [词2...] - <i>设默认必含</i>\n"
+                "/exclude 词1 [词2...] - <i>设默认排除</i>\n\n"
+                "<b>🔧 个人设置</b>\n"
+                "/setsummary on/off - <i>匹配摘要</i>\n"
+                "/setfullword on/off - <i>完整词</i>\n"
+                "/setregex on/off - <i>正则</i>\n"
+                "/setdigest on/off [秒] - <i>合并推送</i>\n"
+                "/setdeep on/off - <i>深度匹配帖子正文</i>\n"
+                "/setbackfill on/off - <i>新规则回溯最近帖子</i>\n"
+                "/feeds - <i>查看订阅源</i>\n\n"
+                "<b>🔍 历史检索</b>\n"
+                "/search 词1 [词2...] [@订阅源] [7d] - <i>搜索已归档的帖子</i>\n"
+            )
+            if is_admin: 
+                msg += "\n<b>👮 管理员</b>\n/setinterval\n/addfeed 名称 URL [间隔] /delfeed 名称\n/debugmem\n"
+            msg += "\n/status - <i>查看状态</i>"
+            send_telegram_message(msg, bot_token, chat_id, msg_id)
+            
+        # 处理 /status 命令
+        elif cmd_raw == "/status":
+            mem = psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024
+            uptime = format_uptime()
+            min_int = global_config['system']['check_min_interval']
+            max_int = global_config['system']['check_max_interval']
+            proc_count = len(processed_ids)
+            my_rules = len(user_conf['keywords'])
+            settings = user_conf.get('settings', {})
+            match_summary = "开" if settings.get('match_summary') else "关"
+            full_word = "开" if settings.get('full_word_match') else "关"
+            regex = "开" if settings.get('regex_match') else "关"
+            digest = f"开({settings.get('digest_window', 60)}s)" if settings.get('digest') else "关"
+            backfill_on = "开" if settings.get('backfill', True) else "关"
+            deep = "开" if settings.get('deep_match') else "关"
+            sys_info = ""
+            if chat_id == os.environ.get('TG_CHAT_ID', '').strip():
+                sys_info = (
+                    f"\n<b>💻 系统指标</b>\n"
+                    f"检测间隔: {min_int}-{max_int}s（按发帖速率自适应）\n"
+                    f"已处理ID: {proc_count}\n"
+                    f"连续错误: {last_rss_error or '无'}\n"
+                )
+                if feed_scheduler is not None:
+                    sys_info += feed_scheduler.status_text()
+                multi = len(feed_fetchers) > 1
+                for name, fetcher in list(feed_fetchers.items()):
+                    sys_info += fetcher.status_text(name if multi else None)
+                sys_info += latency_stats.status_text()
+                sys_info += regex_guard.status_text()
+                if dispatcher is not None:
+                    sys_info += dispatcher.status_text()
+                if digest_buffer is not None:
+                    sys_info += f"合并缓冲: {digest_buffer.pending()} 条\n"
+                if shard_pool is not None:
+                    sys_info += shard_pool.status_text()
+                if body_fetcher is not None:
+                    sys_info += body_fetcher.status_text()
+                if archive is not None:
+                    sys_info += archive.status_text()
+            msg = (
+                f"<b>📊 状态报告</b>\n"
+                f"运行时间: {uptime}\n"
+                f"内存占用: {mem:.1f} MB\n"
+                f"您的规则: {my_rules} 条\n"
+                f"匹配摘要: {match_summary} | 全词匹配: {full_word} | 正则: {regex} | 正文: {deep}\n"
+                f"合并推送: {digest} | 回溯匹配: {backfill_on}\n"
+                f"{sys_info}"
+                f"\n最后检测: {last_rss_check_time.strftime('%H:%M:%S') if last_rss_check_time else '从未'}"
+            )
+            send_telegram_message(msg, bot_token, chat_id, msg_id)
+
+    except Exception as e:
+        logger.error(f"处理消息异常: {e}")
+    finally:
+        if editor is not None and editor.changed():
+            save_user_config(chat_id, editor.conf, events or None)
+
+def get_update_pool():
+    """获取命令处理线程池"""
+    global update_pool
+    if update_pool is None:
+        update_pool = KeyedWorkerPool(int(os.environ.get('TG_UPDATE_WORKERS', '4')), name="update")
+    return update_pool
+
+def dispatch_update(update, bot_token):
+    """把更新交给线程池，同一会话的更新按顺序处理"""
+    message = update.get("message") or {}
+    chat_key = str(message.get("chat", {}).get("id"))
+    get_update_pool().submit(chat_key, handle_update, update, bot_token)
+
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+def webhook_settings():
+    """
+    webhook 配置：返回 (host, port, url, secret, path)
+    TG_WEBHOOK_LISTEN 监听地址，TG_WEBHOOK_URL 为对外地址（设置后自动注册），TG_WEBHOOK_SECRET 为校验用的 secret token
+    未设置 secret 时默认只监听 127.0.0.1，且不允许对外监听或注册 URL（否则任何人都能伪造管理员命令）
+    """
+    secret = os.environ.get('TG_WEBHOOK_SECRET', '').strip()
+    listen = os.environ.get('TG_WEBHOOK_LISTEN', '0.0.0.0:8443' if secret else '127.0.0.1:8443')
+    host, _, port = listen.rpartition(':')
+    host = host.strip('[]') or ('0.0.0.0' if secret else '127.0.0.1')
+    url = os.environ.get('TG_WEBHOOK_URL', '').strip()
+    path = os.environ.get('TG_WEBHOOK_PATH', '/') or '/'
+    if not secret and (url or host not in LOOPBACK_HOSTS):
+        raise ValueError("webhook 模式对外监听或设置 TG_WEBHOOK_URL 时必须设置 TG_WEBHOOK_SECRET")
+    return host, int(port), url, secret, path
+
+def start_webhook_server():
+    """webhook 模式：由 Telegram 推送更新，不再长轮询（配置见 webhook_settings()）"""
+    global webhook_server
+    bot_token = os.environ.get('TG_BOT_TOKEN', '')
+    host, port, url, secret, path = webhook_settings()
+    webhook_server = WebhookServer(host, port, secret,
+                                   lambda update: dispatch_update(update, bot_token), path=path).start()
+    set_telegram_bot_commands(bot_token)
+    if url:
+        set_telegram_webhook(bot_token, url, secret)
+    return webhook_server
+
 def telegram_command_listener():
     """Telegram命令监听器"""
     while True:
@@ -254,8 +1106,8 @@ def telegram_command_listener():
     offset = 0
     while True:
         try:
-            url = f"https://api.telegram.org/bot{bot_token}/getUpdates"
-            resp = requests.get(url, params={"timeout": 60, "offset": offset}, timeout=65)
+            resp = api_request(bot_token, "getUpdates", http_method='GET',
+                               params={"timeout": 60, "offset": offset}, timeout=65)
             if resp.status_code != 200:
                 time.sleep(5)
                 continue
@@ -267,557 +1119,421 @@ def telegram_command_listener():
 
             for update in data.get("result", []):
                 offset = update["update_id"] + 1
-                chat_id = None
-                user_conf = None
-                __uc_orig = None
-                try:
-                    message = update.get("message")
-                    if not message: 
-                        continue
-
-                    chat_id = str(message.get("chat", {}).get("id"))
-                    text = message.get("text", "").strip()
-                    msg_id = message.get("message_id")
-
-                    if not text: 
-                        continue
-
-                    parts = text.split(maxsplit=1)
-                    cmd_raw = parts[0].split('@')[0].lower()
-                    args_str = parts[1] if len(parts) > 1 else ""
-
-                    user_conf = get_user_config(chat_id)
-                    __uc_orig = json.dumps(user_conf, ensure_ascii=False, sort_keys=True)
-                    users_keywords = user_conf['keywords']
-                    users_defaults = user_conf['defaults']
-
-                    # 处理 /add 命令
-                    if cmd_raw == "/add":
-                        if not args_str:
-                            send_telegram_message("❌ 请输入参数。示例：/add mk clean +出", bot_token, chat_id, msg_id)
-                            continue
-
-                        tokens = args_str.split()
-
-                        # 解析 flags 和 switches
-                        flags = []
-                        switches_inc = []
-                        switches_exc = []
-                        keywords = []
-
-                        for t in tokens:
-                            tl = t.lower()
-                            if tl in ('clean', 'clean-i', 'clean-e'):
-                                flags.append(tl)
-                            elif t.startswith('+') and len(t) > 1:
-                                switches_inc.append(t[1:])
-                            elif t.startswith('-') and len(t) > 1:
-                                switches_exc.append(t[1:])
-                            else:
-                                keywords.append(t)
-
-                        if not keywords:
-                            send_telegram_message("❌ 未识别到关键词", bot_token, chat_id, msg_id)
-                            continue
-
-                        # 验证关键词
-                        invalid_keywords = [kw for kw in keywords if not validate_keyword(kw)]
-                        if invalid_keywords:
-                            send_telegram_message(f"❌ 关键词不合法: {', '.join(invalid_keywords)}", bot_token, chat_id, msg_id)
-                            continue
-
-                        logs = []
-                        for kw in keywords:
-                            # 查找或创建
-                            rule = next((x for x in users_keywords if x['word'] == kw), None)
-                            is_new = False
-                            if not rule:
-                                rule = {"word": kw, "include": [], "exclude": []}
-                                users_keywords.append(rule)
-                                is_new = True
-
-                            # 处理 clean
-                            if 'clean' in flags:
-                                rule['include'] = []
-                                rule['exclude'] = []
-                            else:
-                                if 'clean-i' in flags: 
-                                    rule['include'] = []
-                                if 'clean-e' in flags: 
-                                    rule['exclude'] = []
-
-                            # 处理 defaults (仅新建且未clean时)
-                            if is_new and not flags:
-                                for d_inc in users_defaults.get('include', []):
-                                    if d_inc not in rule['include']: 
-                                        rule['include'].append(d_inc)
-                                for d_exc in users_defaults.get('exclude', []):
-                                    if d_exc not in rule['exclude']: 
-                                        rule['exclude'].append(d_exc)
-
-                            # 处理 switches
-                            for inc in switches_inc:
-                                if inc not in rule['include']: 
-                                    rule['include'].append(inc)
-                            for exc in switches_exc:
-                                if exc not in rule['exclude']: 
-                                    rule['exclude'].append(exc)
-
-                            # 生成日志
-                            info = f"<b>{kw}</b>"
-                            extras = []
-                            if rule['include']: 
-                                extras.append(f"➕ 必含: [{','.join(rule['include'])}]")
-                            if rule['exclude']: 
-                                extras.append(f"⛔ 排除: [{','.join(rule['exclude'])}]")
-                            if extras: 
-                                info += " " + " ".join(extras)
-                            logs.append(info)
-
-                        send_telegram_message("✅ 规则已更新：\n" + "\n".join(logs), bot_token, chat_id, msg_id)
-
-                    # 处理 /del 命令
-                    elif cmd_raw == "/del":
-                        targets = args_str.split()
-                        if not targets:
-                            send_telegram_message("❌ 请指定要删除的关键词", bot_token, chat_id, msg_id)
-                            continue
-                        deleted = []
-                        for kw in targets:
-                            initial_len = len(user_conf['keywords'])
-                            user_conf['keywords'] = [r for r in user_conf['keywords'] if r['word'] != kw]
-                            if len(user_conf['keywords']) < initial_len:
-                                deleted.append(kw)
-                        if deleted:
-                            send_telegram_message(f"🗑️ 已删除: {', '.join(deleted)}", bot_token, chat_id, msg_id)
-                        else:
-                            send_telegram_message("⚠️ 未找到匹配的规则", bot_token, chat_id, msg_id)
-
-                    # 处理 /list 命令
-                    elif cmd_raw == "/list":
-                        msg_lines = ["<b>📋 您的配置</b>"]
-                        defs = []
-                        if users_defaults.get('include'): 
-                            defs.append(f"默认必含: {','.join(users_defaults['include'])}")
-                        if users_defaults.get('exclude'): 
-                            defs.append(f"默认排除: {','.join(users_defaults['exclude'])}")
-                        if defs:
-                            msg_lines.append("<i>默认模板:</i>")
-                            msg_lines.extend([f"  {d}" for d in defs])
-                            msg_lines.append("")
-                        if users_keywords:
-                            msg_lines.append(f"<i>监控规则 ({len(users_keywords)}):</i>")
-                            for i, r in enumerate(users_keywords):
-                                line = f"{i+1}. <b>{r['word']}</b>"
-                                extras = []
-                                if r.get('include'): 
-                                    extras.append(f"➕ 包含: {', '.join(r['include'])}")
-                                if r.get('exclude'): 
-                                    extras.append(f"⛔ 排除: {', '.join(r['exclude'])}")
-                                if extras: 
-                                    line += f" ({' '.join(extras)})"
-                                msg_lines.append(line)
-                        else:
-                            msg_lines.append("（暂无监控规则）")
-                        g_exc = user_conf.get('global_exclude', [])
-                        if g_exc:
-                            msg_lines.append("")
-                            msg_lines.append(f"<i>全局屏蔽:</i> {', '.join(g_exc)}")
-                        send_telegram_message("\n".join(msg_lines), bot_token, chat_id, msg_id)
-
-                    # 处理 /include 和 /exclude 命令
-                    elif cmd_raw == "/include":
-                        if not args_str:
-                            user_conf['defaults']['include'] = []
-                            send_telegram_message("✅ 已清空默认必含关键词", bot_token, chat_id, msg_id)
-                        else:
-                            kws = args_str.split()
-                            user_conf['defaults']['include'] = list(dict.fromkeys(kws))
-                            send_telegram_message(f"✅ 默认必含已设为: {', '.join(kws)}", bot_token, chat_id, msg_id)
-
-                    elif cmd_raw == "/exclude":
-                        if not args_str:
-                            user_conf['defaults']['exclude'] = []
-                            send_telegram_message("✅ 已清空默认排除关键词", bot_token, chat_id, msg_id)
-                        else:
-                            kws = args_str.split()
-                            user_conf['defaults']['exclude'] = list(dict.fromkeys(kws))
-                            send_telegram_message(f"✅ 默认排除已设为: {', '.join(kws)}", bot_token, chat_id, msg_id)
-
-                    # 处理 /block 和 /unblock 命令
-                    elif cmd_raw in ("/block", "/unblock"):
-                        kws = args_str.split()
-                        if not kws:
-                            send_telegram_message(f"❌ 请指定关键词", bot_token, chat_id, msg_id)
-                            continue
-                        g_exc = user_conf.get('global_exclude', [])
-                        changed = False
-                        if cmd_raw == "/block":
-                            for k in kws:
-                                if k not in g_exc:
-                                    g_exc.append(k)
-                                    changed = True
-                            if changed:
-                                user_conf['global_exclude'] = g_exc
-                                send_telegram_message(f"🚫 已添加到全局屏蔽", bot_token, chat_id, msg_id)
-                        else:
-                            initial_len = len(g_exc)
-                            user_conf['global_exclude'] = [x for x in g_exc if x not in kws]
-                            if len(user_conf['global_exclude']) < initial_len:
-                                send_telegram_message(f"✅ 已解除屏蔽", bot_token, chat_id, msg_id)
-                            else:
-                                send_telegram_message("⚠️ 未找到相关屏蔽词", bot_token, chat_id, msg_id)
-
-                    # 处理 /blocklist 命令
-                    elif cmd_raw == "/blocklist":
-                        g_exc = user_conf.get('global_exclude', [])
-                        if not g_exc:
-                            send_telegram_message("🚫 全局屏蔽列表为空", bot_token, chat_id, msg_id)
-                        else:
-                            send_telegram_message(f"<b>🚫 全局屏蔽列表</b>\n{', '.join(g_exc)}", bot_token, chat_id, msg_id)
-
-                    # 处理设置命令
-                    elif cmd_raw == "/setsummary":
-                        val = bool_from_text(args_str)
-                        user_conf['settings']['match_summary'] = val
-                        send_telegram_message(f"🔎 摘要匹配: {'开启' if val else '关闭'}", bot_token, chat_id, msg_id)
-
-                    elif cmd_raw == "/setfullword":
-                        val = bool_from_text(args_str)
-                        user_conf['settings']['full_word_match'] = val
-                        send_telegram_message(f"🧩 完整词匹配: {'开启' if val else '关闭'}", bot_token, chat_id, msg_id)
-
-                    elif cmd_raw == "/setregex":
-                        val = bool_from_text(args_str)
-                        user_conf['settings']['regex_match'] = val
-                        send_telegram_message(f"🧠 正则匹配: {'开启' if val else '关闭'}", bot_token, chat_id, msg_id)
-
-                    # 处理 /setinterval 命令（仅管理员）
-                    elif cmd_raw == "/setinterval":
-                        admin_id = os.environ.get('TG_CHAT_ID', '').strip()
-                        if chat_id != admin_id:
-                            send_telegram_message("⛔ 只有管理员可以使用此命令", bot_token, chat_id, msg_id)
-                            continue
-                        parts = args_str.split()
-                        if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
-                            with config_lock:
-                                global_config['system']['check_min_interval'] = int(parts[0])
-                                global_config['system']['check_max_interval'] = int(parts[1])
-                            save_main_config()
-                            send_telegram_message(f"⏱️ 间隔已设为 {parts[0]}-{parts[1]}秒", bot_token, chat_id, msg_id)
-                        else:
-                            send_telegram_message("❌ 格式: /setinterval 30 60", bot_token, chat_id, msg_id)
-
-                    # 处理 /help 和 /start 命令
-                    elif cmd_raw in ("/help", "/start"):
-                        is_admin = (chat_id == os.environ.get('TG_CHAT_ID', '').strip())
-                        msg = (
-                            "<b>👋 NodeSeek 监控机器人</b>\n\n"
-                            "<b>📝 规则管理</b>\n"
-                            "/add [clean] 词1 [词2...] [+必含] [-排除] - <i>批量添加</i>\n"
-                            "/del 词1 [词2...] - <i>批量删除</i>\n"
-                            "/list - <i>查看规则</i>\n"
-                            "/block /unblock - <i>全局屏蔽</i>\n\n"
-                            "<b>⚙️ 默认模板</b>\n"
-                            "/include 词1 [词2...] - <i>设默认必含</i>\n"
-                            "/exclude 词1 [词2...] - <i>设默认排除</i>\n\n"
-                            "<b>🔧 个人设置</b>\n"
-                            "/setsummary on/off - <i>匹配摘要</i>\n"
-                            "/setfullword on/off - <i>完整词</i>\n"
-                            "/setregex on/off - <i>正则</i>\n"
-                        )
-                        if is_admin: 
-                            msg += "\n<b>👮 管理员</b>\n/setinterval\n"
-                        msg += "\n/status - <i>查看状态</i>"
-                        send_telegram_message(msg, bot_token, chat_id, msg_id)
-                        
-                    # 处理 /status 命令
-                    elif cmd_raw == "/status":
-                        mem = psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024
-                        uptime = format_uptime()
-                        min_int = global_config['system']['check_min_interval']
-                        max_int = global_config['system']['check_max_interval']
-                        proc_count = len(processed_ids)
-                        my_rules = len(user_conf['keywords'])
-                        settings = user_conf.get('settings', {})
-                        match_summary = "开" if settings.get('match_summary') else "关"
-                        full_word = "开" if settings.get('full_word_match') else "关"
-                        regex = "开" if settings.get('regex_match') else "关"
-                        sys_info = ""
-                        if chat_id == os.environ.get('TG_CHAT_ID', '').strip():
-                            sys_info = (
-                                f"\n<b>💻 系统指标</b>\n"
-                                f"检测间隔: {min_int}-{max_int}s\n"
-                                f"已处理ID: {proc_count}\n"
-                                f"连续错误: {last_rss_error or '无'}\n"
-                            )
-                        msg = (
-                            f"<b>📊 状态报告</b>\n"
-                            f"运行时间: {uptime}\n"
-                            f"内存占用: {mem:.1f} MB\n"
-                            f"您的规则: {my_rules} 条\n"
-                            f"匹配摘要: {match_summary} | 全词匹配: {full_word} | 正则: {regex}\n"
-                            f"{sys_info}"
-                            f"\n最后检测: {last_rss_check_time.strftime('%H:%M:%S') if last_rss_check_time else '从未'}"
-                        )
-                        send_telegram_message(msg, bot_token, chat_id, msg_id)
-
-                except Exception as e:
-                    logger.error(f"处理消息异常: {e}")
-                finally:
-                    if user_conf is not None and __uc_orig is not None:
-                        __uc_new = json.dumps(user_conf, ensure_ascii=False, sort_keys=True)
-                        if __uc_new != __uc_orig:
-                            with config_lock:
-                                global_config['users'][chat_id] = user_conf
-                            save_main_config()
-            time.sleep(1)
+                dispatch_update(update, bot_token)
         except Exception as e:
             logger.error(f"指令监听异常: {e}")
             time.sleep(5)
 
-def check_rss_feed():
-    """检查RSS订阅源"""
-    global last_rss_check_time, last_rss_error
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }
-        rss_url = global_config['system'].get('rss_url', 'https://rss.nodeseek.com/')
-        resp = requests.get(rss_url, headers=headers, timeout=30)
-        if resp.status_code != 200: 
-            return
-
-        feed = feedparser.parse(resp.content)
-        if not feed.entries: 
-            return
-
-        last_rss_check_time = datetime.datetime.now()
-        last_rss_error = None
-        bot_token = os.environ.get('TG_BOT_TOKEN')
-        if not bot_token: 
-            return
-
-        regex_cache = {}
-        processed_changed = False
+def feed_poll_context(feed=None):
+    """本轮轮询使用的 (配置快照, 订阅源列表, 订阅源, 抓取器)，同一轮内只读取一次快照"""
+    snap = config_snapshot
+    feeds = get_feeds(snap.system)
+    if feed is None:
+        feed = feeds[0]
+    fetcher = feed_fetchers.get(feed['name'])
+    if fetcher is None or fetcher.url != feed['url']:
+        fetcher = feed_fetchers[feed['name']] = FeedFetcher(feed['url'])
+    return snap, feeds, feed, fetcher
+
+def feed_poll_failed(name, e):
+    """记录一次抓取异常，返回 False"""
+    global last_rss_error
+    metric_polls.inc(feed=name, result='exception')
+    last_rss_error = f"{name}: {e}"
+    logger.error(f"RSS检测失败 ({name}): {e}")
+    return False
 
-        for entry in feed.entries:
-            link = getattr(entry, 'link', '').strip()
-            if not link: 
-                continue
-            # 使用链接中的帖子ID作为key，更稳定
-            post_id_match = re.search(r"post-(\d+)", link)
-            if post_id_match:
-                key = post_id_match.group(1)
-            elif hasattr(entry, "id") and entry.id: 
-                key = entry.id
-            else: 
-                key = hashlib.md5(link.encode()).hexdigest()
-
-            # 快速跳过已处理的条目
-            with config_lock:
-                if key in processed_ids:
-                    continue
-
-            # 立即标记为已处理，避免重复
-            with config_lock:
-                processed_ids.add(key)
-                processed_changed = True
-
-            title = getattr(entry, 'title', '').strip()
-            summary = getattr(entry, 'summary', '') or getattr(entry, 'description', '')
-            author = getattr(entry, 'author', '') or getattr(entry, 'dc_creator', '') or 'unknown'
-
-            # 清理HTML标签
-            def clean_html(t): 
-                return re.sub(r'<[^>]+>', '', t).strip()
-            title = clean_html(title)
-            summary = clean_html(summary)
-            author = clean_html(author)
-            
-            # 解析发布时间
-            pub_date_str = ""
-            try:
-                if hasattr(entry, 'published_parsed') and entry.published_parsed:
-                    dt_utc = datetime.datetime(*entry.published_parsed[:6])
-                    dt_bj = dt_utc + datetime.timedelta(hours=8)
-                    pub_date_str = dt_bj.strftime('%Y-%m-%d %H:%M:%S')
-                elif hasattr(entry, 'updated_parsed') and entry.updated_parsed:
-                    dt_utc = datetime.datetime(*entry.updated_parsed[:6])
-                    dt_bj = dt_utc + datetime.timedelta(hours=8)
-                    pub_date_str = dt_bj.strftime('%Y-%m-%d %H:%M:%S')
-            except Exception as e:
-                logger.debug(f"解析发布时间失败: {e}")
-            
-            # 遍历所有用户进行匹配
-            with config_lock:
-                users_copy = copy.deepcopy(global_config['users'])
-            
-            for chat_id, user_conf in users_copy.items():
-                keywords = user_conf['keywords']
-                if not keywords: 
-                    continue
-                settings = user_conf['settings']
-                match_summary = settings.get('match_summary', False)
-                full_word = settings.get('full_word_match', False)
-                use_regex = settings.get('regex_match', False)
-                
-                text_to_check = title.lower()
-                if match_summary: 
-                    text_to_check += " " + summary.lower()
-                
-                # 检查全局屏蔽
-                is_blocked = False
-                for block in user_conf.get('global_exclude', []):
-                    if check_match(text_to_check, block.lower(), False, use_regex, regex_cache):
-                        is_blocked = True
-                        break
-                if is_blocked: 
-                    continue
-                
-                # 检查关键词匹配
-                matched_rules = []
-                for rule in keywords:
-                    base = rule['word'].lower()
-                    if not check_match(text_to_check, base, full_word, use_regex, regex_cache): 
-                        continue
-                    
-                    # 检查排除词
-                    hit_ex = False
-                    for ex in rule.get('exclude', []):
-                        if check_match(text_to_check, ex.lower(), False, use_regex, regex_cache):
-                            hit_ex = True
-                            break
-                    if hit_ex: 
-                        continue
-                    
-                    # 检查必含词
-                    includes = rule.get('include', [])
-                    if includes:
-                        hit_in = False
-                        for inc in includes:
-                            if check_match(text_to_check, inc.lower(), False, use_regex, regex_cache):
-                                hit_in = True
-                                break
-                        if not hit_in: 
-                            continue
-                    matched_rules.append(rule['word'])
-                
-                # 发送匹配通知
-                if matched_rules:
-                    kws_str = ", ".join(matched_rules)
-                    msg = (
-                        f"<b>🎯 发现命中帖子</b>\n"
-                        f"• <b>标题</b>：{title}\n"
-                        f"• <b>匹配</b>：{kws_str}\n"
-                        f"• <b>作者</b>：{author}\n"
-                        f"• <b>时间</b>：{pub_date_str}\n"
-                        f"• <b>链接</b>：{link}"
-                    )
-                    if send_telegram_message(msg, bot_token, chat_id):
-                        logger.info(f"向用户 {chat_id} 推送: {title} (规则: {kws_str})")
-            
-            # 标记为已处理
-            with config_lock:
-                if key not in processed_ids:
-                    processed_ids.add(key)
-                    processed_changed = True
-
-        # 保存已处理ID
-        if processed_changed: 
-            save_processed()
-            
+def check_rss_feed(feed=None):
+    """检查一个RSS订阅源，返回是否抓取成功（供调度器决定退避）"""
+    snap, feeds, feed, fetcher = feed_poll_context(feed)
+    try:
+        parses = fetcher.parses
+        checked, entries = fetcher.poll(processed_ids.__contains__)
+        return process_feed_poll(snap, feeds, feed, fetcher, parses, checked, entries)
     except Exception as e:
-        last_rss_error = str(e)
-        logger.error(f"RSS检测失败: {e}")
+        return feed_poll_failed(feed['name'], e)
+
+async def check_rss_feed_async(client, feed):
+    """
+    check_rss_feed() 的协程版本：在事件循环中异步抓取，匹配、去重记录、归档与推送入队放到线程中完成
+    （正则隔离进程的锁与等待、磁盘写入、深度匹配的正文抓取都会阻塞；AsyncDispatcher.submit() 可跨线程调用）
+    """
+    snap, feeds, feed, fetcher = feed_poll_context(feed)
+    try:
+        parses = fetcher.parses
+        checked, entries = await fetcher.poll_async(client, processed_ids.__contains__)
+        return await asyncio.to_thread(process_feed_poll, snap, feeds, feed, fetcher, parses, checked, entries)
+    except Exception as e:
+        return feed_poll_failed(feed['name'], e)
 
-def validate_regex(pattern):
-    """验证正则表达式是否安全"""
-    if not pattern or len(pattern) > 100:
+def process_feed_poll(snap, feeds, feed, fetcher, parses, checked, entries):
+    """处理一次抓取结果：记录指标，匹配新条目并推送，返回是否抓取成功"""
+    global last_rss_check_time, last_rss_error
+    name = feed['name']
+    metric_fetch_seconds.observe(fetcher.last_fetch_time, feed=name)
+    if fetcher.parses != parses:
+        metric_parse_seconds.observe(fetcher.last_parse_time, feed=name)
+    metric_polls.inc(feed=name, result='ok' if checked else 'error')
+    if not checked:
         return False
-    try:
-        re.compile(pattern)
+
+    last_rss_check_time = datetime.datetime.now()
+    last_rss_error = None
+    if not entries:
+        fetcher.commit()
         return True
-    except:
-        return False
 
-def safe_regex_search(compiled_re, text, timeout_chars=10000):
-    """安全的正则搜索，通过限制文本长度防止 ReDoS"""
-    # 截断过长文本，防止病态输入
-    if len(text) > timeout_chars:
-        text = text[:timeout_chars]
-    try:
-        return bool(compiled_re.search(text))
-    except:
-        return False
+    bot_token = os.environ.get('TG_BOT_TOKEN')
+    if not bot_token: 
+        return True
 
-def check_match(text, pattern, full_word, use_regex, cache):
-    """检查文本是否匹配模式"""
-    if not pattern: 
-        return False
-    if use_regex:
-        if not validate_regex(pattern):
-            logger.warning(f"跳过不安全的正则表达式: {pattern}")
-            return False
+    source_line = f"• <b>来源</b>：{name}\n" if len(feeds) > 1 else ""
+    engine = snap.engine
+    processed_changed = False
+    post_times = []  # 新帖发布时间，用于估计发帖速率
+    archived = []  # 本轮新帖，统一写入归档
+    parsed = []  # (key, EntryText, 标题, 作者, 时间, 链接)
+    match_time = 0.0
+
+    for entry in entries:
+        link = getattr(entry, 'link', '').strip()
+        if not link: 
+            continue
+        # 使用链接中的帖子ID作为key，更稳定
+        key = post_key(link, getattr(entry, 'id', None))
+
+        # 快速跳过已处理的条目，并立即标记为已处理，避免重复
+        if not processed_ids.add(key):
+            continue
+        processed_changed = True
+        metric_entries.inc(feed=name)
+
+        title = getattr(entry, 'title', '').strip()
+        summary = getattr(entry, 'summary', '') or getattr(entry, 'description', '')
+        author = getattr(entry, 'author', '') or getattr(entry, 'dc_creator', '') or 'unknown'
+
+        # 清理HTML标签
+        def clean_html(t): 
+            return re.sub(r'<[^>]+>', '', t).strip()
+        title = clean_html(title)
+        summary = clean_html(summary)
+        author = clean_html(author)
+        
+        # 解析发布时间
+        pub_date_str = ""
+        published = None
         try:
-            if pattern not in cache: 
-                cache[pattern] = re.compile(pattern, re.IGNORECASE)
-            return safe_regex_search(cache[pattern], text)
+            if hasattr(entry, 'published_parsed') and entry.published_parsed:
+                dt_utc = datetime.datetime(*entry.published_parsed[:6])
+                dt_bj = dt_utc + datetime.timedelta(hours=8)
+                pub_date_str = dt_bj.strftime('%Y-%m-%d %H:%M:%S')
+                published = calendar.timegm(entry.published_parsed)
+            elif hasattr(entry, 'updated_parsed') and entry.updated_parsed:
+                dt_utc = datetime.datetime(*entry.updated_parsed[:6])
+                dt_bj = dt_utc + datetime.timedelta(hours=8)
+                pub_date_str = dt_bj.strftime('%Y-%m-%d %H:%M:%S')
+                published = calendar.timegm(entry.updated_parsed)
         except Exception as e:
-            logger.error(f"正则匹配失败: {e}")
-            return False
-    if full_word:
-        if pattern not in cache: 
-            cache[pattern] = re.compile(rf"\b{re.escape(pattern)}\b", re.IGNORECASE)
-        return bool(cache[pattern].search(text))
-    return pattern in text
-
-def restart_program(reason):
-    """重启程序"""
+            logger.debug(f"解析发布时间失败: {e}")
+        if published is not None:
+            post_times.append(published)
+        if archive is not None:
+            archived.append(ArchivedPost(key, name, title, summary, author, link, published))
+        
+        parsed.append((key, EntryText(title, summary), title, author, pub_date_str, link))
+
+    # 深度匹配：通过预筛的帖子并发抓取正文（没有用户开启时不产生任何额外开销）
+    if engine.deep_users and parsed:
+        need = [(key, link) for key, text, _, _, _, link in parsed if engine.needs_body(text, name)]
+        if need:
+            with metric_body_seconds.time(feed=name):
+                bodies = get_body_fetcher().fetch_many(need)
+            for key, text, *_ in parsed:
+                text.set_body(bodies.get(key))
+
+    if shard_pool is not None:
+        # 分片模式：规范化后的条目发布给所有工作进程，由负责各用户的进程匹配和推送
+        shard_pool.publish(name, source_line, [ShardEntry(*p[1:]) for p in parsed])
+        if recent_entries is not None:
+            for key, text, title, author, pub_date_str, link in parsed:
+                # 命中情况只有工作进程知道，回溯时可能重复推送
+                recent_entries.add(RecentEntry(text, name, title, author, pub_date_str, link, frozenset()))
+        parsed = []
+
+    for key, text, title, author, pub_date_str, link in parsed:
+        # 规范化一次，一次扫描得到所有命中的 (chat_id, 规则)
+        t0 = time.perf_counter()
+        hits = engine.match(text, feed=name)
+        match_time += time.perf_counter() - t0
+        if recent_entries is not None:
+            recent_entries.add(RecentEntry(text, name, title, author, pub_date_str, link,
+                                           frozenset(c for c, _ in hits)))
+        for chat_id, matched_rules in hits:
+            kws_str = ", ".join(matched_rules)
+            msg = format_hit(title, kws_str, author, pub_date_str, source_line, link)
+            def on_done(ok, chat_id=chat_id, title=title, kws_str=kws_str):
+                if ok:
+                    logger.info(f"向用户 {chat_id} 推送: {title} (规则: {kws_str})")
+            settings = snap.users[chat_id].get('settings', {})
+            if settings.get('digest'):
+                get_digest_buffer().add(chat_id, msg, settings.get('digest_window', 60), on_done)
+            else:
+                get_dispatcher().submit(chat_id, msg, on_done=on_done)
+
+    # 保存已处理ID
+    if processed_changed: 
+        save_processed()
+    if archived:
+        # 归档只是附加功能，写入失败不能算作抓取失败（否则会跳过 commit 并触发退避）
+        try:
+            archive.add_many(archived)
+        except Exception as e:
+            logger.error(f"写入归档失败 ({name}): {e}")
+    metric_match_seconds.observe(match_time, feed=name)
+    if post_times and feed_scheduler is not None:
+        feed_scheduler.record_posts(name, post_times)
+    fetcher.commit()
+    return True
+
+def restart_program(reason, drain_timeout=30):
+    """重启程序：先停止抓取并发送完队列中的通知，避免丢失推送"""
     logger.info(f"重启: {reason}")
+    try:
+        if feed_scheduler is not None:
+            feed_scheduler.stop()
+        if digest_buffer is not None:
+            digest_buffer.flush(force=True)
+        if dispatcher is not None and not dispatcher.drain(drain_timeout):
+            logger.warning(f"重启前未能发送完队列中的通知（剩余 {dispatcher.pending()} 条）")
+        if shard_pool is not None:
+            shard_pool.stop(drain_timeout)
+        save_processed()
+        if webhook_server is not None:
+            webhook_server.stop()
+    except Exception as e:
+        logger.error(f"重启前清理失败: {e}")
     os.execv(sys.executable, [sys.executable] + sys.argv)
 
 def monitor_loop():
-    """监控循环"""
+    """监控循环：按各订阅源的间隔并发抓取（FEED_WORKERS 控制并发数）"""
+    global feed_scheduler
     logger.info("启动 RSS 监控循环")
+    feed_scheduler = FeedScheduler(check_rss_feed, workers=int(os.environ.get('FEED_WORKERS', '4')))
+    max_hours = float(os.environ.get('RESTART_MAX_HOURS', '24'))
+    max_mem = float(os.environ.get('RESTART_MAX_MEM_MB', '800'))
     error_count = 0
     while True:
         try:
-            check_rss_feed()
+            feed_scheduler.sync(get_feeds(config_snapshot.system))
+            wait = feed_scheduler.run_due()
             error_count = 0
         except Exception as e:
             error_count += 1
+            wait = 5
             logger.error(f"监控循环错误: {e}")
             if error_count >= 15: 
                 restart_program("连续错误过多")
             
+        if mem_diag is not None:
+            try:
+                mem_diag.sample()
+            except Exception as e:
+                logger.warning(f"内存诊断采样失败: {e}")
+
+        if archive is not None:
+            try:
+                archive.maybe_prune()
+            except Exception as e:
+                logger.warning(f"归档清理失败: {e}")
+
+        reason = maintenance_restart_reason(max_hours, max_mem)
+        if reason:
+            restart_program(reason)
+
+        # 抓取中的订阅源完成后才有下次到期时间，因此最多等待 5 秒再检查一次
+        time.sleep(min(max(wait, 0.5), 5))
+
+def maintenance_restart_reason(max_hours, max_mem):
+    """维护重启阈值：RESTART_MAX_HOURS / RESTART_MAX_MEM_MB，设为 0 关闭；需要重启时返回原因"""
+    if shard_pool is not None and shard_pool.dead():
+        # 工作进程退出后其用户收不到推送，整体重启重新创建
+        return f"分片工作进程退出: {shard_pool.dead()}"
+    try:
+        proc = psutil.Process()
+        mem = proc.memory_info().rss / 1024 / 1024
+        uptime_h = (datetime.datetime.now() - start_time).total_seconds() / 3600
+        if (0 < max_hours < uptime_h) or (0 < max_mem < mem): 
+            return f"维护重启 (Mem:{mem:.0f}MB, Time:{uptime_h:.1f}h)"
+    except Exception as e:
+        logger.warning(f"获取进程信息失败: {e}")
+    return None
+
+# --- 事件循环模式（RUN_MODE=async） ---
+async def restart_program_async(reason, drain_timeout=30):
+    """restart_program() 的协程版本：在事件循环中等待抓取结束、通知发完"""
+    logger.info(f"重启: {reason}")
+    try:
+        if feed_scheduler is not None:
+            await feed_scheduler.stop_async()
+        if digest_buffer is not None:
+            digest_buffer.flush(force=True)
+        if dispatcher is not None and not await dispatcher.drain_async(drain_timeout):
+            logger.warning(f"重启前未能发送完队列中的通知（剩余 {dispatcher.pending()} 条）")
+        if shard_pool is not None:
+            await asyncio.to_thread(shard_pool.stop, drain_timeout)
+        save_processed()
+        if webhook_server is not None:
+            webhook_server.stop()
+    except Exception as e:
+        logger.error(f"重启前清理失败: {e}")
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+async def telegram_update_poller(client, bot_token):
+    """长轮询接收命令（协程），命令交给按会话分区的线程池处理"""
+    await asyncio.to_thread(disable_telegram_webhook, bot_token)
+    await asyncio.to_thread(set_telegram_bot_commands, bot_token)
+    offset = 0
+    while True:
         try:
-            proc = psutil.Process()
-            mem = proc.memory_info().rss / 1024 / 1024
-            uptime_h = (datetime.datetime.now() - start_time).total_seconds() / 3600
-            if uptime_h > 24 or mem > 800: 
-                restart_program(f"维护重启 (Mem:{mem:.0f}MB, Time:{uptime_h:.1f}h)")
+            resp = await api_request_async(client, bot_token, "getUpdates", http_method='GET',
+                                           params={"timeout": 60, "offset": offset}, timeout=65)
+            data = resp.json() if resp.status_code == 200 else {}
+            if not data.get("ok"):
+                await asyncio.sleep(5)
+                continue
+            for update in data.get("result", []):
+                offset = update["update_id"] + 1
+                dispatch_update(update, bot_token)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.warning(f"获取进程信息失败: {e}")
+            logger.error(f"指令监听异常: {e}")
+            await asyncio.sleep(5)
 
-        sys_conf = global_config.get('system', {})
-        mn = sys_conf.get('check_min_interval', 30)
-        mx = sys_conf.get('check_max_interval', 60)
-        wait = random.uniform(mn, mx)
-        logger.info(f"等待 {wait:.1f}s ...")
-        time.sleep(wait)
+async def async_monitor_loop():
+    """monitor_loop() 的协程版本：每次抓取是一个任务，阻塞的维护操作放到线程中"""
+    logger.info("启动 RSS 监控循环（事件循环模式）")
+    max_hours = float(os.environ.get('RESTART_MAX_HOURS', '24'))
+    max_mem = float(os.environ.get('RESTART_MAX_MEM_MB', '800'))
+    error_count = 0
+    while True:
+        try:
+            feed_scheduler.sync(get_feeds(config_snapshot.system))
+            wait = feed_scheduler.run_due()
+            error_count = 0
+        except Exception as e:
+            error_count += 1
+            wait = 5
+            logger.error(f"监控循环错误: {e}")
+            if error_count >= 15: 
+                await restart_program_async("连续错误过多")
+
+        if mem_diag is not None:
+            try:
+                await asyncio.to_thread(mem_diag.sample)
+            except Exception as e:
+                logger.warning(f"内存诊断采样失败: {e}")
+
+        if archive is not None:
+            try:
+                await asyncio.to_thread(archive.maybe_prune)
+            except Exception as e:
+                logger.warning(f"归档清理失败: {e}")
+
+        reason = maintenance_restart_reason(max_hours, max_mem)
+        if reason:
+            await restart_program_async(reason)
+
+        # 抓取完成时立即重新计算到期时间；最多 5 秒检查一次维护任务
+        await feed_scheduler.wait_next(min(wait, 5))
+
+async def async_main(bot_token, use_webhook=False):
+    """
+    事件循环模式：抓取、推送与命令接收是同一事件循环中的协作任务，每轮抓取结果的匹配与写盘在线程中处理
+    慢速发送或 429 退避只推迟对应会话的发送协程，不占用配置锁、不阻塞抓取
+    """
+    global async_mode, dispatcher, feed_scheduler
+    async_mode = True
+    tg_client = create_async_client()
+    rss_client = create_async_client(follow_redirects=True)
+    dispatcher = AsyncDispatcher(
+        lambda chat_id, text, reply_to: telegram_send_once_async(tg_client, bot_token, chat_id, text, reply_to),
+        workers=int(os.environ.get('TG_DISPATCH_WORKERS', '8')),
+        global_rate=float(os.environ.get('TG_GLOBAL_RATE', '30')),
+    ).start()
+    feed_scheduler = AsyncFeedScheduler(lambda feed: check_rss_feed_async(rss_client, feed),
+                                        workers=int(os.environ.get('FEED_WORKERS', '4')))
+    poller = None
+    if use_webhook:
+        await asyncio.to_thread(start_webhook_server)
+    else:
+        poller = asyncio.get_running_loop().create_task(telegram_update_poller(tg_client, bot_token))
+    try:
+        await async_monitor_loop()
+    finally:
+        if poller is not None:
+            poller.cancel()
+        dispatcher.stop()
+        await tg_client.aclose()
+        await rss_client.aclose()
 
 if __name__ == "__main__":
     if not os.environ.get('TG_BOT_TOKEN'):
         print("错误: 请设置 TG_BOT_TOKEN 环境变量")
         sys.exit(1)
 
+    use_webhook = bool(os.environ.get('TG_WEBHOOK_URL') or os.environ.get('TG_WEBHOOK_LISTEN'))
+    if use_webhook:
+        try:
+            webhook_settings()
+        except ValueError as e:
+            print(f"错误: {e}")
+            sys.exit(1)
+
+    # 内存诊断需在加载配置前开启，才能跟踪到启动阶段的分配
+    if bool_from_text(os.environ.get('MEM_DEBUG', '')):
+        mem_diag = MemoryDiagnostics(os.path.join(DATA_DIR, 'memdebug'),
+                                     interval=int(os.environ.get('MEM_DEBUG_INTERVAL', '300'))).start()
+
     # 初始化全局配置和已处理ID
     load_config()
 
-    # 启动Telegram命令监听线程
-    t = Thread(target=telegram_command_listener, daemon=True)
-    t.start()
-    
-    # 启动监控循环
-    monitor_loop()
\ No newline at end of file
+    # SHARD_WORKERS=N：匹配与推送分散到 N 个工作进程（fork 创建，须在启动其它线程之前）
+    shards = int(os.environ.get('SHARD_WORKERS', '0'))
+    if shards > 1:
+        start_shard_pool(shards)
+
+    # 帖子归档：ARCHIVE_RETENTION_DAYS 天 / ARCHIVE_MAX_MB 上限，ARCHIVE=off 关闭
+    if bool_from_text(os.environ.get('ARCHIVE', 'on')):
+        archive = PostArchive(ARCHIVE_DB,
+                              retention_days=int(os.environ.get('ARCHIVE_RETENTION_DAYS', '90')),
+                              max_mb=int(os.environ.get('ARCHIVE_MAX_MB', '200')))
+
+    backfill_size = int(os.environ.get('BACKFILL_SIZE', '200'))
+    if backfill_size > 0:
+        recent_entries = RecentEntries(backfill_size)
+
+    # 可选的指标端点，例如 METRICS_LISTEN=127.0.0.1:9108
+    metrics_listen = os.environ.get('METRICS_LISTEN', '').strip()
+    if metrics_listen:
+        host, _, port = metrics_listen.rpartition(':')
+        metrics_server = MetricsServer(host or '127.0.0.1', int(port)).start()
+
+    # RUN_MODE=async：单事件循环运行（需要 httpx）
+    run_async = os.environ.get('RUN_MODE', '').strip().lower() == 'async'
+    if run_async and not async_available():
+        logger.error("RUN_MODE=async 需要安装 httpx，改用线程模式运行")
+        run_async = False
+
+    if run_async:
+        asyncio.run(async_main(os.environ['TG_BOT_TOKEN'], use_webhook))
+    else:
+        # 启动Telegram命令接收：webhook 模式或长轮询线程
+        if use_webhook:
+            start_webhook_server()
+        else:
+            t = Thread(target=telegram_command_listener, daemon=True)
+            t.start()
+
+        # 启动监控循环
+        monitor_loop()
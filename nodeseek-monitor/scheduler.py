@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+多订阅源抓取调度
+每个订阅源独立的间隔、抖动与失败退避，使用有界线程池并发抓取
+配置了 min_interval/max_interval 的订阅源按发帖速率自适应调整间隔
+"""
+
+import math
+import time
+import asyncio
+import random
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+RATE_TAU = 900.0            # 速率估计的衰减时间常数（秒）
+POSTS_PER_POLL = 0.5        # 自适应目标：平均每次抓取约有多少条新帖
+MAX_POST_HISTORY = 200
+
+
+class RateEstimator:
+    """按发布时间估计发帖速率（指数衰减加权，越新的帖子权重越大）"""
+
+    def __init__(self, tau=RATE_TAU):
+        self.tau = tau
+        self.times = deque(maxlen=MAX_POST_HISTORY)
+
+    def add(self, timestamps, now=None):
+        now = time.time() if now is None else now
+        for ts in timestamps:
+            # 时钟偏差导致的未来时间按当前时间计
+            self.times.append(min(ts, now))
+
+    def rate(self, now=None):
+        """当前速率估计（帖/秒）"""
+        now = time.time() if now is None else now
+        horizon = self.tau * 8
+        return sum(math.exp(-(now - t) / self.tau) for t in self.times if now - t < horizon) / self.tau
+
+
+class _FeedState:
+    __slots__ = ('feed', 'next_due', 'errors', 'running', 'last_ok', 'last_error', 'rate', 'interval')
+
+    def __init__(self, feed):
+        self.feed = feed
+        self.next_due = 0.0
+        self.errors = 0
+        self.running = False
+        self.last_ok = None
+        self.last_error = None
+        self.rate = RateEstimator()
+        self.interval = None
+
+
+class FeedScheduler:
+    """
+    订阅源调度器
+    run_feed(feed) 返回 True 表示本次抓取成功；失败时按 interval * 2^errors 退避（不超过 max_backoff）
+    run_feed 可通过 record_posts() 上报新帖的发布时间，供自适应间隔使用
+    """
+
+    def __init__(self, run_feed, workers=4):
+        self.run_feed = run_feed
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="feed")
+        self.lock = Lock()
+        self.states = {}
+        self.stopped = False
+
+    def sync(self, feeds):
+        """按名称同步订阅源列表：新增的立即调度，删除的移除，已有的更新参数"""
+        with self.lock:
+            names = set()
+            for feed in feeds:
+                name = feed['name']
+                names.add(name)
+                st = self.states.get(name)
+                if st is None:
+                    self.states[name] = _FeedState(feed)
+                else:
+                    st.feed = feed
+            for name in list(self.states):
+                if name not in names:
+                    del self.states[name]
+
+    def record_posts(self, name, timestamps):
+        """记录订阅源新帖的发布时间（UNIX 时间戳）"""
+        with self.lock:
+            st = self.states.get(name)
+            if st is not None:
+                st.rate.add(timestamps)
+
+    def base_interval(self, st):
+        """
+        基础间隔：固定间隔的订阅源直接返回 interval；
+        自适应订阅源取 POSTS_PER_POLL / 速率，限制在 [min_interval, max_interval] 内
+        """
+        feed = st.feed
+        if 'min_interval' not in feed:
+            return float(feed.get('interval', 30))
+        lo = float(feed['min_interval'])
+        hi = max(lo, float(feed.get('max_interval', lo)))
+        rate = st.rate.rate()
+        target = POSTS_PER_POLL / rate if rate > 0 else hi
+        return min(hi, max(lo, target))
+
+    def next_interval(self, st):
+        """计算下次抓取的等待时间"""
+        feed = st.feed
+        interval = self.base_interval(st)
+        st.interval = interval
+        if st.errors:
+            return min(float(feed.get('max_backoff', 600)), interval * (2 ** st.errors))
+        if 'min_interval' in feed:
+            # 自适应间隔只加少量抖动，避免固定周期
+            return interval * random.uniform(0.9, 1.1)
+        return interval + random.uniform(0, float(feed.get('jitter', 0)))
+
+    def run_due(self):
+        """提交所有到期的订阅源，返回距下一个到期时间的秒数"""
+        now = time.monotonic()
+        wait = 60.0
+        with self.lock:
+            if self.stopped:
+                return wait
+            for st in self.states.values():
+                if st.running:
+                    continue
+                if st.next_due <= now:
+                    st.running = True
+                    self._submit(st)
+                else:
+                    wait = min(wait, st.next_due - now)
+        return max(0.0, wait)
+
+    def stop(self, wait=True):
+        """停止调度新的抓取，wait 时等待正在进行的抓取完成"""
+        with self.lock:
+            self.stopped = True
+        self.pool.shutdown(wait=wait)
+
+    def _submit(self, st):
+        self.pool.submit(self._run, st)
+
+    def _run(self, st):
+        ok = False
+        try:
+            ok = bool(self.run_feed(st.feed))
+        except Exception as e:
+            logger.error(f"订阅源 {st.feed.get('name')} 抓取异常: {e}")
+            st.last_error = str(e)
+        self._finish(st, ok)
+
+    def _finish(self, st, ok):
+        with self.lock:
+            st.running = False
+            if ok:
+                st.errors = 0
+                st.last_ok = time.time()
+            else:
+                st.errors += 1
+            st.next_due = time.monotonic() + self.next_interval(st)
+
+    def status_text(self):
+        """各订阅源状态（用于 /status）"""
+        now = time.monotonic()
+        wall = time.time()
+        lines = []
+        with self.lock:
+            for name, st in self.states.items():
+                if st.running:
+                    nxt = "抓取中"
+                else:
+                    left = max(0, st.next_due - now)
+                    nxt = f"{time.strftime('%H:%M:%S', time.localtime(wall + left))} ({left:.0f}s 后)"
+                err = f" 连续失败 {st.errors}" if st.errors else ""
+                rate = f"速率 {st.rate.rate() * 60:.2f} 帖/分"
+                if 'min_interval' in st.feed and st.interval is not None:
+                    rate += f" | 间隔 {st.interval:.0f}s"
+                lines.append(f"{name}: {rate} | 下次 {nxt}{err}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+class AsyncFeedScheduler(FeedScheduler):
+    """
+    事件循环中的订阅源调度器：间隔/退避/自适应规则与 FeedScheduler 相同
+    run_feed 为协程函数，每次抓取是一个任务，并发数由信号量限制
+    """
+
+    def __init__(self, run_feed, workers=4):
+        self.run_feed = run_feed
+        self.lock = Lock()
+        self.states = {}
+        self.stopped = False
+        self.semaphore = asyncio.Semaphore(max(1, workers))
+        self.tasks = set()
+        self.finished = asyncio.Event()  # 有抓取完成（产生了新的到期时间）
+
+    def _submit(self, st):
+        task = asyncio.get_running_loop().create_task(self._run_async(st))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run_async(self, st):
+        ok = False
+        try:
+            async with self.semaphore:
+                ok = bool(await self.run_feed(st.feed))
+        except Exception as e:
+            logger.error(f"订阅源 {st.feed.get('name')} 抓取异常: {e}")
+            st.last_error = str(e)
+        self._finish(st, ok)
+        self.finished.set()
+
+    async def wait_next(self, timeout):
+        """等待 timeout 秒，或提前在有抓取完成时返回"""
+        try:
+            await asyncio.wait_for(self.finished.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.finished.clear()
+
+    def stop(self, wait=True):
+        """停止调度新的抓取（等待进行中的抓取请使用 stop_async）"""
+        with self.lock:
+            self.stopped = True
+
+    async def stop_async(self, timeout=30):
+        """停止调度新的抓取，并等待正在进行的抓取完成"""
+        with self.lock:
+            self.stopped = True
+        if self.tasks:
+            await asyncio.wait(list(self.tasks), timeout=timeout)
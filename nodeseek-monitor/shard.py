@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+订阅者分片（SHARD_WORKERS=N）
+- 主进程负责抓取、解析、规范化（每条帖子只处理一次），把条目批量发布给所有工作进程
+- 工作进程按 crc32(chat_id) % N 负责一部分用户：各自维护匹配引擎、推送分发器和合并缓冲，匹配与发送可利用多核
+- 配置变更只发送给负责该用户的工作进程；Telegram 全局限速按进程数平分
+- 工作进程由 fork 创建，须在启动其它线程之前调用 start()；日志经队列交回主进程写入（只有主进程轮转日志文件）
+- 每个分片都要反序列化并扫描全部条目，只有按用户划分的规则判定与发送被分摊，分片数不宜超过 CPU 核数
+- 工作进程中的计数器（如 Telegram 429 次数）随统计回报，增量并入主进程的 /metrics；
+  推送成功/失败数由 totals() 汇总；/status 中的 Telegram 接口耗时只统计主进程自己的请求
+"""
+
+import os
+import time
+import zlib
+import pickle
+import logging
+import multiprocessing
+from logging.handlers import QueueHandler
+from collections import namedtuple
+from queue import Empty
+from threading import Thread, Lock
+
+from matcher import MatchEngine, regex_guard, regex_owners
+from metrics import registry
+from dispatcher import NotificationDispatcher, DigestBuffer, format_hit, format_regex_disabled
+
+logger = logging.getLogger(__name__)
+
+# 发布给工作进程的条目：text 为已规范化（可能含正文）的 EntryText
+ShardEntry = namedtuple('ShardEntry', ['text', 'title', 'author', 'pub_date', 'link'])
+
+
+def shard_of(chat_id, shards):
+    """用户所属的工作进程编号（与 KeyedWorkerPool 的分区方式一致）"""
+    return zlib.crc32(str(chat_id).encode()) % shards
+
+
+def _counter_delta(new, old):
+    """两次 counter_values() 之差（只保留非零项）"""
+    delta = {}
+    for name, values in new.items():
+        base = old.get(name, {})
+        changed = {k: v - base.get(k, 0) for k, v in values.items() if v != base.get(k, 0)}
+        if changed:
+            delta[name] = changed
+    return delta
+
+
+class _ShardWorker:
+    """工作进程内的状态：本分片的用户配置、匹配引擎与推送"""
+
+    def __init__(self, index, send_once, dispatch_options):
+        self.index = index
+        self.users = {}
+        self.engine = MatchEngine({})
+        self.dispatcher = NotificationDispatcher(send_once, **dispatch_options).start()
+        self.digest = None
+        # 本进程的正则由本分片的用户使用，暂停通知只发给他们
+        regex_guard.on_disabled = self._regex_disabled
+        # 统计；计数器从 fork 时继承的主进程数值开始，只回报本进程新增的部分
+        self.counter_base = registry.counter_values()
+        self.entries = 0
+        self.matched = 0
+        self.match_time = 0.0
+
+    def handle(self, msg):
+        kind = msg[0]
+        if kind == 'users':
+            self.users = msg[1]
+            self.engine = MatchEngine(self.users)
+        elif kind == 'events':
+            _, events, changed = msg
+            users = dict(self.users)
+            for chat_id, conf in changed.items():
+                if conf is None:
+                    users.pop(chat_id, None)
+                else:
+                    users[chat_id] = conf
+            self.users = users
+            self.engine = self.engine.apply(events, users)
+        elif kind == 'entries':
+            feed, source_line, items = pickle.loads(msg[1])
+            for e in items:
+                self._deliver(feed, source_line, e)
+
+    def _deliver(self, feed, source_line, e):
+        t0 = time.perf_counter()
+        hits = self.engine.match(e.text, feed=feed)
+        self.match_time += time.perf_counter() - t0
+        self.entries += 1
+        for chat_id, matched_rules in hits:
+            self.matched += 1
+            kws_str = ", ".join(matched_rules)
+            msg = format_hit(e.title, kws_str, e.author, e.pub_date, source_line, e.link)
+            def on_done(ok, chat_id=chat_id, title=e.title, kws_str=kws_str):
+                if ok:
+                    logger.info(f"[分片 {self.index}] 向用户 {chat_id} 推送: {title} (规则: {kws_str})")
+            settings = self.users[chat_id].get('settings', {})
+            if settings.get('digest'):
+                if self.digest is None:
+                    self.digest = DigestBuffer(self.dispatcher).start()
+                self.digest.add(chat_id, msg, settings.get('digest_window', 60), on_done)
+            else:
+                self.dispatcher.submit(chat_id, msg, on_done=on_done)
+
+    def _regex_disabled(self, pattern):
+        for chat_id in regex_owners(self.users, pattern):
+            self.dispatcher.submit(chat_id, format_regex_disabled(pattern, regex_guard.ttl))
+
+    def stop(self, timeout):
+        """发送完队列中的通知（重启前调用）"""
+        if self.digest is not None:
+            self.digest.flush(force=True)
+        if not self.dispatcher.drain(timeout):
+            logger.warning(f"[分片 {self.index}] 未能发送完队列中的通知（剩余 {self.dispatcher.pending()} 条）")
+
+    def stats(self):
+        d = self.dispatcher
+        return ('stats', self.index, {
+            'users': len(self.users),
+            'entries': self.entries,
+            'matched': self.matched,
+            'match_time': self.match_time,
+            'sent': d.sent,
+            'failed': d.failed,
+            'rate_limited': d.rate_limited,
+            'pending': d.pending() + (self.digest.pending() if self.digest else 0),
+        }, _counter_delta(registry.counter_values(), self.counter_base))
+
+
+def _worker_main(index, inbox, outbox, log_queue, send_once, dispatch_options, stats_interval):
+    """工作进程入口：按顺序处理收件队列，定期回报统计"""
+    # fork 继承的日志处理器（含 RotatingFileHandler）不能在多个进程中使用，改为发回主进程
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(QueueHandler(log_queue))
+    worker = _ShardWorker(index, send_once, dispatch_options)
+    parent = os.getppid()
+    last_stats = 0.0
+    while True:
+        try:
+            msg = inbox.get(timeout=stats_interval)
+        except Empty:
+            if os.getppid() != parent:
+                # 主进程已被强制结束，不再有新条目
+                return
+            msg = None
+        if msg is not None and msg[0] == 'stop':
+            worker.stop(msg[1])
+            outbox.put(worker.stats())
+            return
+        if msg is not None:
+            try:
+                worker.handle(msg)
+            except Exception as e:
+                logger.error(f"[分片 {index}] 处理消息失败 ({msg[0]}): {e}")
+        now = time.monotonic()
+        if now - last_stats >= stats_interval:
+            outbox.put(worker.stats())
+            last_stats = now
+
+
+class ShardPool:
+    """
+    主进程侧的分片管理
+    send_once 与其余参数传给各工作进程的 NotificationDispatcher（global_rate 为所有进程合计）
+    """
+
+    def __init__(self, shards, send_once, global_rate=30, stats_interval=2.0, **dispatch_options):
+        ctx = multiprocessing.get_context('fork')
+        self.shards = max(1, int(shards))
+        self.inboxes = [ctx.Queue() for _ in range(self.shards)]
+        self.outbox = ctx.Queue()
+        self.log_queue = ctx.Queue()
+        dispatch_options['global_rate'] = global_rate / self.shards
+        self.procs = [
+            ctx.Process(target=_worker_main, name=f"shard-{i}", daemon=True,
+                        args=(i, self.inboxes[i], self.outbox, self.log_queue, send_once, dispatch_options,
+                              stats_interval))
+            for i in range(self.shards)
+        ]
+        self.lock = Lock()
+        self.stats = [{} for _ in range(self.shards)]
+        self.counters = [{} for _ in range(self.shards)]  # 各工作进程已并入本进程注册表的计数
+        self.published = 0
+
+    def start(self):
+        """启动工作进程与统计收集线程"""
+        for p in self.procs:
+            p.start()
+        Thread(target=self._collect, name="shard-stats", daemon=True).start()
+        Thread(target=self._forward_logs, name="shard-logs", daemon=True).start()
+        logger.info(f"已启动 {self.shards} 个分片工作进程")
+        cpus = os.cpu_count() or 1
+        if self.shards > cpus:
+            logger.warning(f"分片数 {self.shards} 超过 CPU 核数 {cpus}，多出的进程只会争抢 CPU")
+        return self
+
+    def _forward_logs(self):
+        """把工作进程的日志记录交给主进程的日志处理器"""
+        while True:
+            try:
+                record = self.log_queue.get()
+                logging.getLogger(record.name).handle(record)
+            except Exception as e:
+                logger.error(f"转发分片日志失败: {e}")
+                time.sleep(1)
+
+    def _collect(self):
+        while True:
+            try:
+                _, index, stats, counters = self.outbox.get()
+                with self.lock:
+                    self.stats[index] = stats
+                    delta = _counter_delta(counters, self.counters[index])
+                    self.counters[index] = counters
+                registry.add_counts(delta)
+            except Exception as e:
+                logger.error(f"接收分片统计失败: {e}")
+                time.sleep(1)
+
+    def load_users(self, users):
+        """全量下发用户配置（按分片拆分）"""
+        parts = [{} for _ in range(self.shards)]
+        for chat_id, conf in users.items():
+            parts[shard_of(chat_id, self.shards)][chat_id] = conf
+        for q, part in zip(self.inboxes, parts):
+            q.put(('users', part))
+
+    def apply(self, events, users):
+        """增量下发配置变更：事件及相关用户的最新配置（已删除为 None）只发给所属分片"""
+        parts = [([], {}) for _ in range(self.shards)]
+        for e in events:
+            part_events, changed = parts[shard_of(e.chat_id, self.shards)]
+            part_events.append(e)
+            changed[e.chat_id] = users.get(e.chat_id)
+        for q, (part_events, changed) in zip(self.inboxes, parts):
+            if part_events:
+                q.put(('events', part_events, changed))
+
+    def publish(self, feed, source_line, items):
+        """把一批 ShardEntry 发布给所有工作进程"""
+        if not items:
+            return
+        # 只序列化一次，各队列传递同一份字节串
+        msg = ('entries', pickle.dumps((feed, source_line, items), pickle.HIGHEST_PROTOCOL))
+        for q in self.inboxes:
+            q.put(msg)
+        self.published += len(items)
+
+    def dead(self):
+        """已退出的工作进程编号"""
+        return [i for i, p in enumerate(self.procs) if not p.is_alive()]
+
+    def totals(self):
+        """各分片统计之和"""
+        result = {}
+        with self.lock:
+            for stats in self.stats:
+                for k, v in stats.items():
+                    result[k] = result.get(k, 0) + v
+        return result
+
+    def stop(self, timeout=30):
+        """通知工作进程发送完队列后退出，最多等待 timeout 秒"""
+        for q in self.inboxes:
+            q.put(('stop', timeout))
+        deadline = time.monotonic() + timeout + 5
+        for p in self.procs:
+            p.join(max(0.1, deadline - time.monotonic()))
+            if p.is_alive():
+                logger.warning(f"分片工作进程 {p.name} 未能按时退出")
+                p.terminate()
+
+    def status_text(self):
+        """统计信息（用于 /status）"""
+        with self.lock:
+            stats = list(self.stats)
+        dead = set(self.dead())
+        lines = [f"分片: {self.shards} 个工作进程 | 已发布 {self.published} 条"]
+        for i, s in enumerate(stats):
+            state = "已退出" if i in dead else f"用户 {s.get('users', 0)}"
+            lines.append(
+                f"  #{i} {state} | 匹配 {s.get('entries', 0)} 条 / 命中 {s.get('matched', 0)} "
+                f"| 已发送 {s.get('sent', 0)} / 失败 {s.get('failed', 0)} / 排队 {s.get('pending', 0)}"
+            )
+        return "\n".join(lines) + "\n"
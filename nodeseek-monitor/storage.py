@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+配置存储后端
+- SqliteStorage：默认后端，WAL 模式，每个用户一行，单用户修改为独立事务
+- JsonStorage：兼容后端，整体读写 config.json
+"""
+
+import os
+import copy
+import json
+import sqlite3
+import logging
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class JsonStorage:
+    """
+    整体读写 JSON 文件的存储后端（任何修改都重写整个文件）
+    内部持有独立的配置副本，修改与写文件在同一把锁内完成（命令可能在多个线程中并发提交）
+    """
+
+    name = 'json'
+
+    def __init__(self, path, load_json, save_json, default):
+        self.path = path
+        self.load_json = load_json
+        self.save_json = save_json
+        self.default = default
+        self.lock = Lock()
+        self.config = None
+
+    def load(self):
+        """加载完整配置 {system, users}"""
+        with self.lock:
+            self.config = self.load_json(self.path, self.default)
+            return copy.deepcopy(self.config)
+
+    def save_all(self, config):
+        with self.lock:
+            self.config = copy.deepcopy(config)
+            self.save_json(self.path, self.config)
+
+    def save_user(self, chat_id, user_conf):
+        with self.lock:
+            self.config.setdefault('users', {})[chat_id] = copy.deepcopy(user_conf)
+            self.save_json(self.path, self.config)
+
+    def save_system(self, system):
+        with self.lock:
+            self.config['system'] = copy.deepcopy(system)
+            self.save_json(self.path, self.config)
+
+
+class SqliteStorage:
+    """SQLite 存储后端：system 为键值表，users 每个会话一行"""
+
+    name = 'sqlite'
+
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS system (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "chat_id TEXT PRIMARY KEY, config TEXT NOT NULL, "
+            "updated_at REAL NOT NULL DEFAULT (strftime('%s','now')))"
+        )
+        if json_path:
+            self._migrate(json_path)
+
+    def _migrate(self, json_path):
+        """首次启动时从 config.json 一次性迁移"""
+        if not os.path.exists(json_path):
+            return
+        with self.lock:
+            has_data = self.conn.execute(
+                "SELECT EXISTS(SELECT 1 FROM users) OR EXISTS(SELECT 1 FROM system)").fetchone()[0]
+        if has_data:
+            return
+        # 读取或写入失败时抛出异常并保留 config.json，避免以空配置启动后再也无法迁移
+        with open(json_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        self._transaction(self._all_statements(config))
+        os.replace(json_path, json_path + '.migrated')
+        logger.info(f"已从 {json_path} 迁移 {len(config.get('users', {}))} 个用户配置到 SQLite")
+
+    def load(self):
+        """加载完整配置 {system, users}"""
+        with self.lock:
+            system = {k: json.loads(v) for k, v in self.conn.execute("SELECT key, value FROM system")}
+            users = {c: json.loads(v) for c, v in self.conn.execute("SELECT chat_id, config FROM users ORDER BY rowid")}
+        return {'system': system, 'users': users}
+
+    def _transaction(self, statements):
+        """在一个事务中执行，失败时回滚并抛出异常"""
+        with self.lock:
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        self.conn.executemany(sql, params)
+                    else:
+                        self.conn.execute(sql, params)
+                self.conn.execute("COMMIT")
+            except Exception:
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                raise
+
+    def _write(self, statements):
+        try:
+            self._transaction(statements)
+        except Exception as e:
+            logger.error(f"写入 {self.path} 失败: {e}")
+
+    @staticmethod
+    def _all_statements(config):
+        return [
+            ("DELETE FROM system", ()),
+            ("INSERT INTO system (key, value) VALUES (?, ?)",
+             [(k, json.dumps(v, ensure_ascii=False)) for k, v in config.get('system', {}).items()]),
+            ("DELETE FROM users", ()),
+            ("INSERT INTO users (chat_id, config) VALUES (?, ?)",
+             [(c, json.dumps(u, ensure_ascii=False)) for c, u in config.get('users', {}).items()]),
+        ]
+
+    def save_all(self, config):
+        self._write(self._all_statements(config))
+
+    def save_user(self, chat_id, user_conf):
+        self._write([(
+            "INSERT INTO users (chat_id, config) VALUES (?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET config = excluded.config, updated_at = strftime('%s','now')",
+            (chat_id, json.dumps(user_conf, ensure_ascii=False)),
+        )])
+
+    def save_system(self, system):
+        self._write([(
+            "INSERT INTO system (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            [(k, json.dumps(v, ensure_ascii=False)) for k, v in system.items()],
+        )])
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Telegram Bot API 连接层
+- 进程内共享的连接池会话（keep-alive），避免每次请求重新握手
+- 安装了 httpx[http2] 时使用 HTTP/2，否则使用 requests 连接池
+- 事件循环模式使用 httpx.AsyncClient
+- 按 API 方法统计请求延迟
+"""
+
+import os
+import time
+import logging
+from collections import deque
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    _has_h2 = True
+except ImportError:
+    _has_h2 = False
+
+logger = logging.getLogger(__name__)
+
+API_BASE = "https://api.telegram.org"
+POOL_SIZE = int(os.environ.get('TG_POOL_SIZE', '20'))
+USE_HTTP2 = os.environ.get('TG_HTTP2', 'on').strip().lower() in ('on', 'true', '1', 'yes', 'y')
+
+_session = None
+_session_lock = Lock()
+
+
+def get_session():
+    """获取共享会话（惰性创建）"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def _create_session():
+    if httpx is not None and _has_h2 and USE_HTTP2:
+        logger.info(f"Telegram API 使用 HTTP/2 连接池 (pool={POOL_SIZE})")
+        limits = httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE)
+        return httpx.Client(http2=True, limits=limits)
+    logger.info(f"Telegram API 使用 HTTP/1.1 keep-alive 连接池 (pool={POOL_SIZE})")
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+    s.mount("https://", adapter)
+    return s
+
+
+class LatencyStats:
+    """按 API 方法统计的请求延迟"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self.lock = Lock()
+        self.methods = {}  # method -> {'count', 'errors', 'total', 'max', 'recent'}
+
+    def record(self, method, seconds, ok=True):
+        with self.lock:
+            st = self.methods.get(method)
+            if st is None:
+                st = {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0, 'recent': deque(maxlen=self.window)}
+                self.methods[method] = st
+            st['count'] += 1
+            if not ok:
+                st['errors'] += 1
+            st['total'] += seconds
+            st['max'] = max(st['max'], seconds)
+            st['recent'].append(seconds)
+
+    def summary(self):
+        """返回 {method: (count, errors, avg_ms, p50_ms, p95_ms, max_ms)}"""
+        out = {}
+        with self.lock:
+            for method, st in self.methods.items():
+                recent = sorted(st['recent'])
+                if not recent:
+                    continue
+                p50 = recent[len(recent) // 2]
+                p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))]
+                out[method] = (st['count'], st['errors'], st['total'] / st['count'] * 1000,
+                               p50 * 1000, p95 * 1000, st['max'] * 1000)
+        return out
+
+    def status_text(self):
+        """统计信息（用于 /status）"""
+        lines = []
+        for method, (count, errors, avg, p50, p95, mx) in sorted(self.summary().items()):
+            if method == 'getUpdates':
+                continue  # 长轮询耗时没有参考意义
+            lines.append(f"{method}: {count} 次 (失败 {errors}) 平均 {avg:.0f}ms p50 {p50:.0f}ms p95 {p95:.0f}ms")
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+latency_stats = LatencyStats()
+
+
+def api_request(bot_token, method, http_method='POST', timeout=10, **kwargs):
+    """
+    调用 Bot API，返回响应对象（status_code / json() / content）
+    kwargs 透传 data / json / params；网络异常照常抛出
+    """
+    url = f"{API_BASE}/bot{bot_token}/{method}"
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        resp = get_session().request(http_method, url, timeout=timeout, **kwargs)
+        ok = resp.status_code == 200
+        return resp
+    finally:
+        latency_stats.record(method, time.perf_counter() - t0, ok)
+
+
+def async_available():
+    """是否可以使用事件循环模式（需要 httpx）"""
+    return httpx is not None
+
+
+def create_async_client(pool_size=POOL_SIZE, **kwargs):
+    """创建 httpx.AsyncClient（事件循环模式使用，需要安装 httpx）"""
+    if httpx is None:
+        raise RuntimeError("事件循环模式需要安装 httpx: pip install 'httpx[http2]'")
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+    return httpx.AsyncClient(http2=USE_HTTP2 and _has_h2, limits=limits, **kwargs)
+
+
+async def api_request_async(client, bot_token, method, http_method='POST', timeout=10, **kwargs):
+    """api_request() 的协程版本，client 为 create_async_client() 创建的客户端"""
+    url = f"{API_BASE}/bot{bot_token}/{method}"
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        resp = await client.request(http_method, url, timeout=timeout, **kwargs)
+        ok = resp.status_code == 200
+        return resp
+    finally:
+        latency_stats.record(method, time.perf_counter() - t0, ok)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Webhook 接收服务
+基于标准库 http.server，接收 Telegram 推送的更新，校验 secret token 后交给命令处理器
+"""
+
+import hmac
+import json
+import logging
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_BODY = 1024 * 1024
+
+
+class WebhookServer:
+    """接收 Telegram webhook 更新的轻量 HTTP 服务"""
+
+    def __init__(self, host, port, secret, on_update, path='/'):
+        self.secret = secret or ''
+        self.on_update = on_update
+        self.path = path
+        self.received = 0
+        self.rejected = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                logger.debug("webhook: " + fmt % args)
+
+            def _reply(self, code):
+                self.send_response(code)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_POST(self):
+                if self.path.split('?', 1)[0] != server.path:
+                    return self._reply(404)
+                token = self.headers.get(SECRET_HEADER, '')
+                # 按字节比较：header 中含非 ASCII 字符时 compare_digest(str, str) 会抛出 TypeError
+                if server.secret and not hmac.compare_digest(token.encode(), server.secret.encode()):
+                    server.rejected += 1
+                    logger.warning(f"webhook 拒绝请求：secret token 不匹配 ({self.client_address[0]})")
+                    return self._reply(403)
+                length = int(self.headers.get('Content-Length') or 0)
+                if length <= 0 or length > MAX_BODY:
+                    return self._reply(400)
+                try:
+                    update = json.loads(self.rfile.read(length))
+                except Exception:
+                    return self._reply(400)
+                server.received += 1
+                # 先应答再处理：命令处理在线程池中异步进行
+                self._reply(200)
+                try:
+                    server.on_update(update)
+                except Exception as e:
+                    logger.error(f"webhook 更新处理异常: {e}")
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def start(self):
+        """在后台线程中启动服务"""
+        Thread(target=self.httpd.serve_forever, name="webhook", daemon=True).start()
+        logger.info(f"webhook 服务已启动: {self.address[0]}:{self.address[1]}{self.path}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()